@@ -0,0 +1,332 @@
+"""
+Асинхронные обработчики частых запросов на чтение для работы под
+ASGI-сервером (см. foodgram/asgi.py): список рецептов и рецепт, теги,
+поиск ингредиентов и выгрузка списка покупок. Токен, версии данных и кэш
+страниц читаются асинхронными методами Django, список покупок отдается
+асинхронным потоком, поэтому ожидание БД, кэша и медленных клиентов не
+занимает рабочий процесс.
+
+Ответы совпадают с ответами вьюсетов (api/views.py). Остальные методы и
+форматы (например, browsable API), а также ответы с ошибками (неверный
+токен, неверные параметры, объект не найден) обрабатывает вьюсет.
+"""
+from itertools import chain
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from recipes.models import Recipe, ShoppingListItem
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from .cache import (RECIPES_VERSION_KEY, USER_FLAGS_VERSION_KEY, VERSION_KEY,
+                    aget_versions, asingle_flight, reference_data)
+from .filters import RecipeFilter
+from .pagination import CustomPagination
+from .renderers import (ShoppingListCsvRenderer, ShoppingListPdfRenderer,
+                        ShoppingListTextRenderer)
+from .search import ingredient_index
+from .serializers import RecipeSerializer, TagSerializer
+from .utils import aconditional_get
+from .views import SHOPPING_LIST_CHUNK_SIZE, get_page_cache_key
+
+
+class FallbackToViewSetError(Exception):
+    """Запрос должен обработать вьюсет DRF."""
+
+
+async def aauthenticate(request):
+    """
+    Асинхронная проверка токена (как TokenAuthentication DRF). Если токен
+    неверный, то ответ с ошибкой формирует вьюсет.
+    """
+    auth = request.headers.get('Authorization', '').split()
+    if not auth or auth[0].lower() != 'token':
+        return AnonymousUser()
+    if len(auth) != 2:
+        raise FallbackToViewSetError
+    try:
+        token = await Token.objects.select_related('user').aget(key=auth[1])
+    except Token.DoesNotExist:
+        raise FallbackToViewSetError
+    if not token.user.is_active:
+        raise FallbackToViewSetError
+    return token.user
+
+
+class AsyncReadView(View):
+    """
+    Базовый асинхронный обработчик GET-запросов в формате JSON. Остальные
+    запросы и запросы, для которых обработчик вызвал FallbackToViewSetError,
+    передаются синхронному вьюсету viewset_view.
+    """
+    viewset_view = None
+    renderer_classes = (JSONRenderer, )
+
+    # Запрос в формате JSON: без параметра format и без заголовка Accept
+    # браузера, для которого DRF выбирает browsable API
+    def accepts_json(self, request):
+        return (
+            'format' not in request.GET
+            and 'text/html' not in request.headers.get('Accept', '')
+        )
+
+    # Запрос DRF для фильтров, пагинатора и сериализаторов (без чтения тела
+    # и без повторной аутентификации)
+    def get_drf_request(self, request):
+        drf_request = Request(request)
+        drf_request.user = request.user
+        drf_request.accepted_renderer = self.renderer_classes[0]()
+        return drf_request
+
+    # Как и у вьюсетов DRF, проверка CSRF не выполняется
+    @method_decorator(csrf_exempt)
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method == 'GET' and self.accepts_json(request):
+            try:
+                request.user = await aauthenticate(request)
+                response = await self.get(request, *args, **kwargs)
+                patch_vary_headers(response, ('Accept', ))
+                return response
+            except FallbackToViewSetError:
+                pass
+        return await sync_to_async(self.viewset_view)(
+            request,
+            *args,
+            **kwargs
+        )
+
+    # Версии рецептов, справочников и избранного/списка покупок
+    # пользователя (для анонимного пользователя - None), от которых зависит
+    # ответ. Читаются из кэша одним обращением
+    async def load_versions(self, request):
+        user = request.user
+        keys = [RECIPES_VERSION_KEY, VERSION_KEY]
+        if user.is_authenticated:
+            keys.append(USER_FLAGS_VERSION_KEY.format(user.pk))
+        versions = await aget_versions(*keys) + [None]
+        (self.recipes_version, self.reference_version,
+         self.user_flags_version) = versions[:3]
+
+    # Ответ JSON
+    def render(self, data):
+        return HttpResponse(
+            JSONRenderer().render(data),
+            content_type='application/json'
+        )
+
+
+class TagListView(AsyncReadView):
+    """Список тегов из кэша справочников."""
+
+    async def get_validators(self, request):
+        self.reference_version = await reference_data.aversion()
+        return ('tags', self.reference_version, 'json'), None
+
+    @aconditional_get
+    async def get(self, request):
+        snapshot = await reference_data.asnapshot(self.reference_version)
+        return self.render(TagSerializer(snapshot['tags'], many=True).data)
+
+
+class IngredientListView(AsyncReadView):
+    """Поиск ингредиентов по индексу в памяти процесса (api/search.py)."""
+
+    async def get_validators(self, request):
+        self.reference_version = await reference_data.aversion()
+        return ('ingredients', self.reference_version, 'json'), None
+
+    @aconditional_get
+    async def get(self, request):
+        source = (
+            await reference_data.asnapshot(self.reference_version)
+        )['ingredient_rows']
+        name = request.GET.get('name')
+        if name:
+            return self.render(ingredient_index.search(name, source=source))
+        return HttpResponse(
+            ingredient_index.rendered(source),
+            content_type='application/json'
+        )
+
+
+class RecipeReadView(AsyncReadView):
+    """Общие методы списка рецептов и рецепта."""
+
+    # Рецепты с автором, тегами, ингредиентами и флагами пользователя
+    def get_queryset(self, request):
+        return Recipe.objects.with_user_flags(
+            request.user
+        ).with_related()
+
+    # Части ETag, общие для списка и рецепта (как в RecipeViewSet).
+    # Версии должны быть прочитаны (load_versions)
+    def get_etag_parts(self, request):
+        return (
+            self.recipes_version,
+            self.reference_version,
+            request.user.pk,
+            self.user_flags_version,
+            'json'
+        )
+
+
+class RecipeListView(RecipeReadView):
+    """
+    Список рецептов с фильтрами и пагинацией. Список для анонимного
+    пользователя берется из общего кэша страниц (как в RecipeViewSet).
+    """
+
+    async def get_validators(self, request):
+        await self.load_versions(request)
+        return ('recipes', *self.get_etag_parts(request)), None
+
+    # Данные страницы. Форма фильтров (проверка автора) и пагинатор DRF
+    # обращаются к БД синхронно, поэтому вызываются так же, как асинхронные
+    # методы ORM Django: через sync_to_async
+    async def get_data(self, request):
+        drf_request = self.get_drf_request(request)
+        filterset = RecipeFilter(
+            drf_request.query_params,
+            queryset=self.get_queryset(request),
+            request=drf_request
+        )
+        if not await sync_to_async(filterset.is_valid)():
+            raise FallbackToViewSetError
+        queryset = filterset.qs
+        paginator = CustomPagination()
+        page = await sync_to_async(paginator.paginate_queryset)(
+            queryset,
+            drf_request
+        )
+        context = {'request': drf_request}
+        if page is None:
+            recipes = [recipe async for recipe in queryset]
+            return RecipeSerializer(recipes, many=True, context=context).data
+        data = RecipeSerializer(page, many=True, context=context).data
+        return paginator.get_paginated_response(data).data
+
+    @aconditional_get
+    async def get(self, request):
+        if request.user.is_authenticated:
+            return self.render(await self.get_data(request))
+        data = await asingle_flight(
+            get_page_cache_key(request),
+            (self.recipes_version, self.reference_version),
+            lambda: self.get_data(request),
+            settings.RECIPES_PAGE_CACHE_TIMEOUT
+        )
+        return self.render(data)
+
+
+class RecipeDetailView(RecipeReadView):
+    """Рецепт. Если рецепт не найден, то ответ 404 формирует вьюсет."""
+
+    async def get_validators(self, request, pk):
+        updated = await Recipe.objects.filter(pk=pk).values_list(
+            'updated',
+            flat=True
+        ).afirst()
+        if updated is None:
+            raise FallbackToViewSetError
+        await self.load_versions(request)
+        last_modified = None if request.user.is_authenticated else updated
+        return (
+            'recipe',
+            pk,
+            updated.isoformat(),
+            *self.get_etag_parts(request)
+        ), last_modified
+
+    @aconditional_get
+    async def get(self, request, pk):
+        recipe = await self.get_queryset(request).filter(pk=pk).afirst()
+        if recipe is None:
+            raise FallbackToViewSetError
+        drf_request = self.get_drf_request(request)
+        return self.render(
+            RecipeSerializer(recipe, context={'request': drf_request}).data
+        )
+
+
+class ShoppingListView(AsyncReadView):
+    """
+    Выгрузка списка покупок (txt, csv или pdf). Строки списка читаются из
+    БД в отдельном потоке, файл отдается асинхронным потоком.
+    """
+    renderer_classes = (
+        ShoppingListTextRenderer,
+        ShoppingListCsvRenderer,
+        ShoppingListPdfRenderer
+    )
+
+    # Формат файла выбирается так же, как в DRF: по параметру format или
+    # заголовку Accept
+    def accepts_json(self, request):
+        return True
+
+    def select_renderer(self, request):
+        try:
+            renderer, _ = DefaultContentNegotiation().select_renderer(
+                Request(request),
+                [renderer() for renderer in self.renderer_classes]
+            )
+        except NotAcceptable:
+            raise FallbackToViewSetError
+        return renderer
+
+    async def get_validators(self, request):
+        user = request.user
+        if not user.is_authenticated:
+            raise FallbackToViewSetError
+        await self.load_versions(request)
+        return (
+            'shopping_cart',
+            self.recipes_version,
+            self.reference_version,
+            user.pk,
+            self.user_flags_version,
+            self.select_renderer(request).format
+        ), None
+
+    @aconditional_get
+    async def get(self, request):
+        renderer = self.select_renderer(request)
+        # QuerySet.aiterator() в Django 4.2 выполняет запрос values_list
+        # в цикле событий (SynchronousOnlyOperation), поэтому строки
+        # читаются через sync_to_async. Рендерер получает строки по мере
+        # вывода: в памяти находится одна часть списка
+        # (SHOPPING_LIST_CHUNK_SIZE строк), а не весь список
+        output = renderer.stream(chain.from_iterable(
+            ShoppingListItem.objects.export_chunks(
+                request.user,
+                SHOPPING_LIST_CHUNK_SIZE
+            )
+        ))
+
+        async def content():
+            while True:
+                chunk = await sync_to_async(next)(output, None)
+                if chunk is None:
+                    return
+                yield chunk
+
+        response = StreamingHttpResponse(
+            content(),
+            content_type=(
+                f'{renderer.media_type}; charset={renderer.charset}'
+                if renderer.charset else renderer.media_type
+            )
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{renderer.format}"'
+        )
+        return response
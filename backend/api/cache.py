@@ -0,0 +1,266 @@
+import asyncio
+from threading import Lock
+from time import sleep, time
+from uuid import uuid4
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.checks import Tags, Warning, register
+from django.db import transaction
+from recipes.models import Ingredient, Tag
+
+from .db_router import use_primary
+
+# Ключи общего кэша, в которых хранятся версии данных. Версия меняется при
+# каждом изменении соответствующих данных (см. api/signals.py)
+VERSION_KEY = 'reference_data_version'
+RECIPES_VERSION_KEY = 'recipes_version'
+USER_FLAGS_VERSION_KEY = 'recipe_flags_version_{}'
+
+# Параметры single_flight: время жизни блокировки пересчета, интервал
+# ожидания результата пересчета и сколько еще хранится устаревшее значение
+SINGLE_FLIGHT_LOCK_TIMEOUT = 10
+SINGLE_FLIGHT_WAIT_INTERVAL = 0.05
+SINGLE_FLIGHT_STALE_TIMEOUT = 300
+
+# Кэши, общие для всех процессов и серверов, с атомарным add
+SHARED_CACHE_BACKENDS = (
+    'django.core.cache.backends.redis.RedisCache',
+    'django.core.cache.backends.memcached.PyMemcacheCache',
+    'django.core.cache.backends.memcached.PyLibMCCache'
+)
+
+
+# Проверка для manage.py check --deploy: файловый кэш и кэш в памяти
+# процесса не гарантируют атомарность cache.add между процессами и
+# вытесняют версии данных
+@register(Tags.caches, deploy=True)
+def check_shared_cache(**kwargs):
+    if settings.CACHES['default']['BACKEND'] in SHARED_CACHE_BACKENDS:
+        return []
+    return [Warning(
+        'Кэш default не общий для процессов: блокировки single_flight и '
+        'версии данных работают ненадежно.',
+        hint='Укажите REDIS_URL (Redis) в переменных окружения.',
+        id='api.W001'
+    )]
+
+
+def get_version(key):
+    """
+    Текущая версия данных из общего кэша (settings.CACHES). Если версии в
+    кэше нет, то она создается атомарно (cache.add).
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_version(key):
+    """Асинхронный вариант get_version (api/async_views.py)."""
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, uuid4().hex, None)
+        version = await cache.aget(key)
+    return version
+
+
+async def aget_versions(*keys):
+    """
+    Асинхронное чтение нескольких версий одним обращением к кэшу
+    (cache.aget_many). Отсутствующие версии создаются, как в get_version.
+    """
+    versions = await cache.aget_many(keys)
+    for key in keys:
+        if versions.get(key) is None:
+            versions[key] = await aget_version(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(key):
+    """
+    Смена версии данных после фиксации транзакции, чтобы другие процессы не
+    прочитали старые данные под новой версией.
+    """
+    transaction.on_commit(lambda: cache.set(key, uuid4().hex, None))
+
+
+def get_user_flags_version(user):
+    """
+    Версия избранного и списка покупок пользователя (поля is_favorited и
+    is_in_shopping_cart рецептов). Для анонимного пользователя - None.
+    """
+    if not user.is_authenticated:
+        return None
+    return get_version(USER_FLAGS_VERSION_KEY.format(user.pk))
+
+
+def single_flight(key, version, compute, timeout):
+    """
+    Получение значения из общего кэша с защитой от одновременного пересчета.
+    Значение хранится вместе с версией данных и сроком актуальности. Если
+    значение устарело или отсутствует, то пересчитывает его только процесс,
+    получивший блокировку (cache.add). Остальные в это время отдают
+    устаревшее значение, а если его нет - ждут результата пересчета.
+    Значение для кэша читается из основной БД (use_primary).
+    """
+    entry = cache.get(key)
+    if (entry is not None and entry['version'] == version
+            and entry['expires'] > time()):
+        return entry['value']
+    lock_key = f'{key}_lock'
+    if cache.add(lock_key, True, SINGLE_FLIGHT_LOCK_TIMEOUT):
+        try:
+            with use_primary():
+                value = compute()
+            cache.set(key, {
+                'version': version,
+                'expires': time() + timeout,
+                'value': value
+            }, timeout + SINGLE_FLIGHT_STALE_TIMEOUT)
+        finally:
+            cache.delete(lock_key)
+        return value
+    if entry is not None:
+        return entry['value']
+    deadline = time() + SINGLE_FLIGHT_LOCK_TIMEOUT
+    while time() < deadline:
+        sleep(SINGLE_FLIGHT_WAIT_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None and entry['version'] == version:
+            return entry['value']
+        if cache.get(lock_key) is None:
+            break
+    return compute()
+
+
+async def asingle_flight(key, version, compute, timeout):
+    """
+    Асинхронный вариант single_flight: compute - корутина, ожидание
+    результата пересчета не блокирует цикл событий.
+    """
+    entry = await cache.aget(key)
+    if (entry is not None and entry['version'] == version
+            and entry['expires'] > time()):
+        return entry['value']
+    lock_key = f'{key}_lock'
+    if await cache.aadd(lock_key, True, SINGLE_FLIGHT_LOCK_TIMEOUT):
+        try:
+            with use_primary():
+                value = await compute()
+            await cache.aset(key, {
+                'version': version,
+                'expires': time() + timeout,
+                'value': value
+            }, timeout + SINGLE_FLIGHT_STALE_TIMEOUT)
+        finally:
+            await cache.adelete(lock_key)
+        return value
+    if entry is not None:
+        return entry['value']
+    deadline = time() + SINGLE_FLIGHT_LOCK_TIMEOUT
+    while time() < deadline:
+        await asyncio.sleep(SINGLE_FLIGHT_WAIT_INTERVAL)
+        entry = await cache.aget(key)
+        if entry is not None and entry['version'] == version:
+            return entry['value']
+        if await cache.aget(lock_key) is None:
+            break
+    return await compute()
+
+
+class ReferenceDataCache:
+    """
+    Кэш справочников (теги и ингредиенты) в памяти процесса. Актуальность
+    проверяется по версии, которая хранится в общем кэше (settings.CACHES):
+    при изменении справочников версия меняется (см. api/signals.py), и
+    каждый процесс gunicorn перечитывает справочники из БД при следующем
+    обращении к ним.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._snapshot = None
+
+    # Кэш один на процесс: методы кэша передаются в поля сериализаторов и
+    # фильтров, которые DRF и django-filter копируют через deepcopy
+    def __deepcopy__(self, memo):
+        return self
+
+    # Текущая версия справочников
+    def version(self):
+        return get_version(VERSION_KEY)
+
+    # Текущая версия справочников (для асинхронного кода)
+    async def aversion(self):
+        return await aget_version(VERSION_KEY)
+
+    # Смена версии справочников
+    def bump_version(self):
+        bump_version(VERSION_KEY)
+
+    # Чтение справочников из основной БД. Версия запрашивается до чтения
+    # данных, поэтому изменения, сделанные во время чтения, приведут к
+    # повторному чтению при следующем обращении
+    def _load(self, version):
+        with use_primary():
+            tags = list(Tag.objects.order_by('id'))
+            ingredient_rows = list(Ingredient.objects.values(
+                'id', 'name', 'measurement_unit'
+            ))
+        return {
+            'version': version,
+            'tags': tags,
+            'tags_by_id': {tag.id: tag for tag in tags},
+            'ingredient_rows': ingredient_rows,
+            'ingredients_by_id': {
+                row['id']: Ingredient(**row) for row in ingredient_rows
+            }
+        }
+
+    def _get_snapshot(self):
+        version = self.version()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot['version'] != version:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or snapshot['version'] != version:
+                    snapshot = self._snapshot = self._load(version)
+        return snapshot
+
+    # Актуальные справочники для асинхронного кода: версия проверяется
+    # асинхронно (если она не передана), справочники перечитываются из БД в
+    # отдельном потоке, только если версия сменилась
+    async def asnapshot(self, version=None):
+        if version is None:
+            version = await self.aversion()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot['version'] != version:
+            snapshot = await sync_to_async(self._get_snapshot)()
+        return snapshot
+
+    # Все теги
+    def tags(self):
+        return self._get_snapshot()['tags']
+
+    # Тег по id или None, если тег не найден
+    def tag(self, pk):
+        return self._get_snapshot()['tags_by_id'].get(pk)
+
+    # Варианты выбора тегов по slug для фильтров
+    def tag_choices(self):
+        return [(tag.slug, tag.name) for tag in self.tags()]
+
+    # Все ингредиенты в виде словарей (id, name, measurement_unit)
+    def ingredient_rows(self):
+        return self._get_snapshot()['ingredient_rows']
+
+    # Ингредиент по id или None, если ингредиент не найден
+    def ingredient(self, pk):
+        return self._get_snapshot()['ingredients_by_id'].get(pk)
+
+
+reference_data = ReferenceDataCache()
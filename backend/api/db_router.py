@@ -0,0 +1,147 @@
+"""
+Распределение запросов между основной БД и репликами только для чтения
+(settings.REPLICA_DATABASES). С реплик читаются данные приложений recipes и
+users при обработке GET, HEAD и OPTIONS-запросов пользователей API
+(пользователь определен аутентификацией DRF). Остальное чтение (запросы на
+изменение, транзакции, админка, токены и сессии, команды управления и
+фоновые задачи) выполняется в основной БД.
+
+Пользователь, изменивший данные, еще settings.REPLICA_STICKY_TIMEOUT секунд
+читает их из основной БД, поэтому видит свои изменения, даже если реплика
+отстает.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.functional import SimpleLazyObject
+from rest_framework.permissions import SAFE_METHODS
+
+# Приложения, данные которых читаются с реплик
+REPLICA_APPS = ('recipes', 'users')
+# Ключ общего кэша: пользователь недавно изменял данные
+STICKY_KEY = 'db_primary_user_{}'
+
+# Обрабатываемый запрос (устанавливается ReplicaRoutingMiddleware)
+current_request = ContextVar('current_request', default=None)
+# Чтение только из основной БД (use_primary)
+primary_only = ContextVar('primary_only', default=False)
+
+
+@contextmanager
+def use_primary():
+    """
+    Чтение из основной БД внутри блока with. Используется для данных,
+    которые сохраняются в общий кэш под новой версией: прочитанные с
+    отстающей реплики, они остались бы в кэше до следующей смены версии.
+    """
+    token = primary_only.set(True)
+    try:
+        yield
+    finally:
+        primary_only.reset(token)
+
+
+# Пользователь API, определенный аутентификацией DRF, или None (запрос
+# еще не прошел аутентификацию DRF или обрабатывается не DRF)
+def get_api_user(request):
+    user = getattr(request, 'user', None)
+    if user is None or isinstance(user, SimpleLazyObject):
+        return None
+    return user
+
+
+# Ключ кэша для пользователя, который изменяет данные запросом request,
+# или None
+def get_sticky_key(request):
+    if not settings.REPLICA_DATABASES or request.method in SAFE_METHODS:
+        return None
+    user = get_api_user(request)
+    if user is None or not user.is_authenticated:
+        return None
+    return STICKY_KEY.format(user.pk)
+
+
+def get_replica(request):
+    """
+    Реплика для чтения в запросе request или None, если читать нужно из
+    основной БД. После аутентификации реплика выбирается один раз за
+    запрос, поэтому все данные ответа (например, страница и общее
+    количество рецептов) читаются из одной БД.
+    """
+    try:
+        return request._db_replica
+    except AttributeError:
+        pass
+    user = get_api_user(request)
+    if user is None:
+        return None
+    replica = None
+    if not user.is_authenticated or not cache.get(STICKY_KEY.format(user.pk)):
+        replica = random.choice(settings.REPLICA_DATABASES)
+    request._db_replica = replica
+    return replica
+
+
+class ReplicaRouter:
+    """Роутер БД: чтение с реплик, запись и миграции - в основной БД."""
+
+    def db_for_read(self, model, **hints):
+        request = current_request.get()
+        if (
+            request is None
+            or request.method not in SAFE_METHODS
+            or not settings.REPLICA_DATABASES
+            or model._meta.app_label not in REPLICA_APPS
+            or primary_only.get()
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return None
+        return get_replica(request)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    # Реплики содержат те же данные, что и основная БД
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+@sync_and_async_middleware
+def replica_routing_middleware(get_response):
+    """
+    Middleware: запрос сохраняется в current_request для ReplicaRouter.
+    После запроса на изменение данных пользователь на
+    settings.REPLICA_STICKY_TIMEOUT секунд закрепляется за основной БД.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = current_request.set(request)
+            try:
+                response = await get_response(request)
+            finally:
+                current_request.reset(token)
+            key = get_sticky_key(request)
+            if key:
+                await cache.aset(key, True, settings.REPLICA_STICKY_TIMEOUT)
+            return response
+    else:
+        def middleware(request):
+            token = current_request.set(request)
+            try:
+                response = get_response(request)
+            finally:
+                current_request.reset(token)
+            key = get_sticky_key(request)
+            if key:
+                cache.set(key, True, settings.REPLICA_STICKY_TIMEOUT)
+            return response
+    return middleware
@@ -1,7 +1,10 @@
 from django_filters.rest_framework import FilterSet, filters
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.fulltext import search_recipes
+from recipes.models import Ingredient, Recipe
 from users.models import CustomUser
 
+from .cache import reference_data
+
 
 class IngredientFilter(FilterSet):
     """Поиск ингредиента по начальным символам."""
@@ -15,13 +18,15 @@ class IngredientFilter(FilterSet):
 class RecipeFilter(FilterSet):
     """
     Поиск рецепта по автору и тегу, по нахождению в избранном и списке покупок.
+    Допустимые теги проверяются по кэшу справочников. Полнотекстовый поиск
+    (search) - по названию, описанию и ингредиентам, с сортировкой по
+    релевантности.
     """
     author = filters.ModelChoiceFilter(queryset=CustomUser.objects.all())
-    tags = filters.ModelMultipleChoiceFilter(
+    tags = filters.MultipleChoiceFilter(
         label='Тег',
-        queryset=Tag.objects.all(),
-        field_name='tags__slug',
-        to_field_name='slug'
+        choices=reference_data.tag_choices,
+        field_name='tags__slug'
     )
     is_favorited = filters.BooleanFilter(
         label='В избранном',
@@ -31,21 +36,35 @@ class RecipeFilter(FilterSet):
         label='В списке покупок',
         method='get_is_in_shopping_cart'
     )
+    search = filters.CharFilter(label='Поиск', method='get_search')
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = (
+            'author',
+            'tags',
+            'is_favorited',
+            'is_in_shopping_cart',
+            'search'
+        )
 
-    # Фильтр по избранному
+    # Фильтр по избранному. Использует флаг, вычисленный в основном запросе
     def get_is_favorited(self, queryset, name, value):
-        user = self.request.user
-        if value:
-            return queryset.filter(favorite__user=user)
-        return queryset
+        if not value:
+            return queryset
+        if not self.request.user.is_authenticated:
+            return queryset.none()
+        return queryset.filter(is_favorited=True)
 
-    # Фильтр по списку покупок
+    # Фильтр по списку покупок. Использует флаг, вычисленный в основном
+    # запросе
     def get_is_in_shopping_cart(self, queryset, name, value):
-        user = self.request.user
-        if value:
-            return queryset.filter(shoppingcart__user=user)
-        return queryset
+        if not value:
+            return queryset
+        if not self.request.user.is_authenticated:
+            return queryset.none()
+        return queryset.filter(is_in_shopping_cart=True)
+
+    # Полнотекстовый поиск по индексу (recipes/fulltext.py)
+    def get_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
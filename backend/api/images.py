@@ -0,0 +1,148 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from io import BytesIO
+from pathlib import PurePosixPath
+from threading import Lock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+from recipes.models import Recipe
+
+from .cache import RECIPES_VERSION_KEY, bump_version
+
+logger = logging.getLogger(__name__)
+
+# Варианты картинки рецепта: наибольшие ширина и высота. Миниатюра - для
+# карточек в списках (363x240 px, с запасом для экранов высокой плотности),
+# detail - для страницы рецепта
+VARIANTS = {
+    'thumbnail': (720, 480),
+    'detail': (1200, 1200)
+}
+VARIANTS_DIR = 'recipes/variants'
+WEBP_QUALITY = 80
+
+_executor = None
+_executor_lock = Lock()
+
+
+def get_image_hash(data):
+    """Хеш содержимого картинки (SHA-256)."""
+    return sha256(data).hexdigest()
+
+
+def get_variant_name(image_name, variant):
+    """
+    Имя файла варианта картинки. Имя строится по имени оригинала, поэтому по
+    нему видно, для какой картинки построен вариант.
+    """
+    return f'{VARIANTS_DIR}/{PurePosixPath(image_name).stem}_{variant}.webp'
+
+
+def get_variant(recipe, variant):
+    """
+    Вариант картинки рецепта. Пока вариант для текущей картинки не готов,
+    возвращается оригинал.
+    """
+    file = getattr(recipe, f'image_{variant}')
+    if file and file.name == get_variant_name(recipe.image.name, variant):
+        return file
+    return recipe.image
+
+
+def variants_ready(recipe):
+    """Проверка, что все варианты построены для текущей картинки рецепта."""
+    return all(
+        get_variant(recipe, variant) is not recipe.image
+        for variant in VARIANTS
+    )
+
+
+def build_variants(recipe):
+    """
+    Построение вариантов картинки рецепта в формате WebP. Варианты
+    сохраняются, только если картинка рецепта за это время не изменилась.
+    После сохранения меняется дата изменения рецепта и версия рецептов,
+    чтобы клиенты получили ссылки на варианты.
+    """
+    image_name = recipe.image.name
+    with recipe.image.open('rb') as file:
+        data = file.read()
+    storage = recipe.image.storage
+    names = {}
+    with Image.open(BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        for variant, size in VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail(size, Image.LANCZOS)
+            buffer = BytesIO()
+            resized.save(buffer, 'WEBP', quality=WEBP_QUALITY)
+            name = get_variant_name(image_name, variant)
+            storage.delete(name)
+            names[f'image_{variant}'] = storage.save(
+                name,
+                ContentFile(buffer.getvalue())
+            )
+    old_names = {
+        getattr(recipe, field).name for field in names
+    } - {None, ''} - set(names.values())
+    updated = Recipe.objects.filter(pk=recipe.pk, image=image_name).update(
+        updated=timezone.now(),
+        **names
+    )
+    if not updated:
+        for name in names.values():
+            storage.delete(name)
+        return
+    for name in old_names:
+        storage.delete(name)
+    bump_version(RECIPES_VERSION_KEY)
+
+
+def _process(pk):
+    try:
+        recipe = Recipe.objects.filter(pk=pk).first()
+        if recipe and recipe.image and not variants_ready(recipe):
+            build_variants(recipe)
+    except Exception:
+        logger.exception('Не удалось построить варианты картинки рецепта %s',
+                         pk)
+    finally:
+        if settings.IMAGE_VARIANT_WORKERS:
+            connections.close_all()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_VARIANT_WORKERS,
+                thread_name_prefix='image-variants'
+            )
+    return _executor
+
+
+def schedule_variants(recipe):
+    """
+    Построение вариантов картинки после фиксации транзакции в фоновом
+    потоке процесса. Если settings.IMAGE_VARIANT_WORKERS = 0, то варианты
+    строятся сразу после фиксации транзакции в текущем потоке. Задачи,
+    потерянные при перезапуске процесса, выполняет команда
+    build_image_variants.
+    """
+    pk = recipe.pk
+
+    def submit():
+        if settings.IMAGE_VARIANT_WORKERS:
+            _get_executor().submit(_process, pk)
+        else:
+            _process(pk)
+
+    transaction.on_commit(submit)
@@ -0,0 +1,232 @@
+"""
+Замеры запросов: количество и время запросов к БД, время сериализации и
+размер ответа. Замеры передаются в заголовке Server-Timing администраторам
+(всем пользователям при settings.SERVER_TIMING_FOR_ALL, например в тестах),
+а запросы, превысившие settings.SLOW_REQUEST_MS или
+settings.SLOW_REQUEST_QUERIES, записываются в журнал api.instrumentation
+вместе с самыми долгими запросами к БД. Замеры потокового ответа
+продолжаются, пока передается его тело.
+"""
+import json
+import logging
+from contextvars import ContextVar
+from heapq import heappush, heappushpop
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.decorators import sync_and_async_middleware
+
+from .db_router import get_api_user
+
+logger = logging.getLogger(__name__)
+
+# Наибольшая длина текста запроса к БД в журнале
+MAX_SQL_LENGTH = 2000
+
+# Замеры обрабатываемого запроса (устанавливается request_timing_middleware)
+request_timing = ContextVar('request_timing', default=None)
+
+
+class RequestTiming:
+    """
+    Замеры одного запроса. Запросы к БД считаются вместе с их временем,
+    сохраняются settings.SLOW_REQUEST_SQL самых долгих.
+    """
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializing = False
+        self.sql_limit = settings.SLOW_REQUEST_SQL
+        self.slowest = []
+
+    def execute(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = perf_counter() - start
+            self.queries += 1
+            self.db_time += duration
+            if len(self.slowest) < self.sql_limit:
+                heappush(self.slowest, (duration, self.queries, sql))
+            elif self.sql_limit:
+                heappushpop(self.slowest, (duration, self.queries, sql))
+
+    # Замеры по готовому ответу. Тело потокового ответа формируется после
+    # выхода из middleware, поэтому заголовок Server-Timing содержит замеры
+    # только до начала передачи тела (помечается partial), а запись в
+    # журнал делается, когда тело передано целиком (stream, astream)
+    def finish(self, request, response):
+        user = get_api_user(request)
+        if not response.streaming:
+            size = len(response.content)
+            self.set_header(response, user, size)
+            self.log(request, response, user, size)
+            return
+        self.set_header(response, user, None)
+        if response.is_async:
+            response.streaming_content = self.astream(
+                request,
+                response,
+                user,
+                response.streaming_content
+            )
+        else:
+            response.streaming_content = self.stream(
+                request,
+                response,
+                user,
+                response.streaming_content
+            )
+
+    def set_header(self, response, user, size):
+        if not (
+            settings.SERVER_TIMING_FOR_ALL
+            or (user is not None and user.is_staff)
+        ):
+            return
+        total = (perf_counter() - self.start) * 1000
+        metrics = [
+            f'total;dur={total:.1f}',
+            f'db;dur={self.db_time * 1000:.1f}',
+            f'serializer;dur={self.serializer_time * 1000:.1f}',
+            f'queries;desc="{self.queries}"'
+        ]
+        if size is not None:
+            metrics.append(f'size;desc="{size}"')
+        else:
+            metrics.append('partial;desc="streaming"')
+        response['Server-Timing'] = ', '.join(metrics)
+
+    # Запись в журнал медленного запроса
+    def log(self, request, response, user, size):
+        total = (perf_counter() - self.start) * 1000
+        if (
+            total < settings.SLOW_REQUEST_MS
+            and self.queries < settings.SLOW_REQUEST_QUERIES
+        ):
+            return
+        logger.warning(json.dumps({
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'user': user.pk if user is not None else None,
+            'total_ms': round(total, 1),
+            'db_ms': round(self.db_time * 1000, 1),
+            'serializer_ms': round(self.serializer_time * 1000, 1),
+            'queries': self.queries,
+            'size': size,
+            'streaming': response.streaming,
+            'slowest_sql': [
+                {'ms': round(duration * 1000, 1),
+                 'sql': sql[:MAX_SQL_LENGTH]}
+                for duration, _, sql in sorted(self.slowest, reverse=True)
+            ]
+        }, ensure_ascii=False))
+
+    # Тело потокового ответа: каждая часть формируется с замерами запроса
+    # в контексте, поэтому учитываются запросы к БД во время передачи тела.
+    # Запись в журнал - после последней части или разрыва соединения
+    def stream(self, request, response, user, content):
+        size = 0
+        content = iter(content)
+        try:
+            while True:
+                token = request_timing.set(self)
+                try:
+                    chunk = next(content, None)
+                finally:
+                    request_timing.reset(token)
+                if chunk is None:
+                    return
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.log(request, response, user, size)
+
+    async def astream(self, request, response, user, content):
+        size = 0
+        content = content.__aiter__()
+        try:
+            while True:
+                token = request_timing.set(self)
+                try:
+                    chunk = await content.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    request_timing.reset(token)
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.log(request, response, user, size)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    execute_wrapper всех подключений к БД: запрос к БД учитывается в
+    замерах текущего запроса, если они ведутся. Замеры берутся из контекста,
+    поэтому учитываются и запросы асинхронных обработчиков (sync_to_async).
+    """
+    timing = request_timing.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    return timing.execute(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedSerializerMixin:
+    """
+    Сериализатор, время работы которого учитывается в замерах запроса.
+    Вложенные сериализаторы отдельно не учитываются, время запросов к БД
+    во время сериализации входит во время сериализации.
+    """
+
+    def to_representation(self, instance):
+        timing = request_timing.get()
+        if timing is None or timing.serializing:
+            return super().to_representation(instance)
+        timing.serializing = True
+        start = perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            timing.serializer_time += perf_counter() - start
+            timing.serializing = False
+
+
+@sync_and_async_middleware
+def request_timing_middleware(get_response):
+    """Middleware: замеры запроса (RequestTiming)."""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            timing = RequestTiming()
+            token = request_timing.set(timing)
+            try:
+                response = await get_response(request)
+            finally:
+                request_timing.reset(token)
+            timing.finish(request, response)
+            return response
+    else:
+        def middleware(request):
+            timing = RequestTiming()
+            token = request_timing.set(timing)
+            try:
+                response = get_response(request)
+            finally:
+                request_timing.reset(token)
+            timing.finish(request, response)
+            return response
+    return middleware
@@ -1,6 +1,61 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class CustomCursorPagination(CursorPagination):
+    """
+    Пагинатор по курсору (keyset): следующая страница выбирается условием
+    по id, без COUNT(*) и OFFSET. Рецепты, найденные полнотекстовым поиском,
+    упорядочены по релевантности (search_rank): курсор хранит
+    релевантность, рецепты с одинаковой релевантностью упорядочены по id.
+    """
+    ordering = '-id'
+    search_ordering = ('-search_rank', '-id')
+    page_size = 6
+    page_size_query_param = 'limit'
+
+    def get_ordering(self, request, queryset, view):
+        if 'search_rank' in queryset.query.annotations:
+            return self.search_ordering
+        return super().get_ordering(request, queryset, view)
 
 
 class CustomPagination(PageNumberPagination):
-    """Кастомный пагинатор, для вывода запрошенного количества страниц."""
+    """
+    Кастомный пагинатор, для вывода запрошенного количества страниц.
+    Параметр pagination=cursor (или наличие параметра cursor) включает
+    пагинацию по курсору, см. CustomCursorPagination.
+    """
     page_size_query_param = 'limit'
+    mode_query_param = 'pagination'
+    cursor_pagination_class = CustomCursorPagination
+
+    def __init__(self):
+        self.cursor_paginator = None
+
+    # Проверка, что запрошена пагинация по курсору
+    def is_cursor_mode(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or self.cursor_pagination_class.cursor_query_param
+            in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.is_cursor_mode(request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset,
+                request,
+                view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.cursor_paginator:
+            return self.cursor_paginator.to_html()
+        return super().to_html()
@@ -0,0 +1,429 @@
+import os
+import zlib
+from functools import lru_cache
+from struct import pack, unpack_from
+
+# Размеры страницы A4, поля и межстрочный интервал в пунктах
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 50
+FONT_SIZE = 11
+TITLE_FONT_SIZE = 16
+LINE_HEIGHT = 16
+
+# Таблицы шрифта, которые сохраняются в подмножестве шрифта
+SUBSET_TABLES = ('head', 'hhea', 'maxp', 'hmtx', 'loca', 'glyf', 'cvt ',
+                 'fpgm', 'prep', 'OS/2', 'post', 'name')
+
+# Флаги составного глифа (таблица glyf)
+ARG_1_AND_2_ARE_WORDS = 0x0001
+WE_HAVE_A_SCALE = 0x0008
+MORE_COMPONENTS = 0x0020
+WE_HAVE_AN_X_AND_Y_SCALE = 0x0040
+WE_HAVE_A_TWO_BY_TWO = 0x0080
+
+# Номера служебных объектов PDF. Страницы нумеруются начиная с FIRST_PAGE
+CATALOG, PAGES, FONT, CID_FONT, DESCRIPTOR, FONT_FILE, TO_UNICODE = range(
+    1, 8
+)
+FIRST_PAGE = 8
+
+
+class TrueTypeFont:
+    """
+    Шрифт TrueType для встраивания в PDF. Из файла шрифта читаются только
+    таблицы, необходимые для вывода текста: метрики, ширины глифов и
+    таблица соответствия символов глифам (cmap). В документ встраивается
+    подмножество шрифта, в котором остаются только использованные глифы.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.data = file.read()
+        self.name = os.path.splitext(os.path.basename(path))[0].replace(
+            ' ', ''
+        )
+        tables = {}
+        for index in range(unpack_from('>H', self.data, 4)[0]):
+            tag, _, offset, length = unpack_from(
+                '>4sIII', self.data, 12 + 16 * index
+            )
+            tables[tag.decode('latin-1')] = (offset, length)
+        self.tables = tables
+        head, hhea = tables['head'][0], tables['hhea'][0]
+        units = unpack_from('>H', self.data, head + 18)[0]
+        self.scale = 1000 / units
+        self.bbox = [
+            round(value * self.scale)
+            for value in unpack_from('>4h', self.data, head + 36)
+        ]
+        ascent, descent = unpack_from('>2h', self.data, hhea + 4)
+        self.ascent = round(ascent * self.scale)
+        self.descent = round(descent * self.scale)
+        metrics_count = unpack_from('>H', self.data, hhea + 34)[0]
+        self.widths = [
+            round(unpack_from('>H', self.data, tables['hmtx'][0] + 4 * i)[0]
+                  * self.scale)
+            for i in range(metrics_count)
+        ]
+        self.long_loca = unpack_from('>h', self.data, head + 50)[0] == 1
+        self.glyph_count = unpack_from(
+            '>H', self.data, tables['maxp'][0] + 4
+        )[0]
+        self.glyphs = self._read_cmap(tables['cmap'][0])
+
+    # Чтение таблицы cmap (форматы 12 и 4 для кодировки Unicode)
+    def _read_cmap(self, offset):
+        records = {}
+        for index in range(unpack_from('>H', self.data, offset + 2)[0]):
+            platform, encoding, subtable = unpack_from(
+                '>HHI', self.data, offset + 4 + 8 * index
+            )
+            records[platform, encoding] = offset + subtable
+        for key in ((3, 10), (0, 4), (3, 1), (0, 3)):
+            if key in records:
+                subtable = records[key]
+                break
+        else:
+            return {}
+        glyphs = {}
+        if unpack_from('>H', self.data, subtable)[0] == 12:
+            groups = unpack_from('>I', self.data, subtable + 12)[0]
+            for index in range(groups):
+                start, end, glyph = unpack_from(
+                    '>3I', self.data, subtable + 16 + 12 * index
+                )
+                for code in range(start, end + 1):
+                    glyphs[code] = glyph + code - start
+            return glyphs
+        segments = unpack_from('>H', self.data, subtable + 6)[0] // 2
+        ends = subtable + 14
+        starts = ends + 2 * segments + 2
+        deltas = starts + 2 * segments
+        range_offsets = deltas + 2 * segments
+        for index in range(segments):
+            end = unpack_from('>H', self.data, ends + 2 * index)[0]
+            start = unpack_from('>H', self.data, starts + 2 * index)[0]
+            delta = unpack_from('>h', self.data, deltas + 2 * index)[0]
+            position = range_offsets + 2 * index
+            range_offset = unpack_from('>H', self.data, position)[0]
+            for code in range(start, min(end, 0xFFFE) + 1):
+                if range_offset:
+                    glyph = unpack_from(
+                        '>H',
+                        self.data,
+                        position + range_offset + 2 * (code - start)
+                    )[0]
+                    if glyph:
+                        glyph = (glyph + delta) & 0xFFFF
+                else:
+                    glyph = (code + delta) & 0xFFFF
+                if glyph:
+                    glyphs[code] = glyph
+        return glyphs
+
+    # Смещения глифов в таблице glyf (таблица loca)
+    def _glyph_offsets(self):
+        offset = self.tables['loca'][0]
+        if self.long_loca:
+            return unpack_from(
+                f'>{self.glyph_count + 1}I', self.data, offset
+            )
+        return [
+            value * 2 for value in unpack_from(
+                f'>{self.glyph_count + 1}H', self.data, offset
+            )
+        ]
+
+    # Глифы, из которых состоят составные глифы
+    def _with_components(self, glyphs, offsets):
+        glyf = self.tables['glyf'][0]
+        pending = list(glyphs)
+        result = set(glyphs)
+        while pending:
+            glyph = pending.pop()
+            start, end = offsets[glyph], offsets[glyph + 1]
+            if end - start < 10:
+                continue
+            if unpack_from('>h', self.data, glyf + start)[0] >= 0:
+                continue
+            position = glyf + start + 10
+            while True:
+                flags, component = unpack_from('>HH', self.data, position)
+                if component not in result:
+                    result.add(component)
+                    pending.append(component)
+                position += 4
+                position += 4 if flags & ARG_1_AND_2_ARE_WORDS else 2
+                if flags & WE_HAVE_A_SCALE:
+                    position += 2
+                elif flags & WE_HAVE_AN_X_AND_Y_SCALE:
+                    position += 4
+                elif flags & WE_HAVE_A_TWO_BY_TWO:
+                    position += 8
+                if not flags & MORE_COMPONENTS:
+                    break
+        return result
+
+    # Подмножество шрифта: номера глифов сохраняются, а описания
+    # неиспользованных глифов удаляются из таблицы glyf
+    def subset(self, glyphs):
+        offsets = self._glyph_offsets()
+        keep = self._with_components(set(glyphs) | {0}, offsets)
+        glyf = self.tables['glyf'][0]
+        glyph_data = []
+        loca = [0]
+        for glyph in range(self.glyph_count):
+            if glyph in keep:
+                data = self.data[
+                    glyf + offsets[glyph]:glyf + offsets[glyph + 1]
+                ]
+                data += b'\0' * (-len(data) % 4)
+                glyph_data.append(data)
+                loca.append(loca[-1] + len(data))
+            else:
+                loca.append(loca[-1])
+        tables = {
+            tag: self.data[offset:offset + length]
+            for tag, (offset, length) in self.tables.items()
+            if tag in SUBSET_TABLES
+        }
+        head = bytearray(tables['head'])
+        head[8:12] = b'\0' * 4
+        head[50:52] = pack('>h', 1)
+        tables['head'] = bytes(head)
+        tables['loca'] = pack(f'>{len(loca)}I', *loca)
+        tables['glyf'] = b''.join(glyph_data)
+        if 'post' in tables:
+            # Таблица post версии 3.0 - без имен глифов
+            tables['post'] = pack('>I', 0x00030000) + tables['post'][4:32]
+        return build_font_file(tables)
+
+    def width(self, glyph):
+        if glyph < len(self.widths):
+            return self.widths[glyph]
+        return self.widths[-1]
+
+
+def build_font_file(tables):
+    """Сборка файла шрифта TrueType из таблиц."""
+    count = len(tables)
+    power = 1
+    while power * 2 <= count:
+        power *= 2
+    header = pack(
+        '>IHHHH', 0x00010000, count, power * 16,
+        power.bit_length() - 1, count * 16 - power * 16
+    )
+    offset = len(header) + 16 * count
+    directory = []
+    body = []
+    for tag in sorted(tables):
+        data = tables[tag]
+        padded = data + b'\0' * (-len(data) % 4)
+        checksum = sum(unpack_from(f'>{len(padded) // 4}I', padded))
+        directory.append(pack(
+            '>4sIII', tag.encode('latin-1'), checksum & 0xFFFFFFFF,
+            offset, len(data)
+        ))
+        body.append(padded)
+        offset += len(padded)
+    return header + b''.join(directory) + b''.join(body)
+
+
+@lru_cache(maxsize=None)
+def load_font(path):
+    """Шрифт загружается один раз на процесс. Если файла нет - None."""
+    if not path or not os.path.exists(path):
+        return None
+    return TrueTypeFont(path)
+
+
+def pdf_string(value):
+    """Строка PDF в кодировке WinAnsi для стандартного шрифта Helvetica."""
+    value = value.encode('cp1252', 'replace')
+    for char in (b'\\', b'(', b')'):
+        value = value.replace(char, b'\\' + char)
+    return b'(' + value + b')'
+
+
+class PdfWriter:
+    """
+    Потоковый вывод PDF-документа из строк текста. Страницы отдаются по мере
+    заполнения, поэтому в памяти хранится только текущая страница и
+    смещения объектов для таблицы xref. Если указан шрифт TrueType, то он
+    встраивается в документ (нужен для кириллицы), иначе используется
+    стандартный шрифт Helvetica.
+    """
+
+    def __init__(self, title, font_path=None):
+        self.title = title
+        self.font = load_font(font_path)
+        self.offsets = {}
+        self.position = 0
+        self.used_glyphs = {}
+        self.page_numbers = []
+
+    def _object(self, number, body):
+        self.offsets[number] = self.position
+        chunk = b'%d 0 obj\n' % number + body + b'\nendobj\n'
+        self.position += len(chunk)
+        return chunk
+
+    def _stream(self, number, content, extra=b''):
+        content = zlib.compress(content)
+        return self._object(
+            number,
+            b'<< /Length %d /Filter /FlateDecode%s >>\nstream\n'
+            % (len(content), extra) + content + b'\nendstream'
+        )
+
+    # Ширина текста в пунктах
+    def _text_width(self, text, size):
+        if self.font is None:
+            return len(text) * size * 0.55
+        return sum(
+            self.font.width(self.font.glyphs.get(ord(char), 0))
+            for char in text
+        ) * size / 1000
+
+    # Текст в виде строки PDF: для встроенного шрифта - номера глифов
+    def _encode(self, text):
+        if self.font is None:
+            return pdf_string(text)
+        glyphs = []
+        for char in text:
+            glyph = self.font.glyphs.get(ord(char), 0)
+            self.used_glyphs.setdefault(glyph, char)
+            glyphs.append(b'%04X' % glyph)
+        return b'<' + b''.join(glyphs) + b'>'
+
+    # Перенос строки по словам, чтобы она поместилась в ширину страницы
+    def _wrap(self, text, size):
+        width = PAGE_WIDTH - 2 * MARGIN
+        line = ''
+        for word in text.split(' '):
+            candidate = f'{line} {word}' if line else word
+            if line and self._text_width(candidate, size) > width:
+                yield line
+                line = word
+            else:
+                line = candidate
+        yield line
+
+    def _page(self, lines):
+        content = [b'BT']
+        y = PAGE_HEIGHT - MARGIN
+        for text, size in lines:
+            content.append(
+                b'/F1 %d Tf 1 0 0 1 %d %d Tm %s Tj'
+                % (size, MARGIN, y, self._encode(text))
+            )
+            y -= LINE_HEIGHT if size == FONT_SIZE else LINE_HEIGHT * 2
+        content.append(b'ET')
+        number = FIRST_PAGE + 2 * len(self.page_numbers)
+        self.page_numbers.append(number)
+        return self._stream(number + 1, b'\n'.join(content)) + self._object(
+            number,
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] '
+            b'/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>'
+            % (PAGES, PAGE_WIDTH, PAGE_HEIGHT, FONT, number + 1)
+        )
+
+    def _fonts(self):
+        if self.font is None:
+            yield self._object(
+                FONT,
+                b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+                b'/Encoding /WinAnsiEncoding >>'
+            )
+            return
+        # Имя подмножества шрифта по стандарту PDF: префикс из шести букв
+        name = b'FGSUBS+' + self.font.name.encode('ascii', 'replace')
+        yield self._object(
+            FONT,
+            b'<< /Type /Font /Subtype /Type0 /BaseFont /%s '
+            b'/Encoding /Identity-H /DescendantFonts [%d 0 R] '
+            b'/ToUnicode %d 0 R >>' % (name, CID_FONT, TO_UNICODE)
+        )
+        widths = b' '.join(
+            b'%d [%d]' % (glyph, self.font.width(glyph))
+            for glyph in sorted(self.used_glyphs)
+        )
+        yield self._object(
+            CID_FONT,
+            b'<< /Type /Font /Subtype /CIDFontType2 /BaseFont /%s '
+            b'/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) '
+            b'/Supplement 0 >> /FontDescriptor %d 0 R /W [%s] '
+            b'/CIDToGIDMap /Identity >>' % (name, DESCRIPTOR, widths)
+        )
+        yield self._object(
+            DESCRIPTOR,
+            b'<< /Type /FontDescriptor /FontName /%s /Flags 32 '
+            b'/FontBBox [%d %d %d %d] /ItalicAngle 0 /Ascent %d '
+            b'/Descent %d /CapHeight %d /StemV 80 /FontFile2 %d 0 R >>'
+            % (name, *self.font.bbox, self.font.ascent, self.font.descent,
+               self.font.ascent, FONT_FILE)
+        )
+        font_file = self.font.subset(self.used_glyphs)
+        yield self._stream(
+            FONT_FILE,
+            font_file,
+            b' /Length1 %d' % len(font_file)
+        )
+        mappings = sorted(self.used_glyphs.items())
+        blocks = []
+        for start in range(0, len(mappings), 100):
+            block = mappings[start:start + 100]
+            blocks.append(b'%d beginbfchar\n' % len(block) + b'\n'.join(
+                b'<%04X> <%s>' % (
+                    glyph, char.encode('utf-16-be').hex().upper().encode()
+                ) for glyph, char in block
+            ) + b'\nendbfchar')
+        yield self._stream(TO_UNICODE, b'\n'.join((
+            b'/CIDInit /ProcSet findresource begin 12 dict begin begincmap',
+            b'/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) '
+            b'/Supplement 0 >> def',
+            b'/CMapName /Adobe-Identity-UCS def /CMapType 2 def',
+            b'1 begincodespacerange <0000> <FFFF> endcodespacerange',
+            *blocks,
+            b'endcmap CMapName currentdict /CMap defineresource pop end end'
+        )))
+
+    # Вывод документа по частям: заголовок, страницы, шрифт, каталог и
+    # таблица xref
+    def stream(self, lines):
+        header = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+        self.position = len(header)
+        yield header
+        per_page = (PAGE_HEIGHT - 2 * MARGIN) // LINE_HEIGHT
+        page = [(self.title, TITLE_FONT_SIZE)]
+        used = 2
+        for line in lines:
+            for part in self._wrap(line, FONT_SIZE):
+                if used >= per_page:
+                    yield self._page(page)
+                    page, used = [], 0
+                page.append((part, FONT_SIZE))
+                used += 1
+        yield self._page(page)
+        yield from self._fonts()
+        kids = b' '.join(b'%d 0 R' % number for number in self.page_numbers)
+        yield self._object(
+            PAGES,
+            b'<< /Type /Pages /Kids [%s] /Count %d >>'
+            % (kids, len(self.page_numbers))
+        )
+        yield self._object(CATALOG, b'<< /Type /Catalog /Pages %d 0 R >>'
+                           % PAGES)
+        count = max(self.offsets) + 1
+        entries = [b'0000000000 65535 f \n'] + [
+            b'%010d 00000 n \n' % self.offsets.get(number, 0)
+            if number in self.offsets else b'0000000000 65535 f \n'
+            for number in range(1, count)
+        ]
+        yield (
+            b'xref\n0 %d\n' % count + b''.join(entries)
+            + b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+            % (count, CATALOG, self.position)
+        )
@@ -11,6 +11,10 @@ class IsAdminOrAuthorOrReadOnly(BasePermission):
     def has_permission(self, request, view):
         return request.method in SAFE_METHODS or request.user.is_authenticated
 
-    # Разрешение на выполнение действия на уровне определенного объекта
+    # Разрешение на выполнение действия на уровне определенного объекта.
+    # Автор сравнивается по id, без запроса автора из БД
     def has_object_permission(self, request, view, obj):
-        return request.method in SAFE_METHODS or obj.author == request.user
+        return (
+            request.method in SAFE_METHODS
+            or obj.author_id == request.user.pk
+        )
@@ -0,0 +1,327 @@
+"""
+Профилирование отдельных запросов администраторов: запрос с заголовком
+X-Profile или параметром profile выполняется под cProfile. При значении
+store отчет сохраняется в settings.PROFILE_DIR (имя файла - в заголовке
+X-Profile-Report), при любом другом значении возвращается вместо ответа.
+Отчет содержит время по слоям (DRF, djoser, Django, код проекта), время
+методов SerializerMethodField, дерево вызовов и самые долгие функции; файл
+.prof можно открыть в snakeviz. Остальные запросы проверяются только на
+наличие заголовка и параметра.
+
+Под ASGI профилируются поток цикла событий и поток запроса, в котором
+выполняется синхронный код (sync_to_async). В отчет могут попасть
+сопрограммы других запросов, которые выполнялись в это время.
+"""
+import os
+import re
+import sysconfig
+from collections import defaultdict
+from cProfile import Profile
+from io import StringIO
+from pathlib import Path
+from pstats import Stats
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.decorators import sync_and_async_middleware
+from rest_framework.exceptions import APIException
+from rest_framework.fields import SerializerMethodField
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .instrumentation import request_timing
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAM = 'profile'
+# Значение флага профилирования: сохранить отчет, а не возвращать его
+STORE_MODE = 'store'
+# В дереве вызовов не показываются вызовы короче этой доли времени запроса,
+# а также вызовы глубже TREE_MAX_DEPTH. Дерево ограничено TREE_MAX_LINES
+# строками
+TREE_MIN_SHARE = 0.005
+TREE_MAX_DEPTH = 40
+TREE_MAX_LINES = 500
+# Количество строк в списках самых долгих функций
+TOP_FUNCTIONS = 30
+
+# Ожидание событий в цикле событий (под ASGI): в это время код запроса
+# выполняется в другом потоке, поэтому время ожидания не относится к слоям
+IDLE_FUNCTIONS = (
+    "<method 'poll' of 'select.epoll' objects>",
+    "<method 'control' of 'select.kqueue' objects>",
+    '<built-in method select.select>'
+)
+STDLIB_DIR = Path(sysconfig.get_path('stdlib'))
+
+# Функция SerializerMethodField, из которой вызываются методы get_<поле>
+METHOD_FIELD_CALLER = (
+    SerializerMethodField.to_representation.__code__.co_filename,
+    SerializerMethodField.to_representation.__code__.co_firstlineno,
+    SerializerMethodField.to_representation.__code__.co_name
+)
+
+
+# Режим профилирования из заголовка или параметра запроса, None - запрос
+# не профилируется
+def get_profile_mode(request):
+    mode = request.META.get(PROFILE_HEADER)
+    if mode is None and PROFILE_PARAM in request.META.get('QUERY_STRING', ''):
+        mode = request.GET.get(PROFILE_PARAM)
+    return mode or None
+
+
+# Проверка, что запрос выполняет администратор. Пользователь определяется
+# аутентификацией DRF (до DRF-представления)
+def is_staff_request(request):
+    drf_request = Request(request, authenticators=[
+        authentication() for authentication
+        in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    ])
+    try:
+        return drf_request.user.is_staff
+    except APIException:
+        return False
+
+
+# Путь файла относительно проекта, пакета или стандартной библиотеки
+def get_relative_path(filename):
+    path = Path(filename)
+    if 'site-packages' in path.parts:
+        return Path(*path.parts[path.parts.index('site-packages') + 1:])
+    for base in (settings.BASE_DIR, STDLIB_DIR):
+        if path.is_relative_to(base):
+            return path.relative_to(base)
+    return path
+
+
+# Слой, к которому относится функция: приложение проекта, пакет (для Django
+# отдельно ORM), стандартная библиотека или встроенная функция
+def get_layer(func):
+    filename, _, name = func
+    if filename == '~':
+        if name in IDLE_FUNCTIONS:
+            return 'ожидание в цикле событий'
+        return 'встроенные функции'
+    path = Path(filename)
+    if 'site-packages' in path.parts or path.is_relative_to(
+        settings.BASE_DIR
+    ):
+        parts = get_relative_path(filename).parts
+        if parts[:2] == ('django', 'db'):
+            return 'django.db'
+        return parts[0]
+    return 'стандартная библиотека'
+
+
+# Короткое имя функции: путь, строка, имя
+def get_label(func):
+    filename, line, name = func
+    if filename == '~':
+        return name
+    return f'{get_relative_path(filename)}:{line}({name})'
+
+
+class RequestProfile:
+    """Профилировщики запроса и отчет по их результатам."""
+
+    def __init__(self, request, mode):
+        self.request = request
+        self.mode = mode
+        self.profilers = []
+        self.start = perf_counter()
+
+    def add_profiler(self):
+        profiler = Profile()
+        self.profilers.append(profiler)
+        return profiler
+
+    # Общая статистика профилировщиков, которые что-то записали
+    def get_stats(self, stream):
+        stats = Stats(stream=stream)
+        for profiler in self.profilers:
+            profiler.create_stats()
+            if profiler.stats:
+                stats.add(profiler)
+        return stats
+
+    # Собственное время функций по слоям
+    def write_layers(self, lines, stats):
+        layers = defaultdict(float)
+        for func, (_, _, own, _, _) in stats.stats.items():
+            layers[get_layer(func)] += own
+        lines.append('Время по слоям (собственное время функций):')
+        for layer, own in sorted(layers.items(), key=lambda item: -item[1]):
+            lines.append(f'{own * 1000:10.1f} мс  {layer}')
+
+    # Методы get_<поле> полей SerializerMethodField: количество вызовов и
+    # общее время
+    def write_method_fields(self, lines, stats):
+        lines.append('Поля SerializerMethodField:')
+        fields = sorted(
+            (callers[METHOD_FIELD_CALLER][3], callers[METHOD_FIELD_CALLER][1],
+             func)
+            for func, (_, _, _, _, callers) in stats.stats.items()
+            if METHOD_FIELD_CALLER in callers and func[0] != '~'
+        )
+        for total, calls, func in reversed(fields):
+            lines.append(
+                f'{total * 1000:10.1f} мс {calls:>7}  {get_label(func)}'
+            )
+        if not fields:
+            lines.append('    нет')
+
+    # Дерево вызовов по связям вызывающая - вызываемая функция. Время
+    # функции, которая вызывается из разных мест, делится по вызывающим
+    # функциям, но не по полному пути вызова
+    def write_tree(self, lines, stats, total):
+        children = defaultdict(list)
+        for func, (_, _, _, _, callers) in stats.stats.items():
+            for caller, (_, calls, _, cumulative) in callers.items():
+                children[caller].append((cumulative, calls, func))
+        roots = sorted(
+            (cumulative, calls, func)
+            for func, (_, calls, _, cumulative, callers)
+            in stats.stats.items()
+            if not callers
+        )
+        min_time = total * TREE_MIN_SHARE
+        max_lines = len(lines) + TREE_MAX_LINES
+        lines.append(
+            f'Дерево вызовов (время, вызовы; без вызовов короче '
+            f'{min_time * 1000:.1f} мс):'
+        )
+
+        def write(node, depth, path):
+            cumulative, calls, func = node
+            lines.append(
+                f'{cumulative * 1000:10.1f} мс {calls:>7}  '
+                f'{"  " * depth}{get_label(func)}'
+            )
+            if depth >= TREE_MAX_DEPTH or len(lines) >= max_lines:
+                return
+            for child in sorted(children[func], reverse=True):
+                if child[0] >= min_time and child[2] not in path:
+                    write(child, depth + 1, path | {child[2]})
+
+        for root in reversed(roots):
+            if root[0] >= min_time:
+                write(root, 0, {root[2]})
+
+    def report(self, response):
+        elapsed = perf_counter() - self.start
+        stream = StringIO()
+        stats = self.get_stats(stream)
+        lines = [
+            f'{self.request.method} {self.request.get_full_path()} - '
+            f'{response.status_code}, {elapsed * 1000:.1f} мс'
+        ]
+        timing = request_timing.get()
+        if timing is not None:
+            lines.append(
+                f'Запросов к БД: {timing.queries}, время БД: '
+                f'{timing.db_time * 1000:.1f} мс, сериализация: '
+                f'{timing.serializer_time * 1000:.1f} мс'
+            )
+        for write in (self.write_layers, self.write_method_fields):
+            lines.append('')
+            write(lines, stats)
+        lines.append('')
+        self.write_tree(lines, stats, elapsed)
+        for sort, title in (
+            ('cumulative', 'Функции по общему времени:'),
+            ('tottime', 'Функции по собственному времени:')
+        ):
+            stats.sort_stats(sort).print_stats(TOP_FUNCTIONS)
+            lines.extend(('', title, stream.getvalue()))
+            stream.seek(0)
+            stream.truncate()
+        return stats, '\n'.join(lines)
+
+    # Ответ на профилируемый запрос: отчет вместо ответа или исходный ответ
+    # со ссылкой на сохраненный отчет
+    def respond(self, response):
+        stats, report = self.report(response)
+        if self.mode != STORE_MODE:
+            report_response = HttpResponse(
+                report,
+                content_type='text/plain; charset=utf-8'
+            )
+            report_response['X-Profile-Status'] = str(response.status_code)
+            return report_response
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        path = re.sub(r'\W+', '_', self.request.path).strip('_')[:80]
+        name = (
+            f'{timezone.now():%Y%m%d-%H%M%S-%f}-{self.request.method}-{path}'
+        )
+        stats.dump_stats(os.path.join(settings.PROFILE_DIR, f'{name}.prof'))
+        with open(
+            os.path.join(settings.PROFILE_DIR, f'{name}.txt'),
+            'w',
+            encoding='utf8'
+        ) as file:
+            file.write(report)
+        response['X-Profile-Report'] = f'{name}.txt'
+        return response
+
+
+# Потоковый ответ (например, список покупок) читается целиком, чтобы
+# формирование его содержимого попало в отчет
+def read_streaming(response):
+    if response.streaming:
+        response.streaming_content = list(response.streaming_content)
+    return response
+
+
+async def aread_streaming(response):
+    if response.streaming:
+        if response.is_async:
+            chunks = [chunk async for chunk in response.streaming_content]
+
+            async def content():
+                for chunk in chunks:
+                    yield chunk
+            response.streaming_content = content()
+        else:
+            response.streaming_content = await sync_to_async(list)(
+                response.streaming_content
+            )
+    return response
+
+
+@sync_and_async_middleware
+def request_profiling_middleware(get_response):
+    """Middleware: профилирование запросов администраторов по запросу."""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            mode = get_profile_mode(request)
+            if mode is None or not await sync_to_async(is_staff_request)(
+                request
+            ):
+                return await get_response(request)
+            profile = RequestProfile(request, mode)
+            profiler = profile.add_profiler()
+            # Профилировщик потока, в котором выполняется синхронный код
+            # запроса
+            sync_profiler = profile.add_profiler()
+            await sync_to_async(sync_profiler.enable)()
+            profiler.enable()
+            try:
+                response = await aread_streaming(await get_response(request))
+            finally:
+                profiler.disable()
+                await sync_to_async(sync_profiler.disable)()
+            return profile.respond(response)
+    else:
+        def middleware(request):
+            mode = get_profile_mode(request)
+            if mode is None or not is_staff_request(request):
+                return get_response(request)
+            profile = RequestProfile(request, mode)
+            response = profile.add_profiler().runcall(
+                lambda: read_streaming(get_response(request))
+            )
+            return profile.respond(response)
+    return middleware
@@ -0,0 +1,99 @@
+from csv import writer
+
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer
+
+from .pdf import PdfWriter
+
+# Количество строк списка покупок, которые отдаются одной частью ответа
+ROWS_PER_CHUNK = 100
+
+
+class Echo:
+    """Псевдофайл для csv.writer: возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """
+    Базовый рендерер списка покупок. Метод stream выводит строки списка по
+    частям для StreamingHttpResponse. Метод render используется DRF для
+    ответов с ошибками.
+    """
+    charset = 'utf-8'
+    title = 'Ваш список покупок:'
+
+    # Строки списка: название, количество и единица измерения ингредиента
+    def stream(self, rows):
+        raise NotImplementedError
+
+    # Вывод сообщения (например, об ошибке) в формате рендерера
+    def stream_message(self, lines):
+        raise NotImplementedError
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            lines = [f'{key}: {value}' for key, value in data.items()]
+        else:
+            lines = [str(data)]
+        return b''.join(self.stream_message(lines))
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    """Список покупок в виде текста."""
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, rows):
+        chunk = [f'{self.title}\n']
+        for name, amount, measurement_unit in rows:
+            chunk.append(f'{name} - {amount} {measurement_unit}\n')
+            if len(chunk) >= ROWS_PER_CHUNK:
+                yield ''.join(chunk).encode()
+                chunk = []
+        yield ''.join(chunk).encode()
+
+    def stream_message(self, lines):
+        yield ''.join(f'{line}\n' for line in lines).encode()
+
+
+class ShoppingListCsvRenderer(ShoppingListRenderer):
+    """
+    Список покупок в формате CSV. Файл начинается с BOM, чтобы Excel открыл
+    его в кодировке UTF-8.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    header = ('Ингредиент', 'Количество', 'Единица измерения')
+
+    def stream(self, rows):
+        csv_writer = writer(Echo())
+        chunk = ['\ufeff', csv_writer.writerow(self.header)]
+        for row in rows:
+            chunk.append(csv_writer.writerow(row))
+            if len(chunk) >= ROWS_PER_CHUNK:
+                yield ''.join(chunk).encode()
+                chunk = []
+        yield ''.join(chunk).encode()
+
+    def stream_message(self, lines):
+        csv_writer = writer(Echo())
+        yield ''.join(csv_writer.writerow((line, )) for line in lines).encode()
+
+
+class ShoppingListPdfRenderer(ShoppingListRenderer):
+    """Список покупок в формате PDF (см. api/pdf.py)."""
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+    def stream(self, rows):
+        return PdfWriter(self.title, settings.SHOPPING_LIST_FONT).stream(
+            f'{name} - {amount} {measurement_unit}'
+            for name, amount, measurement_unit in rows
+        )
+
+    def stream_message(self, lines):
+        return PdfWriter('', settings.SHOPPING_LIST_FONT).stream(lines)
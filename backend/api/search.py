@@ -0,0 +1,207 @@
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from threading import Lock
+
+from rest_framework.renderers import JSONRenderer
+
+from .cache import reference_data
+
+# Максимальное количество ингредиентов в результатах поиска
+SEARCH_LIMIT = 50
+
+
+def normalize(value):
+    """Приведение строки к виду, в котором выполняется поиск."""
+    return value.strip().lower().replace('ё', 'е')
+
+
+def allowed_typos(query):
+    """Допустимое количество опечаток в зависимости от длины запроса."""
+    if len(query) < 4:
+        return 0
+    if len(query) < 7:
+        return 1
+    return 2
+
+
+def bigrams(value):
+    """Множество пар соседних символов строки."""
+    return {value[i:i + 2] for i in range(len(value) - 1)}
+
+
+def positional_bigrams(value):
+    """Пары соседних символов строки с позицией первого вхождения."""
+    positions = {}
+    for i in range(len(value) - 1):
+        positions.setdefault(value[i:i + 2], i)
+    return positions
+
+
+def prefix_distance(query, word, max_distance):
+    """
+    Расстояние Левенштейна между запросом и ближайшим к нему началом слова
+    (минимум по всем длинам начала слова) или None, если оно превышает
+    max_distance. Поэтому пропуск буквы в запросе стоит одну опечатку, как и
+    лишняя или замененная буква. Вычисляется только полоса матрицы шириной
+    max_distance вокруг диагонали, вычисление прекращается, как только все
+    значения в строке матрицы превысили порог.
+    """
+    word = word[:len(query) + max_distance]
+    if len(word) < len(query) - max_distance:
+        return None
+    outside = max_distance + 1
+    previous = [j if j <= max_distance else outside
+                for j in range(len(word) + 1)]
+    for i, query_char in enumerate(query, 1):
+        start = max(1, i - max_distance)
+        stop = min(len(word), i + max_distance)
+        current = [outside] * (len(word) + 1)
+        current[0] = i if i <= max_distance else outside
+        row_min = current[0]
+        for j in range(start, stop + 1):
+            value = previous[j - 1] + (query_char != word[j - 1])
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > max_distance:
+            return None
+        previous = current
+    distance = min(previous)
+    return distance if distance <= max_distance else None
+
+
+class IngredientSearchIndex:
+    """
+    Индекс ингредиентов в памяти процесса. Строится из кэша справочников
+    (api/cache.py) и перестраивается при смене его версии.
+    Результаты поиска упорядочены так: сначала ингредиенты, название которых
+    начинается с запроса, затем содержащие запрос, затем похожие на запрос
+    с учетом опечаток (по возрастанию количества опечаток, затем по
+    названию). Расстояние Левенштейна вычисляется только для слов, у начала
+    которых достаточно общих с запросом пар символов: каждая опечатка меняет
+    не более двух пар.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._snapshot = None
+
+    # Построение индекса: строки отсортированы по нормализованному названию,
+    # что позволяет искать по префиксу бинарным поиском. Индекс неизменяем,
+    # поэтому его можно читать из нескольких потоков без блокировки
+    def _build(self, source):
+        rows = sorted(
+            source,
+            key=lambda row: (normalize(row['name']), row['id'])
+        )
+        names = [normalize(row['name']) for row in rows]
+        words = [name.split() for name in names]
+        # Для каждой пары символов хранятся слова, в которых она встречается,
+        # упорядоченные по позиции пары в слове
+        postings = defaultdict(list)
+        for index, name_words in enumerate(words):
+            for word_number, word in enumerate(name_words):
+                for bigram, position in positional_bigrams(word).items():
+                    postings[bigram].append((position, index, word_number))
+        for entries in postings.values():
+            entries.sort()
+        rendered = JSONRenderer().render(
+            sorted(rows, key=lambda row: (row['name'], row['id']))
+        )
+        return {
+            'source': source,
+            'rows': rows,
+            'names': names,
+            'words': words,
+            'postings': postings,
+            'rendered': rendered
+        }
+
+    # Индекс перестраивается, если кэш справочников вернул новый список
+    # ингредиентов. Список source можно передать готовым (например, из
+    # ReferenceDataCache.asnapshot), тогда кэш справочников не проверяется
+    def _get_snapshot(self, source=None):
+        if source is None:
+            source = reference_data.ingredient_rows()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot['source'] is not source:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or snapshot['source'] is not source:
+                    snapshot = self._snapshot = self._build(source)
+        return snapshot
+
+    # Все ингредиенты в виде готового JSON
+    def rendered(self, source=None):
+        return self._get_snapshot(source)['rendered']
+
+    # Ингредиенты, похожие на запрос с учетом опечаток, по возрастанию
+    # количества опечаток и по названию (индексы строк упорядочены по
+    # названию)
+    def _similar(self, snapshot, query, seen, limit):
+        max_typos = allowed_typos(query)
+        if not max_typos or limit <= 0:
+            return []
+        query_bigrams = bigrams(query)
+        threshold = max(len(query_bigrams) - 2 * max_typos, 1)
+        # Сравнивается только начало слова длиной не больше длины запроса и
+        # количества опечаток, поэтому пары, расположенные дальше от начала
+        # слова, не учитываются
+        end = (len(query) + max_typos - 1, )
+        hits = Counter()
+        for bigram in query_bigrams:
+            entries = snapshot['postings'].get(bigram, ())
+            hits.update(
+                (index, word_number) for _, index, word_number
+                in entries[:bisect_left(entries, end)]
+            )
+        distances = {}
+        for (index, word_number), count in hits.items():
+            if index in seen or count < threshold:
+                continue
+            distance = prefix_distance(
+                query,
+                snapshot['words'][index][word_number],
+                max_typos
+            )
+            if distance is not None and distance < distances.get(
+                index, max_typos + 1
+            ):
+                distances[index] = distance
+        found = sorted(
+            distances,
+            key=lambda index: (distances[index], index)
+        )[:limit]
+        seen.update(found)
+        return found
+
+    # Поиск ингредиентов по названию
+    def search(self, query, limit=SEARCH_LIMIT, source=None):
+        snapshot = self._get_snapshot(source)
+        rows, names = snapshot['rows'], snapshot['names']
+        query = normalize(query)
+        if not query:
+            return rows[:limit]
+        found = []
+        for index in range(bisect_left(names, query), len(names)):
+            if len(found) >= limit or not names[index].startswith(query):
+                break
+            found.append(index)
+        seen = set(found)
+        for index, name in enumerate(names):
+            if len(found) >= limit:
+                break
+            if index not in seen and query in name:
+                found.append(index)
+                seen.add(index)
+        found.extend(
+            self._similar(snapshot, query, seen, limit - len(found))
+        )
+        return [rows[index] for index in found]
+
+
+ingredient_index = IngredientSearchIndex()
@@ -1,12 +1,27 @@
+import base64
+import binascii
+
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
 from djoser.serializers import UserSerializer
 from drf_extra_fields.fields import Base64ImageField
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Subscription, Tag)
+from recipes.models import (Ingredient, Recipe, RecipeIngredient,
+                            ShoppingListItem, Subscription, Tag)
 from rest_framework import serializers
 from users.models import CustomUser
 
+from .cache import reference_data
+from .images import get_image_hash, get_variant
+from .instrumentation import TimedSerializerMixin
+
+# Наибольшее количество ингредиента в рецепте (PositiveSmallIntegerField)
+MAX_INGREDIENT_AMOUNT = 32767
+# Наибольшее количество объектов в одном запросе массового добавления или
+# удаления
+MAX_BATCH_SIZE = 100
 
-class TagSerializer(serializers.ModelSerializer):
+
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор для тегов."""
 
     class Meta:
@@ -14,7 +29,8 @@ class TagSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin,
+                           serializers.ModelSerializer):
     """Сериализатор для ингредиентов."""
 
     class Meta:
@@ -22,11 +38,81 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class CustomUserSerializer(TimedSerializerMixin, UserSerializer):
+    """
+    Сериализатор для пользователей (эндпоинты djoser). Отличается от
+    сериализатора djoser только учетом времени в замерах запроса.
+    """
+
+
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Поле первичного ключа справочника (тег, ингредиент). Объект ищется в
+    кэше справочников функцией lookup, без запроса к БД.
+    """
+
+    def __init__(self, lookup, **kwargs):
+        self.lookup = lookup
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        obj = self.lookup(pk)
+        if obj is None:
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
+
+class RecipeImageField(Base64ImageField):
+    """
+    Картинка рецепта в base64. Если при редактировании рецепта передана та
+    же картинка (совпадает хеш содержимого), то она не проверяется и не
+    сохраняется повторно. Хеш новой картинки сохраняется вместе с ней
+    (RecipeCreateUpdateSerializer.with_image_hash).
+    """
+
+    def to_internal_value(self, data):
+        instance = getattr(self.parent, 'instance', None)
+        if instance is not None and instance.image_hash and isinstance(
+            data,
+            str
+        ):
+            try:
+                decoded_file = base64.b64decode(data.split(';base64,')[-1])
+            except (TypeError, binascii.Error, ValueError):
+                decoded_file = None
+            if (decoded_file
+                    and get_image_hash(decoded_file) == instance.image_hash):
+                return instance.image
+        return super().to_internal_value(data)
+
+
+class ImageVariantField(serializers.ImageField):
+    """
+    Ссылка на вариант картинки рецепта (api/images.py). Пока вариант не
+    построен, возвращается ссылка на оригинал.
+    """
+
+    def __init__(self, variant, **kwargs):
+        self.variant = variant
+        kwargs.update(source='*', read_only=True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        return super().to_representation(get_variant(recipe, self.variant))
+
+
 class RecipeIngredientSerializer(serializers.ModelSerializer):
     """Сериализатор для ингредиентов в рецепте."""
-    id = serializers.PrimaryKeyRelatedField(
+    id = CachedPrimaryKeyRelatedField(
         source='ingredient',
-        queryset=Ingredient.objects.all()
+        queryset=Ingredient.objects.all(),
+        lookup=reference_data.ingredient
     )
     name = serializers.StringRelatedField(source='ingredient.name')
     measurement_unit = serializers.StringRelatedField(
@@ -38,14 +124,36 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeIngredientReadSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор для ингредиентов в рецепте (просмотр рецептов). Использует
+    только предварительно выбранные данные и не обращается к БД.
+    """
+    id = serializers.ReadOnlyField(source='ingredient_id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit'
+    )
+
+    class Meta:
+        model = RecipeIngredient
+        fields = ('id', 'name', 'measurement_unit', 'amount')
+
+
+class RecipeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор для рецептов (просмотр рецептов)."""
     tags = TagSerializer(many=True)
     author = UserSerializer(default=serializers.CurrentUserDefault())
-    ingredients = serializers.SerializerMethodField()
+    ingredients = RecipeIngredientReadSerializer(
+        source='recipe_ingredient',
+        many=True,
+        read_only=True
+    )
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField()
+    image_thumbnail = ImageVariantField('thumbnail')
+    image_detail = ImageVariantField('detail')
 
     class Meta:
         model = Recipe
@@ -58,51 +166,35 @@ class RecipeSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_thumbnail',
+            'image_detail',
             'text',
             'cooking_time'
         )
 
-    # Получение ингредиентов определенного рецепта
-    def get_ingredients(self, obj):
-        ingredients = RecipeIngredient.objects.filter(
-            recipe=obj
-        ).order_by(
-            'ingredient__name'
-        )
-        return RecipeIngredientSerializer(ingredients, many=True).data
-
-    # Получение пользователя и проверка авторизован ли он
-    def get_and_check_user(self):
-        user = self.context.get('request').user
-        if user.is_authenticated:
-            return user
-
-    # Получение пользователя и проверка, что рецепт находится в избранном у
-    # пользователя
+    # Проверка, что рецепт находится в избранном у пользователя. Значение
+    # вычисляется в основном запросе (Recipe.objects.with_user_flags), для
+    # анонимного пользователя - None
     def get_is_favorited(self, obj):
-        user = self.get_and_check_user()
-        return user and Favorite.objects.filter(
-            user=user,
-            recipe=obj
-        ).exists()
+        return getattr(obj, 'is_favorited', None)
 
-    # Получение пользователя и проверка, что рецепт находится в списке
-    # покупок у пользователя
+    # Проверка, что рецепт находится в списке покупок у пользователя. Значение
+    # вычисляется в основном запросе (Recipe.objects.with_user_flags), для
+    # анонимного пользователя - None
     def get_is_in_shopping_cart(self, obj):
-        user = self.get_and_check_user()
-        return user and ShoppingCart.objects.filter(
-            user=user,
-            recipe=obj
-        ).exists()
+        return getattr(obj, 'is_in_shopping_cart', None)
 
 
 class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
     """Сериализатор для рецептов (создание и редактирование рецептов)."""
+    tags = CachedPrimaryKeyRelatedField(
+        queryset=Tag.objects.all(),
+        lookup=reference_data.tag,
+        many=True
+    )
     author = UserSerializer(default=serializers.CurrentUserDefault())
     ingredients = RecipeIngredientSerializer(many=True)
-    is_favorited = serializers.SerializerMethodField()
-    is_in_shopping_cart = serializers.SerializerMethodField()
-    image = Base64ImageField()
+    image = RecipeImageField()
 
     class Meta:
         model = Recipe
@@ -111,82 +203,180 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
             'tags',
             'author',
             'ingredients',
-            'is_favorited',
-            'is_in_shopping_cart',
             'name',
             'image',
             'text',
             'cooking_time'
         )
 
-    # Получение пользователя и проверка авторизован ли он
-    def get_and_check_user(self):
-        user = self.context.get('request').user
-        if user.is_authenticated:
-            return user
+    # Объединение повторяющихся ингредиентов: количества одного ингредиента
+    # складываются
+    def validate_ingredients(self, value):
+        amounts = {}
+        for ingredient_data in value:
+            ingredient = ingredient_data['ingredient']
+            amounts[ingredient] = (
+                amounts.get(ingredient, 0) + ingredient_data['amount']
+            )
+            if amounts[ingredient] > MAX_INGREDIENT_AMOUNT:
+                raise serializers.ValidationError(
+                    f'Количество ингредиента {ingredient} больше '
+                    f'{MAX_INGREDIENT_AMOUNT}!'
+                )
+        return [
+            {'ingredient': ingredient, 'amount': amount}
+            for ingredient, amount in amounts.items()
+        ]
+
+    # Добавление тегов рецепта одним запросом. Теги записываются напрямую в
+    # промежуточную таблицу: дата изменения и версия рецептов обновляются
+    # при сохранении самого рецепта
+    def add_tags(self, recipe, tag_ids):
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag_id=tag_id)
+            for tag_id in tag_ids
+        )
 
-    # Получение пользователя и проверка, что рецепт находится в избранном у
-    # пользователя
-    def get_is_favorited(self, obj):
-        user = self.get_and_check_user()
-        return user and Favorite.objects.filter(
-            user=user,
-            recipe=obj
-        ).exists()
+    # Добавление ингредиентов рецепта одним запросом
+    def add_ingredients(self, recipe, amounts):
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient_id=ingredient_id,
+                amount=amount
+            ) for ingredient_id, amount in amounts.items()
+        )
 
-    # Получение пользователя и проверка, что рецепт находится в списке
-    # покупок у пользователя
-    def get_is_in_shopping_cart(self, obj):
-        user = self.get_and_check_user()
-        return user and ShoppingCart.objects.filter(
-            user=user,
-            recipe=obj
-        ).exists()
+    # Количества ингредиентов рецепта по id ингредиента
+    def get_amounts(self, ingredients):
+        return {
+            ingredient_data['ingredient'].id: ingredient_data['amount']
+            for ingredient_data in ingredients
+        }
+
+    # Хеш содержимого новой картинки: вычисляется по декодированным
+    # данным запроса и сохраняется вместе с картинкой. Если картинка не
+    # изменилась, то поле image содержит текущий файл рецепта
+    def with_image_hash(self, validated_data):
+        image = validated_data.get('image')
+        if isinstance(image, UploadedFile):
+            validated_data['image_hash'] = get_image_hash(
+                b''.join(image.chunks())
+            )
+        return validated_data
 
     # Создание нового рецепта
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        recipe = Recipe.objects.create(**validated_data)
-        recipe.tags.set(tags)
-        for ingredient_data in ingredients:
-            ingredient = ingredient_data.get('ingredient')
-            amount = ingredient_data.get('amount')
-            RecipeIngredient.objects.create(
-                recipe=recipe,
-                ingredient=ingredient,
-                amount=amount
+        with transaction.atomic():
+            recipe = Recipe.objects.create(
+                **self.with_image_hash(validated_data)
             )
+            self.add_tags(recipe, dict.fromkeys(tag.id for tag in tags))
+            self.add_ingredients(recipe, self.get_amounts(ingredients))
         return recipe
 
-    # Обновление существующего рецепта
+    # Обновление существующего рецепта. Изменяются только те теги и
+    # ингредиенты, которые изменились. Текущие теги и ингредиенты берутся из
+    # предварительной выборки (Recipe.objects.with_related). Если
+    # ингредиенты изменились, то списки покупок пользователей, у которых
+    # рецепт в корзине, пересчитываются в той же транзакции: старые
+    # ингредиенты вычитаются, новые - прибавляются. Ингредиенты удаляются,
+    # изменяются и добавляются без сигналов моделей: дата изменения, версия
+    # рецептов и поисковый индекс обновляются один раз при сохранении
+    # рецепта
     def update(self, recipe, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        recipe.tags.clear()
-        recipe.ingredients.clear()
-        recipe.tags.set(tags)
-        for ingredient_data in ingredients:
-            ingredient = ingredient_data.get('ingredient')
-            amount = ingredient_data.get('amount')
-            RecipeIngredient.objects.create(
-                recipe=recipe,
-                ingredient=ingredient,
-                amount=amount
+        tag_ids = {tag.id for tag in tags}
+        current_tag_ids = {tag.id for tag in recipe.tags.all()}
+        amounts = self.get_amounts(ingredients)
+        current = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in recipe.recipe_ingredient.all()
+        }
+        removed = current.keys() - amounts.keys()
+        changed = [
+            current[ingredient_id]
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id in current
+            and current[ingredient_id].amount != amount
+        ]
+        added = {
+            ingredient_id: amount
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in current
+        }
+        ingredients_changed = removed or changed or added
+        with transaction.atomic():
+            if ingredients_changed:
+                ShoppingListItem.objects.apply_recipe(recipe, -1)
+            if current_tag_ids - tag_ids:
+                Recipe.tags.through.objects.filter(
+                    recipe=recipe,
+                    tag_id__in=current_tag_ids - tag_ids
+                ).delete()
+            self.add_tags(recipe, tag_ids - current_tag_ids)
+            if removed:
+                # QuerySet.delete() отправляет post_delete для каждой строки
+                RecipeIngredient.objects.filter(
+                    recipe=recipe,
+                    ingredient_id__in=removed
+                )._raw_delete(RecipeIngredient.objects.db)
+            for recipe_ingredient in changed:
+                recipe_ingredient.amount = amounts[
+                    recipe_ingredient.ingredient_id
+                ]
+            RecipeIngredient.objects.bulk_update(changed, ('amount', ))
+            self.add_ingredients(recipe, added)
+            recipe = super().update(
+                recipe,
+                self.with_image_hash(validated_data)
             )
-        return super().update(recipe, validated_data)
+            if ingredients_changed:
+                ShoppingListItem.objects.apply_recipe(recipe, 1)
+        return recipe
 
-    # Преобразует объект в формат, подходящий для представления
+    # Преобразует объект в формат, подходящий для представления. Рецепт
+    # перечитывается тем же запросом, что и в списке рецептов, чтобы флаги
+    # is_favorited и is_in_shopping_cart вычислялись одним запросом
     def to_representation(self, recipe):
         request = self.context.get('request')
         context = {'request': request}
+        recipe = Recipe.objects.with_user_flags(
+            request.user
+        ).with_related().get(pk=recipe.pk)
         return RecipeSerializer(recipe, context=context).data
 
 
-class SubscriptionSerializer(serializers.ModelSerializer):
-    """Сериализатор для подписки на автора рецепта."""
+class RecipesLimitSerializer(serializers.Serializer):
+    """Сериализатор для проверки параметра запроса recipes_limit."""
+    recipes_limit = serializers.IntegerField(min_value=0, required=False)
+
+
+class BatchSerializer(serializers.Serializer):
+    """
+    Сериализатор для проверки списка id объектов в запросах массового
+    добавления и удаления.
+    """
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BATCH_SIZE
+    )
+
+
+class SubscriptionSerializer(TimedSerializerMixin,
+                             serializers.ModelSerializer):
+    """
+    Сериализатор для подписки на автора рецепта. Если рецепты автора и
+    признак подписки уже вычислены в запросе (см.
+    CustomUserViewSet.subscriptions), то они берутся из объекта. Количество
+    рецептов хранится в поле автора recipes_count (см. api/signals.py).
+    """
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -202,25 +392,38 @@ class SubscriptionSerializer(serializers.ModelSerializer):
             'recipes_count'
         )
 
+    # Получение и проверка параметра recipes_limit. Проверка выполняется
+    # один раз на весь список авторов
+    def get_recipes_limit(self):
+        if 'recipes_limit' not in self.context:
+            params = RecipesLimitSerializer(
+                data=self.context.get('request').query_params
+            )
+            params.is_valid(raise_exception=True)
+            self.context['recipes_limit'] = params.validated_data.get(
+                'recipes_limit'
+            )
+        return self.context['recipes_limit']
+
     # Получение рецептов, созданных автором
     def get_recipes(self, obj):
         request = self.context.get('request')
-        recipes = Recipe.objects.filter(author=obj)
-        recipes_limit = request.query_params.get('recipes_limit')
         context = {'request': request}
-        if recipes_limit:
-            recipes = recipes[:int(recipes_limit)]
+        recipes = getattr(obj, 'limited_recipes', None)
+        if recipes is None:
+            recipes = Recipe.objects.filter(author=obj)
+            recipes_limit = self.get_recipes_limit()
+            if recipes_limit is not None:
+                recipes = recipes[:recipes_limit]
         return RecipeFavoriteSerializer(
             recipes,
             many=True,
             context=context).data
 
-    # Получение количества рецептов, созданных автором
-    def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj).count()
-
     # Проверка, что текущий пользователь подписан на автора рецепта
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         return user.is_authenticated and Subscription.objects.filter(
             user=user,
@@ -228,8 +431,10 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         ).exists()
 
 
-class RecipeFavoriteSerializer(serializers.ModelSerializer):
+class RecipeFavoriteSerializer(TimedSerializerMixin,
+                               serializers.ModelSerializer):
     """Сериализатор для рецептов, находящихся в избранном."""
+    image_thumbnail = ImageVariantField('thumbnail')
 
     class Meta:
         model = Recipe
@@ -237,5 +442,6 @@ class RecipeFavoriteSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_thumbnail',
             'cooking_time'
         )
@@ -0,0 +1,224 @@
+from django.db import transaction
+from django.db.models import F, QuerySet
+from django.db.models.functions import Greatest
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from recipes.fulltext import delete_from_search_index, update_search_index
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from users.models import CustomUser
+
+from .cache import (RECIPES_VERSION_KEY, USER_FLAGS_VERSION_KEY, bump_version,
+                    reference_data)
+from .images import schedule_variants, variants_ready
+
+# Поля пользователя, которые выводятся в данных автора рецепта
+AUTHOR_FIELDS = {'username', 'first_name', 'last_name', 'email'}
+# Счетчики рецепта, которые меняются при добавлении рецепта в избранное и в
+# список покупок и при удалении из них
+RECIPE_COUNTERS = {
+    Favorite: 'favorites_count',
+    ShoppingCart: 'shopping_cart_count'
+}
+
+
+def change_counter(model, pk, field, delta):
+    """
+    Изменение счетчика одним запросом UPDATE (F-выражение) в транзакции, в
+    которой изменяются данные. Счетчик не становится отрицательным, если он
+    разошелся с данными (исправляется командой reconcile_counters).
+    """
+    model.objects.filter(pk=pk).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+
+
+def author_fields_changed(update_fields):
+    """
+    Проверка, что сохранение пользователя могло изменить данные автора
+    рецепта: сохраняются все поля (update_fields не задан) или хотя бы одно
+    из AUTHOR_FIELDS.
+    """
+    return update_fields is None or not AUTHOR_FIELDS.isdisjoint(
+        update_fields
+    )
+
+
+def relations_changed(model, user, object_ids, sign):
+    """
+    Обновление счетчиков рецептов и версии избранного/списка покупок
+    пользователя после массового добавления (sign=1) или удаления (sign=-1)
+    связей (UserRelationQuerySet.add_many и remove_many не отправляют сигналы
+    моделей). Счетчики всех рецептов меняются одним запросом.
+    """
+    if not object_ids or model not in RECIPE_COUNTERS:
+        return
+    field = RECIPE_COUNTERS[model]
+    Recipe.objects.filter(pk__in=object_ids).update(
+        **{field: Greatest(F(field) + sign, 0)}
+    )
+    bump_version(USER_FLAGS_VERSION_KEY.format(user.pk))
+
+
+# Смена версии кэша справочников при изменении или удалении тега или
+# ингредиента
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+def bump_reference_data_version(**kwargs):
+    reference_data.bump_version()
+
+
+# Смена версии рецептов при изменении или удалении рецепта
+@receiver((post_save, post_delete), sender=Recipe)
+def bump_recipes_version(**kwargs):
+    bump_version(RECIPES_VERSION_KEY)
+
+
+# Построение вариантов новой картинки рецепта (api/images.py)
+@receiver(post_save, sender=Recipe)
+def build_image_variants(instance, raw=False, **kwargs):
+    if not raw and instance.image and not variants_ready(instance):
+        schedule_variants(instance)
+
+
+# Связанная запись удаляется каскадом вместе с рецептом (origin - рецепт
+# или QuerySet рецептов): дату изменения, индекс и счетчики удаляемого
+# рецепта обновлять не нужно
+def deleted_with_recipe(origin):
+    return isinstance(origin, Recipe) or (
+        isinstance(origin, QuerySet) and origin.model is Recipe
+    )
+
+
+def schedule_search_index_update(recipe_id):
+    """
+    Обновление поискового индекса рецепта (recipes/fulltext.py) после
+    фиксации транзакции, когда сохранены и рецепт, и его ингредиенты.
+    Рецепты собираются в множество подключения к БД, и первый выполненный
+    после фиксации обработчик обновляет индекс всех рецептов одним
+    запросом, остальные ничего не делают. Рецепты отмененной транзакции
+    переиндексируются вместе со следующей.
+    """
+    connection = transaction.get_connection()
+    if not hasattr(connection, 'pending_search_index'):
+        connection.pending_search_index = set()
+    connection.pending_search_index.add(recipe_id)
+    transaction.on_commit(lambda: flush_search_index(connection))
+
+
+def flush_search_index(connection):
+    recipe_ids = connection.pending_search_index
+    if recipe_ids:
+        connection.pending_search_index = set()
+        update_search_index(sorted(recipe_ids))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def update_recipe_search_index(sender, instance, raw=False, origin=None,
+                               **kwargs):
+    if raw or deleted_with_recipe(origin):
+        return
+    schedule_search_index_update(
+        instance.pk if sender is Recipe else instance.recipe_id
+    )
+
+
+# Переименование ингредиента обновляет индекс рецептов с этим ингредиентом
+@receiver(post_save, sender=Ingredient)
+def update_search_index_on_ingredient_change(instance, created, raw=False,
+                                             **kwargs):
+    if created or raw:
+        return
+    transaction.on_commit(lambda: update_search_index(
+        RecipeIngredient.objects.filter(
+            ingredient=instance
+        ).values_list('recipe_id', flat=True).distinct()
+    ))
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_recipe_from_search_index(instance, **kwargs):
+    delete_from_search_index(instance.pk)
+
+
+# Изменение ингредиентов и тегов рецепта обновляет дату изменения рецепта
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def touch_recipe_on_ingredients_change(instance, origin=None, **kwargs):
+    if deleted_with_recipe(origin):
+        return
+    Recipe.objects.filter(
+        pk=instance.recipe_id
+    ).update(updated=timezone.now())
+    bump_version(RECIPES_VERSION_KEY)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def touch_recipe_on_tags_change(instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        recipes = Recipe.objects.filter(pk=instance.pk)
+    elif action == 'pre_clear':
+        recipes = Recipe.objects.filter(tags=instance)
+    else:
+        recipes = Recipe.objects.filter(pk__in=pk_set)
+    recipes.update(updated=timezone.now())
+    bump_version(RECIPES_VERSION_KEY)
+
+
+# Данные автора выводятся в рецептах. Новый пользователь еще не автор, а
+# сохранение только других полей (last_login, пароль, recipes_count) данные
+# автора в рецептах не меняет
+@receiver((post_save, post_delete), sender=CustomUser)
+def bump_recipes_version_on_author_change(created=False, update_fields=None,
+                                          **kwargs):
+    if created or not author_fields_changed(update_fields):
+        return
+    bump_version(RECIPES_VERSION_KEY)
+
+
+# Изменение автора меняет дату изменения его рецептов: от нее зависит
+# Last-Modified рецепта
+@receiver(post_save, sender=CustomUser)
+def touch_recipes_on_author_change(instance, created, raw=False,
+                                   update_fields=None, **kwargs):
+    if created or raw or not author_fields_changed(update_fields):
+        return
+    Recipe.objects.filter(author=instance).update(updated=timezone.now())
+
+
+# Смена версии избранного и списка покупок пользователя
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def bump_user_flags_version(instance, **kwargs):
+    bump_version(USER_FLAGS_VERSION_KEY.format(instance.user_id))
+
+
+# Счетчики избранного и списка покупок рецепта
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def increment_recipe_counter(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_counter(Recipe, instance.recipe_id, RECIPE_COUNTERS[sender], 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def decrement_recipe_counter(sender, instance, origin=None, **kwargs):
+    if deleted_with_recipe(origin):
+        return
+    change_counter(Recipe, instance.recipe_id, RECIPE_COUNTERS[sender], -1)
+
+
+# Счетчик рецептов автора
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_counter(CustomUser, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(instance, **kwargs):
+    change_counter(CustomUser, instance.author_id, 'recipes_count', -1)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
@@ -18,3 +19,38 @@ urlpatterns = (
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
 )
+
+# Асинхронные обработчики частых запросов на чтение располагаются перед
+# маршрутами вьюсетов и передают им остальные запросы
+if settings.ASYNC_READ_VIEWS:
+    from .async_views import (IngredientListView, RecipeDetailView,
+                              RecipeListView, ShoppingListView, TagListView)
+
+    urlpatterns = (
+        path('tags/', TagListView.as_view(
+            viewset_view=TagViewSet.as_view({'get': 'list', 'post': 'create'})
+        )),
+        path('ingredients/', IngredientListView.as_view(
+            viewset_view=IngredientViewSet.as_view(
+                {'get': 'list', 'post': 'create'}
+            )
+        )),
+        path('recipes/', RecipeListView.as_view(
+            viewset_view=RecipeViewSet.as_view(
+                {'get': 'list', 'post': 'create'}
+            )
+        )),
+        path('recipes/download_shopping_cart/', ShoppingListView.as_view(
+            viewset_view=RecipeViewSet.as_view(
+                {'get': 'download_shopping_cart'},
+                **RecipeViewSet.download_shopping_cart.kwargs
+            )
+        )),
+        path('recipes/<int:pk>/', RecipeDetailView.as_view(
+            viewset_view=RecipeViewSet.as_view({
+                'get': 'retrieve',
+                'patch': 'partial_update',
+                'delete': 'destroy'
+            })
+        )),
+    ) + urlpatterns
@@ -1,7 +1,93 @@
+from functools import wraps
+from hashlib import md5
+
+from django.db import transaction
 from django.shortcuts import get_object_or_404
+from django.utils.cache import (get_conditional_response, patch_vary_headers,
+                                quote_etag)
+from django.utils.http import http_date
 from rest_framework import serializers, status
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
 
+from .serializers import BatchSerializer
+from .signals import relations_changed
+
+
+def parse_pk(value):
+    """Преобразование id из URL в число. Для некорректного id вернет None."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_etag(etag_parts):
+    """ETag из частей, которые определяют версию ресурса."""
+    if etag_parts is None:
+        return None
+    return quote_etag(md5('|'.join(map(str, etag_parts)).encode()).hexdigest())
+
+
+def set_validators(response, etag, timestamp):
+    """Заголовки ETag, Last-Modified и Vary ответа на условный запрос."""
+    if response.status_code in (200, 304):
+        if etag:
+            response['ETag'] = etag
+        if timestamp:
+            response['Last-Modified'] = http_date(timestamp)
+    # Ответ зависит от пользователя (is_favorited, is_in_shopping_cart)
+    patch_vary_headers(response, ('Authorization', ))
+    return response
+
+
+def conditional_get(handler):
+    """
+    Декоратор для методов list и retrieve вьюсета: поддержка условных
+    GET-запросов (If-None-Match / If-Modified-Since). Метод вьюсета
+    get_validators возвращает части ETag и дату изменения ресурса. Если
+    ресурс не изменился, то возвращается ответ 304 без сериализации данных.
+    """
+    @wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        etag_parts, last_modified = self.get_validators(
+            request, *args, **kwargs
+        )
+        etag = get_etag(etag_parts)
+        timestamp = last_modified and int(last_modified.timestamp())
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=timestamp
+        )
+        if response is None:
+            response = handler(self, request, *args, **kwargs)
+        return set_validators(response, etag, timestamp)
+    return wrapper
+
+
+def aconditional_get(handler):
+    """
+    Асинхронный вариант conditional_get для обработчиков
+    api/async_views.py: get_validators и обработчик - корутины.
+    """
+    @wraps(handler)
+    async def wrapper(self, request, *args, **kwargs):
+        etag_parts, last_modified = await self.get_validators(
+            request, *args, **kwargs
+        )
+        etag = get_etag(etag_parts)
+        timestamp = last_modified and int(last_modified.timestamp())
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=timestamp
+        )
+        if response is None:
+            response = await handler(self, request, *args, **kwargs)
+        return set_validators(response, etag, timestamp)
+    return wrapper
+
 
 class AbstractCreateDeleteMixin():
     """
@@ -9,21 +95,32 @@ class AbstractCreateDeleteMixin():
     удаления объектов.
     """
 
-    # Метод выполняет операции добавления и удаления объектов
+    # Метод выполняет операции добавления и удаления объектов. Связь
+    # добавляется и удаляется одним запросом (UserRelationQuerySet), вместе
+    # с выборкой объекта - два запроса; столько же стоит повторное
+    # добавление или удаление (400). Изменение связи стоит дополнительных
+    # запросов в обработчиках сигналов и on_change: обновление счетчика
+    # рецепта (избранное, корзина), пересчет списка покупок (корзина: один
+    # запрос при добавлении, два при удалении), рецепты автора в ответе на
+    # подписку. Всего не больше пяти запросов, без учета запроса
+    # аутентификации по токену и команд транзакции (BEGIN, COMMIT). Функция
+    # on_change(obj, sign, user) вызывается в той же транзакции, только если
+    # объект добавлен (sign=1) или удален (sign=-1)
     def perform_action(self, model, object, serializer, request, pk,
-                       keyword, message_add_fail, message_no_exists):
+                       keyword, message_add_fail, message_no_exists,
+                       on_change=None):
         user = request.user
         obj = get_object_or_404(object, id=pk)
 
         if request.method == 'POST':
-            if model.objects.filter(
-                user=user,
-                **{keyword: obj}
-            ).exists():
+            with transaction.atomic():
+                added = model.objects.add(user=user, **{keyword: obj})
+                if added and on_change:
+                    on_change(obj, 1, user)
+            if not added:
                 raise serializers.ValidationError(
                     {'message': message_add_fail}
                 )
-            model.objects.create(user=user, **{keyword: obj})
             ser = serializer(
                 obj,
                 context={'request': request}
@@ -31,12 +128,73 @@ class AbstractCreateDeleteMixin():
             return Response(ser.data, status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
-            if not model.objects.filter(
-                user=user,
-                **{keyword: obj}
-            ).exists():
+            with transaction.atomic():
+                deleted = model.objects.remove(user=user, **{keyword: obj})
+                if deleted and on_change:
+                    on_change(obj, -1, user)
+            if not deleted:
                 raise serializers.ValidationError(
                     {'message': message_no_exists}
                 )
-            model.objects.get(user=user, **{keyword: obj}).delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
+
+    # Массовое добавление (POST) и удаление (DELETE) объектов из списка id
+    # в теле запроса. Объекты выбираются из queryset одним запросом, связи
+    # добавляются или удаляются одним запросом в одной транзакции. Для
+    # каждого id возвращается код, как у perform_action (201 и данные
+    # объекта, 204, 400 или 404). Функция on_change(objs, sign, user)
+    # вызывается один раз для всех добавленных или удаленных объектов
+    def perform_batch_action(self, model, queryset, serializer, request,
+                             keyword, message_add_fail, message_no_exists,
+                             on_change=None):
+        params = BatchSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(params.validated_data['ids']))
+        user = request.user
+        objs = queryset.in_bulk(ids)
+        found = [objs[pk] for pk in ids if pk in objs]
+        sign = 1 if request.method == 'POST' else -1
+
+        with transaction.atomic():
+            if sign > 0:
+                changed = model.objects.add_many(user, keyword, found)
+            else:
+                changed = model.objects.remove_many(user, keyword, found)
+            changed = set(changed)
+            relations_changed(model, user, changed, sign)
+            if changed and on_change:
+                on_change([obj for obj in found if obj.pk in changed],
+                          sign, user)
+
+        results = []
+        for pk in ids:
+            if pk not in objs:
+                results.append({
+                    'id': pk,
+                    'status': status.HTTP_404_NOT_FOUND,
+                    'errors': {'detail': NotFound.default_detail}
+                })
+            elif pk not in changed:
+                results.append({
+                    'id': pk,
+                    'status': status.HTTP_400_BAD_REQUEST,
+                    'errors': {
+                        'message': message_add_fail if sign > 0
+                        else message_no_exists
+                    }
+                })
+            elif sign > 0:
+                results.append({
+                    'id': pk,
+                    'status': status.HTTP_201_CREATED,
+                    'data': serializer(
+                        objs[pk],
+                        context={'request': request}
+                    ).data
+                })
+            else:
+                results.append({
+                    'id': pk,
+                    'status': status.HTTP_204_NO_CONTENT
+                })
+        return Response(results)
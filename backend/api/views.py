@@ -1,20 +1,65 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from hashlib import md5
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch, Value
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Subscription, Tag)
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListItem, Subscription, Tag)
 from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 from users.models import CustomUser
 
+from .cache import (RECIPES_VERSION_KEY, get_user_flags_version, get_version,
+                    reference_data, single_flight)
 from .filters import IngredientFilter, RecipeFilter
-from .pagination import CustomPagination
+from .pagination import CustomCursorPagination, CustomPagination
 from .permissions import IsAdminOrAuthorOrReadOnly
+from .renderers import (ShoppingListCsvRenderer, ShoppingListPdfRenderer,
+                        ShoppingListTextRenderer)
+from .search import ingredient_index
 from .serializers import (IngredientSerializer, RecipeCreateUpdateSerializer,
                           RecipeFavoriteSerializer, RecipeSerializer,
-                          SubscriptionSerializer, TagSerializer)
-from .utils import AbstractCreateDeleteMixin
+                          RecipesLimitSerializer, SubscriptionSerializer,
+                          TagSerializer)
+from .utils import AbstractCreateDeleteMixin, conditional_get, parse_pk
+
+# Размер части, которыми список покупок выбирается из БД
+SHOPPING_LIST_CHUNK_SIZE = 500
+# Сообщения об ошибках добавления и удаления: объект уже добавлен, объекта
+# нет среди добавленных
+SUBSCRIBE_MESSAGES = (
+    'Вы уже пописаны на этого автора!',
+    'Вы не подписаны на этого автора!'
+)
+FAVORITE_MESSAGES = (
+    'Рецепт уже в избранном!',
+    'Рецепт отсутствует в избранном!'
+)
+SHOPPING_CART_MESSAGES = (
+    'Рецепт уже в корзине!',
+    'Рецепт отсутствует в корзине!'
+)
+
+
+def get_page_cache_key(request):
+    """
+    Ключ кэша страницы списка рецептов: параметры запроса отсортированы,
+    поэтому их порядок в URL не важен. Хост учитывается, так как он входит
+    в ссылки на соседние страницы.
+    """
+    params = urlencode(sorted(
+        (key, value)
+        for key, values in request.GET.lists()
+        for value in values
+    ))
+    key = f'{request.get_host()}?{params}'
+    return f'recipes_page_{md5(key.encode()).hexdigest()}'
 
 
 class CustomUserViewSet(AbstractCreateDeleteMixin, UserViewSet):
@@ -24,22 +69,42 @@ class CustomUserViewSet(AbstractCreateDeleteMixin, UserViewSet):
     pagination_class = CustomPagination
     http_method_names = ('get', 'post', 'patch', 'delete')
 
+    # Авторы с признаком подписки и первыми recipes_limit рецептами. Срез в
+    # Prefetch выполняется оконной функцией: первые N рецептов каждого
+    # автора выбираются одним запросом
+    def get_subscription_queryset(self, recipes_limit):
+        recipes = Recipe.objects.all()
+        if recipes_limit is not None:
+            recipes = recipes[:recipes_limit]
+        return CustomUser.objects.annotate(
+            is_subscribed=Value(True)
+        ).prefetch_related(
+            Prefetch('recipe_set', queryset=recipes, to_attr='limited_recipes')
+        )
+
     # Получение подписчиков пользователя
     @action(
         methods=('get', ),
-        detail=False
+        detail=False,
+        permission_classes=(IsAuthenticated, )
     )
     def subscriptions(self, request):
-        queryset = CustomUser.objects.filter(following__user=request.user)
+        params = RecipesLimitSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        recipes_limit = params.validated_data.get('recipes_limit')
+        queryset = self.get_subscription_queryset(recipes_limit).filter(
+            following__user=request.user
+        ).order_by('-id')
         obj = self.paginate_queryset(queryset)
         serializer = SubscriptionSerializer(
             obj,
             many=True,
-            context={'request': request}
+            context={'request': request, 'recipes_limit': recipes_limit}
         )
         return self.get_paginated_response(serializer.data)
 
-    # Подписка на автора рецепта или отписка от автора рецепта
+    # Подписка на автора рецепта или отписка от автора рецепта. Признак
+    # подписки в ответе известен заранее и не запрашивается отдельно
     @action(
         methods=('post', 'delete'),
         detail=True
@@ -48,22 +113,62 @@ class CustomUserViewSet(AbstractCreateDeleteMixin, UserViewSet):
         author_id = self.kwargs.get('id')
         return self.perform_action(
             Subscription,
-            CustomUser,
+            CustomUser.objects.annotate(is_subscribed=Value(True)),
             SubscriptionSerializer,
             request,
             author_id,
             'author',
-            'Вы уже пописаны на этого автора!',
-            'Вы не подписаны на этого автора!'
+            *SUBSCRIBE_MESSAGES
+        )
+
+    # Подписка на нескольких авторов или отписка от них одним запросом:
+    # список id авторов передается в поле ids
+    @action(
+        methods=('post', 'delete'),
+        detail=False,
+        url_path='subscribe/batch'
+    )
+    def subscribe_batch(self, request):
+        params = RecipesLimitSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return self.perform_batch_action(
+            Subscription,
+            self.get_subscription_queryset(
+                params.validated_data.get('recipes_limit')
+            ),
+            SubscriptionSerializer,
+            request,
+            'author',
+            *SUBSCRIBE_MESSAGES
         )
 
 
 class TagViewSet(ModelViewSet):
-    """Вьюсет тегов."""
+    """Вьюсет тегов. Теги для просмотра берутся из кэша справочников."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (IsAdminOrAuthorOrReadOnly, )
 
+    # Валидаторы условных GET-запросов: версия кэша справочников
+    def get_validators(self, request, *args, **kwargs):
+        return (
+            'tags',
+            reference_data.version(),
+            request.accepted_renderer.format
+        ), None
+
+    @conditional_get
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_serializer(reference_data.tags(), many=True)
+        return Response(serializer.data)
+
+    @conditional_get
+    def retrieve(self, request, *args, **kwargs):
+        tag = reference_data.tag(parse_pk(kwargs.get('pk')))
+        if tag is None:
+            raise Http404
+        return Response(self.get_serializer(tag).data)
+
 
 class IngredientViewSet(ModelViewSet):
     """Вьюсет ингредиентов."""
@@ -73,6 +178,38 @@ class IngredientViewSet(ModelViewSet):
     filter_backends = (DjangoFilterBackend, )
     filterset_class = IngredientFilter
 
+    # Валидаторы условных GET-запросов: версия кэша справочников
+    def get_validators(self, request, *args, **kwargs):
+        return (
+            'ingredients',
+            reference_data.version(),
+            request.accepted_renderer.format
+        ), None
+
+    # Список ингредиентов отдается из индекса в памяти процесса: поиск по
+    # параметру name выполняется без обращения к БД, а полный список
+    # отдается заранее сериализованным JSON. Для остальных форматов
+    # (например, browsable API) используется стандартная обработка
+    @conditional_get
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+        name = request.query_params.get('name')
+        if name:
+            return Response(ingredient_index.search(name))
+        return HttpResponse(
+            ingredient_index.rendered(),
+            content_type='application/json'
+        )
+
+    # Просмотр ингредиента из кэша справочников
+    @conditional_get
+    def retrieve(self, request, *args, **kwargs):
+        ingredient = reference_data.ingredient(parse_pk(kwargs.get('pk')))
+        if ingredient is None:
+            raise Http404
+        return Response(self.get_serializer(ingredient).data)
+
 
 class RecipeViewSet(AbstractCreateDeleteMixin, ModelViewSet):
     """Вьюсет рецептов."""
@@ -84,12 +221,64 @@ class RecipeViewSet(AbstractCreateDeleteMixin, ModelViewSet):
     http_method_names = ('get', 'post', 'patch', 'delete')
 
     # Получение всех объектов модели Recipe с предварительной выборкой
-    # связанных моделей recipe_ingredient__ingredient и tags для
-    # оптимизации запросов к БД за счет сокращения количества обращений к ней
+    # автора, тегов и ингредиентов для оптимизации запросов к БД за счет
+    # сокращения количества обращений к ней. Флаги is_favorited и
+    # is_in_shopping_cart вычисляются в том же запросе. Для удаления
+    # связанные объекты не нужны
     def get_queryset(self):
-        return Recipe.objects.prefetch_related(
-            'recipe_ingredient__ingredient', 'tags'
-        ).all()
+        if self.action == 'destroy':
+            return Recipe.objects.all()
+        return Recipe.objects.with_user_flags(
+            self.request.user
+        ).with_related()
+
+    # Валидаторы условных GET-запросов: версии рецептов, справочников и
+    # избранного/списка покупок пользователя, для рецепта - еще и дата его
+    # изменения. Версия рецептов нужна и рецепту: изменение автора меняет
+    # только ее. Дата изменения (Last-Modified) отдается только анонимным
+    # пользователям: для остальных ответ зависит еще и от избранного и списка
+    # покупок, у которых нет даты изменения
+    def get_validators(self, request, *args, **kwargs):
+        user = request.user
+        etag_parts = (
+            get_version(RECIPES_VERSION_KEY),
+            reference_data.version(),
+            user.pk,
+            get_user_flags_version(user),
+            request.accepted_renderer.format
+        )
+        if self.action == 'list':
+            return ('recipes', *etag_parts), None
+        if self.action == 'download_shopping_cart':
+            return ('shopping_cart', *etag_parts), None
+        pk = parse_pk(kwargs.get('pk'))
+        updated = Recipe.objects.filter(pk=pk).values_list(
+            'updated',
+            flat=True
+        ).first()
+        if updated is None:
+            return None, None
+        last_modified = None if user.is_authenticated else updated
+        return ('recipe', pk, updated.isoformat(), *etag_parts), last_modified
+
+    # Список рецептов для анонимного пользователя берется из общего кэша.
+    # Кэш сбрасывается сменой версии рецептов и справочников (api/signals.py)
+    @conditional_get
+    def list(self, request, *args, **kwargs):
+        handler = super().list
+        if request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+        data = single_flight(
+            get_page_cache_key(request),
+            (get_version(RECIPES_VERSION_KEY), reference_data.version()),
+            lambda: handler(request, *args, **kwargs).data,
+            settings.RECIPES_PAGE_CACHE_TIMEOUT
+        )
+        return Response(data)
+
+    @conditional_get
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
     # Если создается новый рецепт или обновляется существующий, то возвращается
     # RecipeCreateUpdateSerializer, иначе возвращается RecipeSerializer
@@ -98,6 +287,31 @@ class RecipeViewSet(AbstractCreateDeleteMixin, ModelViewSet):
             return RecipeCreateUpdateSerializer
         return RecipeSerializer
 
+    # Удаление рецепта. Ингредиенты рецепта вычитаются из списков покупок
+    # пользователей, у которых он в корзине, в той же транзакции
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            ShoppingListItem.objects.apply_recipe(instance, -1)
+            instance.delete()
+
+    # Лента подписок: рецепты авторов, на которых подписан пользователь, от
+    # новых к старым. Пагинация всегда по курсору, поэтому следующая
+    # страница выбирается условием по id, без OFFSET. Фильтры списка
+    # рецептов тоже применяются
+    @action(
+        methods=('get', ),
+        detail=False,
+        permission_classes=(IsAuthenticated, ),
+        pagination_class=CustomCursorPagination
+    )
+    def feed(self, request):
+        queryset = self.filter_queryset(
+            self.get_queryset().feed(request.user)
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     # Добавление текущего рецепта в избранное или удаление его из избранного
     @action(
         methods=('post', 'delete'),
@@ -111,8 +325,24 @@ class RecipeViewSet(AbstractCreateDeleteMixin, ModelViewSet):
             request,
             pk,
             'recipe',
-            'Рецепт уже в избранном!',
-            'Рецепт отсутствует в избранном!'
+            *FAVORITE_MESSAGES
+        )
+
+    # Добавление нескольких рецептов в избранное или удаление их из
+    # избранного одним запросом: список id рецептов передается в поле ids
+    @action(
+        methods=('post', 'delete'),
+        detail=False,
+        url_path='favorite/batch'
+    )
+    def favorite_batch(self, request):
+        return self.perform_batch_action(
+            Favorite,
+            Recipe.objects.all(),
+            RecipeFavoriteSerializer,
+            request,
+            'recipe',
+            *FAVORITE_MESSAGES
         )
 
     # Добавление текущего рецепта в список покупок или удаление его из списка
@@ -129,31 +359,56 @@ class RecipeViewSet(AbstractCreateDeleteMixin, ModelViewSet):
             request,
             pk,
             'recipe',
-            'Рецепт уже в корзине!',
-            'Рецепт отсутствует в корзине!'
+            *SHOPPING_CART_MESSAGES,
+            on_change=ShoppingListItem.objects.apply_recipe
+        )
+
+    # Добавление нескольких рецептов в список покупок или удаление их из
+    # списка покупок одним запросом (например, всех рецептов плана питания).
+    # Суммы ингредиентов всех рецептов меняются одним запросом
+    @action(
+        methods=('post', 'delete'),
+        detail=False,
+        url_path='shopping_cart/batch'
+    )
+    def shopping_cart_batch(self, request):
+        return self.perform_batch_action(
+            ShoppingCart,
+            Recipe.objects.all(),
+            RecipeFavoriteSerializer,
+            request,
+            'recipe',
+            *SHOPPING_CART_MESSAGES,
+            on_change=ShoppingListItem.objects.apply_recipes
         )
 
-    # Загрузка рецепта в виде txt-файла
+    # Загрузка списка покупок в формате txt, csv или pdf (параметр format).
+    # Суммы ингредиентов уже посчитаны (ShoppingListItem), список выбирается
+    # из БД частями и отдается потоком, по мере вывода строк
     @action(
         methods=('get', ),
-        detail=False
+        detail=False,
+        permission_classes=(IsAuthenticated, ),
+        renderer_classes=(
+            ShoppingListTextRenderer,
+            ShoppingListCsvRenderer,
+            ShoppingListPdfRenderer
+        )
     )
+    @conditional_get
     def download_shopping_cart(self, request):
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__shoppingcart__user=request.user
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(
-            amount_sum=Sum('amount')
-        ).order_by(
-            'ingredient__name'
-        )
-        shopping_cart = 'Ваш список покупок:\n'
-        for ingredient in ingredients:
-            shopping_cart += (
-                f'{ingredient["ingredient__name"]} - '
-                f'{ingredient["amount_sum"]} '
-                f'{ingredient["ingredient__measurement_unit"]}\n'
+        ingredients = ShoppingListItem.objects.for_export(request.user)
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(
+                ingredients.iterator(chunk_size=SHOPPING_LIST_CHUNK_SIZE)
+            ),
+            content_type=(
+                f'{renderer.media_type}; charset={renderer.charset}'
+                if renderer.charset else renderer.media_type
             )
-        return HttpResponse(shopping_cart, content_type='text/plain')
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{renderer.format}"'
+        )
+        return response
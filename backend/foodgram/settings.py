@@ -36,6 +36,9 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE = (
+    'api.instrumentation.request_timing_middleware',
+    'api.profiling.request_profiling_middleware',
+    'api.db_router.replica_routing_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -87,6 +90,84 @@ else:
         },
     }
 
+# Время жизни соединений с основной БД и с репликами в секундах (0 -
+# соединение закрывается после каждого запроса). Перед повторным
+# использованием соединение проверяется
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 0))
+DB_REPLICA_CONN_MAX_AGE = int(
+    os.getenv('DB_REPLICA_CONN_MAX_AGE', DB_CONN_MAX_AGE)
+)
+DATABASES['default'].update(
+    CONN_MAX_AGE=DB_CONN_MAX_AGE,
+    CONN_HEALTH_CHECKS=True
+)
+
+# Реплики БД только для чтения (api/db_router.py) через ";": адреса серверов
+# PostgreSQL (host или host:port) или пути к файлам SQLite. Реплики
+# подключаются как replica_1, replica_2 и т.д.
+for number, replica in enumerate(
+    filter(None, os.getenv('DB_REPLICAS', '').split(';')),
+    start=1
+):
+    if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+        location = {'NAME': replica}
+    else:
+        host, _, port = replica.partition(':')
+        location = {'HOST': host, 'PORT': port or DATABASES['default']['PORT']}
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        **location,
+        'CONN_MAX_AGE': DB_REPLICA_CONN_MAX_AGE,
+        'TEST': {'MIRROR': 'default'}
+    }
+REPLICA_DATABASES = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ('api.db_router.ReplicaRouter', )
+# Сколько секунд пользователь после изменения данных читает их из основной
+# БД (реплика может отставать)
+REPLICA_STICKY_TIMEOUT = int(os.getenv('REPLICA_STICKY_TIMEOUT', 5))
+
+# Общий для всех процессов gunicorn кэш: версии данных (api/cache.py),
+# блокировки single_flight, страницы списка рецептов и признаки чтения из
+# основной БД (api/db_router.py). Блокировкам нужен атомарный между
+# процессами cache.add, а версии данных не должны вытесняться, поэтому на
+# сервере используется Redis (REDIS_URL). Версии хранятся без срока жизни и
+# не вытесняются при политике maxmemory-policy volatile-lru (см.
+# docker-compose.yml). Файловый кэш (или CACHE_BACKEND) - только для
+# разработки: при CACHE_MAX_ENTRIES записей он удаляет случайную треть
+# записей, в том числе версии
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': os.getenv(
+                'CACHE_BACKEND',
+                'django.core.cache.backends.filebased.FileBasedCache'
+            ),
+            'LOCATION': os.getenv('CACHE_LOCATION', os.path.join(BASE_DIR, 'cache')),
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 100000)),
+            },
+        },
+    }
+
+# Время (в секундах), в течение которого страница списка рецептов для
+# анонимных пользователей отдается из кэша
+RECIPES_PAGE_CACHE_TIMEOUT = int(os.getenv('RECIPES_PAGE_CACHE_TIMEOUT', 60))
+
+# Шрифт TrueType для списка покупок в формате PDF (нужен для кириллицы).
+# Если файла нет, то используется стандартный шрифт Helvetica
+SHOPPING_LIST_FONT = os.getenv(
+    'SHOPPING_LIST_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
 AUTH_PASSWORD_VALIDATORS = (
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -120,6 +201,48 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Количество фоновых потоков процесса, которые строят варианты картинок
+# рецептов (api/images.py). При 0 варианты строятся сразу после сохранения
+# рецепта в потоке запроса
+IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', 2))
+
+# Асинхронные обработчики частых запросов на чтение (api/async_views.py).
+# Включаются при запуске под ASGI-сервером (foodgram/asgi.py)
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'False') == 'True'
+
+# Замеры запросов (api/instrumentation.py): заголовок Server-Timing для всех
+# пользователей (иначе только для администраторов) и пороги журнала
+# медленных запросов - время в миллисекундах и количество запросов к БД. В
+# журнал записываются SLOW_REQUEST_SQL самых долгих запросов к БД
+SERVER_TIMING_FOR_ALL = os.getenv('SERVER_TIMING_FOR_ALL', 'False') == 'True'
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', 1000))
+SLOW_REQUEST_QUERIES = int(os.getenv('SLOW_REQUEST_QUERIES', 50))
+SLOW_REQUEST_SQL = int(os.getenv('SLOW_REQUEST_SQL', 5))
+
+# Каталог отчетов профилирования запросов (api/profiling.py)
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(asctime)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'message',
+        },
+    },
+    'loggers': {
+        'api.instrumentation': {
+            'handlers': ('console', ),
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
 AUTH_USER_MODEL = 'users.CustomUser'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -133,6 +256,10 @@ REST_FRAMEWORK = {
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'HIDE_USERS': False,
+    'SERIALIZERS': {
+        'user': 'api.serializers.CustomUserSerializer',
+        'current_user': 'api.serializers.CustomUserSerializer',
+    },
     'PERMISSIONS': {
         'user_create': ('rest_framework.permissions.AllowAny', ),
         'user_list': ('rest_framework.permissions.IsAdminUser', ),
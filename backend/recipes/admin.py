@@ -1,5 +1,8 @@
+from django import forms
 from django.contrib import admin
 
+from .admin_utils import (LargeTableAdmin, PrefetchedAutocompleteSelect,
+                          autocomplete_filter)
 from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
                      ShoppingCart, Subscription, Tag)
 
@@ -8,50 +11,91 @@ from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
 class TagAdmin(admin.ModelAdmin):
     list_display = ('name', 'color', 'slug')
     list_filter = ('name',)
+    search_fields = ('name', 'slug')
 
 
 @admin.register(Ingredient)
-class IngredientAdmin(admin.ModelAdmin):
+class IngredientAdmin(LargeTableAdmin):
     list_display = ('name', 'measurement_unit')
-    list_filter = ('name',)
+    search_fields = ('^name', )
+
+
+class RecipeIngredientForm(forms.ModelForm):
+    """
+    Форма ингредиента в рецепте: выбранный ингредиент передается виджету
+    автодополнения, чтобы он не выбирал его из БД.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        widget = self.fields['ingredient'].widget
+        getattr(widget, 'widget', widget).selected = (
+            self.instance.ingredient if self.instance.ingredient_id else None
+        )
 
 
 class RecipeIngredientInline(admin.TabularInline):
     model = RecipeIngredient
+    form = RecipeIngredientForm
     extra = 0
 
+    # Ингредиенты выбираются вместе со строками рецепта
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('ingredient')
+
+    # Выбор ингредиента с автодополнением, без вывода всех ингредиентов
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'ingredient':
+            kwargs['widget'] = PrefetchedAutocompleteSelect(
+                db_field,
+                self.admin_site,
+                using=kwargs.get('using')
+            )
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
 
 @admin.register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(LargeTableAdmin):
     inlines = (RecipeIngredientInline, )
     list_display = ('name', 'author')
-    list_filter = ('name', 'author__username', 'tags')
+    list_filter = (autocomplete_filter('author'), 'tags')
+    list_select_related = ('author', )
+    search_fields = ('name', )
+    autocomplete_fields = ('author', )
     readonly_fields = ('in_favorites', )
 
     @admin.display(description='Число добавлений в избранное')
     def in_favorites(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
 
 
 @admin.register(RecipeIngredient)
-class RecipeIngredientAdmin(admin.ModelAdmin):
+class RecipeIngredientAdmin(LargeTableAdmin):
     list_display = ('recipe', 'ingredient', 'amount')
-    list_filter = ('recipe', )
+    list_filter = (autocomplete_filter('recipe'), )
+    list_select_related = ('recipe', 'ingredient')
+    autocomplete_fields = ('recipe', 'ingredient')
 
 
 @admin.register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
+class ShoppingCartAdmin(LargeTableAdmin):
     list_display = ('user', 'recipe')
-    list_filter = ('user', )
+    list_filter = (autocomplete_filter('user'), )
+    list_select_related = ('user', 'recipe')
+    autocomplete_fields = ('user', 'recipe')
 
 
 @admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
+class FavoriteAdmin(LargeTableAdmin):
     list_display = ('user', 'recipe')
-    list_filter = ('user', )
+    list_filter = (autocomplete_filter('user'), )
+    list_select_related = ('user', 'recipe')
+    autocomplete_fields = ('user', 'recipe')
 
 
 @admin.register(Subscription)
-class SubscriptionAdmin(admin.ModelAdmin):
+class SubscriptionAdmin(LargeTableAdmin):
     list_display = ('user', 'author')
-    list_filter = ('user', )
+    list_filter = (autocomplete_filter('user'), )
+    list_select_related = ('user', 'author')
+    autocomplete_fields = ('user', 'author')
@@ -0,0 +1,149 @@
+from django import forms
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+
+# Начиная с этого количества строк (по статистике PostgreSQL) в списке
+# объектов без фильтров выводится примерное количество объектов
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор списка объектов в админке. Для списка без фильтров в
+    PostgreSQL количество объектов берется из статистики таблицы
+    (pg_class.reltuples), без COUNT(*) по всей таблице.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class '
+                    'WHERE oid = %s::regclass',
+                    [connection.ops.quote_name(queryset.model._meta.db_table)]
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= ESTIMATED_COUNT_THRESHOLD:
+                return row[0]
+        return super().count
+
+
+class AutocompleteFilter(admin.SimpleListFilter):
+    """
+    Фильтр по внешнему ключу с выбором значения через автодополнение. В
+    отличие от стандартного фильтра не выбирает все связанные объекты для
+    боковой панели. У админки связанной модели должны быть заданы
+    search_fields.
+    """
+    template = 'admin/autocomplete_filter.html'
+    field_name = None
+
+    def __init__(self, request, params, model, model_admin):
+        self.field = model._meta.get_field(self.field_name)
+        self.parameter_name = (
+            f'{self.field_name}__{self.field.target_field.name}__exact'
+        )
+        self.title = self.field.verbose_name
+        super().__init__(request, params, model, model_admin)
+        self.form_field = forms.ModelChoiceField(
+            queryset=self.field.remote_field.model._default_manager.all(),
+            widget=AutocompleteSelect(self.field, model_admin.admin_site),
+            required=False
+        )
+
+    def has_output(self):
+        return True
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        try:
+            return queryset.filter(**{self.parameter_name: self.value()})
+        except (ValueError, ValidationError) as error:
+            raise IncorrectLookupParameters(error)
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.value() is None,
+            'query_string': changelist.get_query_string(
+                remove=(self.parameter_name, )
+            ),
+            'display': _('All'),
+            'widget': self.form_field.widget.render(
+                self.parameter_name,
+                self.value(),
+                attrs={'id': f'filter_{self.parameter_name}'}
+            )
+        }
+
+
+def autocomplete_filter(field_name):
+    """Класс фильтра с автодополнением для внешнего ключа field_name."""
+    return type(
+        f'{field_name.title()}AutocompleteFilter',
+        (AutocompleteFilter, ),
+        {'field_name': field_name}
+    )
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Админка для больших таблиц: примерное количество объектов, без подсчета
+    общего количества при фильтрации и с подключением скриптов для фильтров
+    с автодополнением.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @property
+    def media(self):
+        media = super().media
+        for list_filter in self.list_filter:
+            if isinstance(list_filter, type) and issubclass(
+                list_filter,
+                AutocompleteFilter
+            ):
+                field = self.model._meta.get_field(list_filter.field_name)
+                return media + AutocompleteSelect(
+                    field,
+                    self.admin_site
+                ).media + forms.Media(js=('recipes/autocomplete_filter.js', ))
+        return media
+
+
+class PrefetchedAutocompleteSelect(AutocompleteSelect):
+    """
+    Виджет автодополнения, которому форма передает уже выбранный объект
+    (атрибут selected). Такой виджет не обращается к БД при выводе, поэтому
+    в строках inline нет запроса на каждую строку.
+    """
+    selected = None
+
+    def optgroups(self, name, value, attr=None):
+        if self.selected is None or [str(v) for v in value] != [
+            str(self.selected.pk)
+        ]:
+            return super().optgroups(name, value, attr)
+        options = []
+        if not self.is_required:
+            options.append(self.create_option(name, '', '', False, 0))
+        options.append(self.create_option(
+            name,
+            self.selected.pk,
+            self.choices.field.label_from_instance(self.selected),
+            True,
+            len(options)
+        ))
+        return [(None, options, 0)]
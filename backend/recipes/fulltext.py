@@ -0,0 +1,174 @@
+"""
+Полнотекстовый поиск рецептов по названию, описанию и названиям
+ингредиентов. Индекс хранится в отдельной таблице, которая создается
+миграцией recipes/migrations/0003_recipe_search_index.py средствами БД: в
+PostgreSQL - tsvector с индексом GIN, в SQLite - виртуальная таблица FTS5.
+Индекс рецепта обновляется при каждом изменении рецепта и его ингредиентов
+(см. api/signals.py).
+"""
+import re
+
+from django.db import connections, router
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+from .models import Ingredient, Recipe, RecipeIngredient
+
+SEARCH_TABLE = 'recipes_recipe_search'
+# Конфигурация полнотекстового поиска PostgreSQL
+SEARCH_CONFIG = 'russian'
+# Веса столбцов FTS5 в bm25: название, описание, ингредиенты
+BM25_WEIGHTS = (10.0, 5.0, 2.0)
+
+
+# Подключение к БД, в которой хранятся рецепты
+def get_connection():
+    return connections[router.db_for_write(Recipe)]
+
+
+# Выражение SQL: текст без буквы ё (в индексе и в запросе она заменяется на е)
+def normalize_sql(expression):
+    return f"replace(replace({expression}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+# Выражение SQL: взвешенный tsvector текста (PostgreSQL)
+def weighted(expression, weight):
+    return (
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', {expression}), "
+        f"'{weight}')"
+    )
+
+
+def update_search_index(recipe_ids=None):
+    """
+    Обновление индекса рецептов recipe_ids (без recipe_ids - всех рецептов)
+    одним запросом.
+    """
+    connection = get_connection()
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        return
+    if recipe_ids is not None:
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return
+    quote = connection.ops.quote_name
+    recipe_table = quote(Recipe._meta.db_table)
+    select = (
+        f'FROM {recipe_table} r '
+        f'LEFT JOIN {quote(RecipeIngredient._meta.db_table)} ri '
+        f'ON ri.recipe_id = r.id '
+        f'LEFT JOIN {quote(Ingredient._meta.db_table)} i '
+        f'ON i.id = ri.ingredient_id '
+    )
+    params = []
+    where = ''
+    if recipe_ids is not None:
+        where = f'WHERE r.id IN ({", ".join(["%s"] * len(recipe_ids))}) '
+        params = recipe_ids
+    name = normalize_sql('r.name')
+    text = normalize_sql('r.text')
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            ingredients = normalize_sql(
+                "coalesce(string_agg(i.name, ' '), '')"
+            )
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (recipe_id, document) '
+                f'SELECT r.id, {weighted(name, "A")} || '
+                f'{weighted(text, "B")} || {weighted(ingredients, "C")} '
+                f'{select}{where}GROUP BY r.id '
+                f'ON CONFLICT (recipe_id) '
+                f'DO UPDATE SET document = excluded.document',
+                params
+            )
+            return
+        ingredients = normalize_sql(
+            "coalesce(group_concat(i.name, ' '), '')"
+        )
+        if recipe_ids is None:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        else:
+            cursor.execute(
+                f'DELETE FROM {SEARCH_TABLE} '
+                f'WHERE rowid IN ({", ".join(["%s"] * len(recipe_ids))})',
+                recipe_ids
+            )
+        cursor.execute(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, name, text, ingredients) '
+            f'SELECT r.id, {name}, {text}, {ingredients} '
+            f'{select}{where}GROUP BY r.id',
+            params
+        )
+
+
+def delete_from_search_index(recipe_id):
+    """
+    Удаление рецепта из индекса. Записи индекса не ссылаются на рецепты
+    внешним ключом (иначе таблицу рецептов нельзя очистить TRUNCATE), а
+    записи удаленных рецептов не попадают в выдачу, так как поиск
+    ограничивает выборку рецептов.
+    """
+    connection = get_connection()
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        return
+    column = 'recipe_id' if connection.vendor == 'postgresql' else 'rowid'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {SEARCH_TABLE} WHERE {column} = %s',
+            [recipe_id]
+        )
+
+
+def get_search_query(value):
+    """
+    Слова поискового запроса: только буквы и цифры, без буквы ё. Каждое
+    слово ищется как начало слова, все слова должны быть найдены.
+    """
+    return [
+        word.replace('ё', 'е')
+        for word in re.findall(r'\w+', value.lower().replace('_', ' '))
+    ]
+
+
+def search_recipes(queryset, value):
+    """
+    Рецепты queryset, найденные по запросу value, с релевантностью
+    search_rank (чем больше, тем выше рецепт в выдаче). Релевантность -
+    число, поэтому по ней можно сравнивать в пагинации по курсору
+    (api/pagination.py). В PostgreSQL ts_rank (real) приводится к float8,
+    чтобы значение из курсора точно совпадало со значением в БД.
+    """
+    words = get_search_query(value)
+    if not words:
+        return queryset
+    connection = get_connection()
+    recipe_table = connection.ops.quote_name(Recipe._meta.db_table)
+    if connection.vendor == 'postgresql':
+        query = ' & '.join(f'{word}:*' for word in words)
+        tsquery = f"to_tsquery('{SEARCH_CONFIG}', %s)"
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT recipe_id FROM {SEARCH_TABLE} '
+            f'WHERE document @@ {tsquery}',
+            (query, )
+        )).annotate(search_rank=RawSQL(
+            f'SELECT ts_rank(document, {tsquery})::float8 '
+            f'FROM {SEARCH_TABLE} '
+            f'WHERE recipe_id = {recipe_table}.id',
+            (query, ),
+            output_field=FloatField()
+        )).order_by('-search_rank', '-id')
+    if connection.vendor == 'sqlite':
+        query = ' '.join(f'"{word}"*' for word in words)
+        weights = ', '.join(map(str, BM25_WEIGHTS))
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {SEARCH_TABLE} '
+            f'WHERE {SEARCH_TABLE} MATCH %s',
+            (query, )
+        )).annotate(search_rank=RawSQL(
+            f'SELECT -bm25({SEARCH_TABLE}, {weights}) FROM {SEARCH_TABLE} '
+            f'WHERE {SEARCH_TABLE} MATCH %s '
+            f'AND rowid = {recipe_table}.id',
+            (query, ),
+            output_field=FloatField()
+        )).order_by('-search_rank', '-id')
+    return queryset.filter(name__icontains=value)
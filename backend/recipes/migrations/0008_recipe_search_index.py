@@ -0,0 +1,81 @@
+"""
+Таблица индекса полнотекстового поиска рецептов (recipes/fulltext.py):
+в PostgreSQL - tsvector с индексом GIN, в SQLite - виртуальная таблица
+FTS5. В остальных БД таблица не создается, поиск выполняется по названию.
+Таблица могла быть создана раньше (до миграции она создавалась после
+migrate), поэтому создается только при отсутствии. Индекс существующих
+рецептов строит команда rebuild_search_index.
+"""
+from django.db import connection, migrations
+
+SEARCH_SQL = {
+    'postgresql': (
+        'CREATE TABLE IF NOT EXISTS recipes_recipe_search '
+        '(recipe_id bigint PRIMARY KEY, document tsvector NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS recipes_recipe_search_document '
+        'ON recipes_recipe_search USING gin (document)'
+    ),
+    'sqlite': (
+        'CREATE VIRTUAL TABLE IF NOT EXISTS recipes_recipe_search '
+        'USING fts5(name, text, ingredients, '
+        "tokenize = 'unicode61 remove_diacritics 2')",
+    )
+}
+REVERSE_SEARCH_SQL = {
+    'postgresql': ('DROP TABLE IF EXISTS recipes_recipe_search', ),
+    'sqlite': ('DROP TABLE IF EXISTS recipes_recipe_search', )
+}
+
+
+class VendorRunSQL(migrations.RunSQL):
+    """
+    RunSQL, в котором SQL выбирается по типу БД, в которой выполняется
+    миграция. migrate --plan показывает SQL для БД default.
+    """
+
+    def __init__(self, sql, reverse_sql, **kwargs):
+        self.vendor_sql = sql
+        self.vendor_reverse_sql = reverse_sql
+        super().__init__(
+            sql=sql.get(connection.vendor, ()),
+            reverse_sql=reverse_sql.get(connection.vendor, ()),
+            **kwargs
+        )
+
+    def deconstruct(self):
+        return (
+            self.__class__.__qualname__,
+            [],
+            {'sql': self.vendor_sql, 'reverse_sql': self.vendor_reverse_sql}
+        )
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        self.sql = self.vendor_sql.get(schema_editor.connection.vendor, ())
+        super().database_forwards(
+            app_label, schema_editor, from_state, to_state
+        )
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        self.reverse_sql = self.vendor_reverse_sql.get(
+            schema_editor.connection.vendor,
+            ()
+        )
+        super().database_backwards(
+            app_label, schema_editor, from_state, to_state
+        )
+
+    def describe(self):
+        return 'Таблица индекса полнотекстового поиска рецептов'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_counters'),
+    ]
+
+    operations = [
+        VendorRunSQL(SEARCH_SQL, REVERSE_SEARCH_SQL),
+    ]
@@ -1,7 +1,9 @@
 from colorfield import fields
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connection, models
+from django.db.models import Exists, OuterRef, Prefetch, Q
+from django.db.models.signals import post_delete, post_save
 from users.models import CustomUser
 
 
@@ -51,11 +53,59 @@ class Ingredient(models.Model):
         ordering = ('name', )
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = (models.UniqueConstraint(
+            fields=('name', 'measurement_unit'),
+            name='unique_ingredient'
+        ), )
 
     def __str__(self):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    """QuerySet рецептов."""
+
+    # Выборка автора, тегов и ингредиентов рецепта. Ингредиенты возвращаются
+    # уже отсортированными по названию, поэтому сериализатор не обращается
+    # к БД повторно
+    def with_related(self):
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'recipe_ingredient',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient'
+                ).order_by('ingredient__name')
+            )
+        )
+
+    # Добавление флагов is_favorited и is_in_shopping_cart для пользователя
+    # в основной запрос. Для анонимного пользователя флаги не вычисляются
+    def with_user_flags(self, user):
+        if not user.is_authenticated:
+            return self
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user,
+                recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user,
+                recipe=OuterRef('pk')
+            ))
+        )
+
+    # Лента подписок: рецепты авторов, на которых подписан пользователь.
+    # Условие EXISTS по подпискам (ограничение уникальности user, author)
+    # и индекс рецептов (автор, -id) позволяют БД выбирать страницу ленты
+    # без сортировки всех рецептов авторов
+    def feed(self, user):
+        return self.filter(Exists(Subscription.objects.filter(
+            user=user,
+            author=OuterRef('author')
+        )))
+
+
 class Recipe(models.Model):
     """Модель рецептов."""
     name = models.CharField(
@@ -69,17 +119,48 @@ class Recipe(models.Model):
         blank=False
     )
     text = models.TextField(verbose_name='Описание', blank=False)
+    # Отдельный индекс по автору не нужен: его заменяет индекс
+    # recipe_author_id_idx (автор, -id)
     author = models.ForeignKey(
         CustomUser,
         verbose_name='Автор',
         on_delete=models.CASCADE,
-        blank=False
+        blank=False,
+        db_index=False
     )
     image = models.ImageField(
         verbose_name='Картинка',
         upload_to='recipes/',
         blank=False
     )
+    image_thumbnail = models.ImageField(
+        verbose_name='Миниатюра картинки',
+        upload_to='recipes/variants/',
+        blank=True,
+        editable=False
+    )
+    image_detail = models.ImageField(
+        verbose_name='Картинка для страницы рецепта',
+        upload_to='recipes/variants/',
+        blank=True,
+        editable=False
+    )
+    image_hash = models.CharField(
+        verbose_name='Хеш картинки',
+        max_length=64,
+        blank=True,
+        editable=False
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Число добавлений в избранное',
+        default=0,
+        editable=False
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        verbose_name='Число добавлений в список покупок',
+        default=0,
+        editable=False
+    )
     tags = models.ManyToManyField(
         Tag,
         verbose_name='Тег',
@@ -93,10 +174,21 @@ class Recipe(models.Model):
         blank=False
     )
 
+    updated = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
     class Meta:
         ordering = ('-id', )
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = (models.Index(
+            fields=('author', '-id'),
+            name='recipe_author_id_idx'
+        ), )
 
     def __str__(self):
         return self.name
@@ -151,6 +243,109 @@ class RecipeIngredient(models.Model):
                 f'{self.ingredient.measurement_unit}')
 
 
+class UserRelationQuerySet(models.QuerySet):
+    """
+    Добавление и удаление связи пользователя с объектом одним запросом:
+    INSERT ... ON CONFLICT DO NOTHING и DELETE ... RETURNING (PostgreSQL и
+    SQLite). Повторное добавление или удаление ничего не меняет, поэтому
+    одновременные запросы не создают дубликатов. Сигналы post_save и
+    post_delete отправляются, только если запись добавлена или удалена.
+    """
+
+    # Столбцы и значения полей связи (поле - объект модели)
+    def get_columns(self, fields):
+        return {
+            self.model._meta.get_field(name).column: obj.pk
+            for name, obj in fields.items()
+        }
+
+    # Добавление связи. Вернет новую запись или None, если связь уже есть
+    def add(self, **fields):
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        columns = self.get_columns(fields)
+        names = ', '.join(map(connection.ops.quote_name, columns))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({names}) '
+                f'VALUES ({", ".join(["%s"] * len(columns))}) '
+                f'ON CONFLICT ({names}) DO NOTHING RETURNING id',
+                list(columns.values())
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        instance = self.model(pk=row[0], **fields)
+        post_save.send(
+            sender=self.model,
+            instance=instance,
+            created=True,
+            update_fields=None,
+            raw=False,
+            using=self.db
+        )
+        return instance
+
+    # Удаление связи. Вернет количество удаленных записей
+    def remove(self, **fields):
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        columns = self.get_columns(fields)
+        where = ' AND '.join(
+            f'{connection.ops.quote_name(column)} = %s' for column in columns
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {table} WHERE {where} RETURNING id',
+                list(columns.values())
+            )
+            pks = [row[0] for row in cursor.fetchall()]
+        for pk in pks:
+            instance = self.model(pk=pk, **fields)
+            post_delete.send(
+                sender=self.model,
+                instance=instance,
+                using=self.db,
+                origin=instance
+            )
+        return len(pks)
+
+    # Добавление связей пользователя user с объектами objs (поле связи field)
+    # одним запросом. Как и bulk_create, не отправляет сигналы моделей. Вернет
+    # id объектов, с которыми связь добавлена
+    def add_many(self, user, field, objs):
+        if not objs:
+            return []
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        column = connection.ops.quote_name(
+            self.model._meta.get_field(field).column
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, {column}) '
+                f'VALUES {", ".join(["(%s, %s)"] * len(objs))} '
+                f'ON CONFLICT (user_id, {column}) DO NOTHING '
+                f'RETURNING {column}',
+                [value for obj in objs for value in (user.pk, obj.pk)]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    # Удаление связей пользователя user с объектами objs одним запросом, без
+    # сигналов моделей. Вернет id объектов, связь с которыми удалена
+    def remove_many(self, user, field, objs):
+        if not objs:
+            return []
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        column = connection.ops.quote_name(
+            self.model._meta.get_field(field).column
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {table} WHERE user_id = %s AND {column} IN '
+                f'({", ".join(["%s"] * len(objs))}) RETURNING {column}',
+                [user.pk, *(obj.pk for obj in objs)]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
 class AbstractModel(models.Model):
     """
     Абстрактная модель, которая связывает пользователя с каким-либо объектом.
@@ -172,14 +367,20 @@ class AbstractModel(models.Model):
         related_name='%(class)s'
     )
 
+    objects = UserRelationQuerySet.as_manager()
+
     class Meta:
         abstract = True
+        constraints = (models.UniqueConstraint(
+            fields=('user', 'recipe'),
+            name='unique_%(class)s'
+        ), )
 
 
 class ShoppingCart(AbstractModel):
     """Модель, которая связывает пользователя и покупки (список покупок)."""
 
-    class Meta:
+    class Meta(AbstractModel.Meta):
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Список покупок'
 
@@ -187,10 +388,151 @@ class ShoppingCart(AbstractModel):
         return f'Рецепт {self.recipe} в корзине у пользователя {self.user}'
 
 
+class ShoppingListItemQuerySet(models.QuerySet):
+    """
+    Изменение сумм ингредиентов в списках покупок. Суммы меняются одним
+    запросом INSERT ... ON CONFLICT DO UPDATE (PostgreSQL и SQLite), поэтому
+    одновременные изменения списка одного пользователя не теряются.
+    """
+
+    # Прибавление (sign=1) или вычитание (sign=-1) ингредиентов рецепта в
+    # списке покупок пользователя. Без user - у всех пользователей, у
+    # которых рецепт в корзине
+    def apply_recipe(self, recipe, sign, user=None):
+        self.apply_recipes((recipe, ), sign, user)
+
+    # То же для нескольких рецептов сразу: суммы всех рецептов меняются
+    # одним запросом
+    def apply_recipes(self, recipes, sign, user=None):
+        if not recipes:
+            return
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        recipe_ingredient = connection.ops.quote_name(
+            RecipeIngredient._meta.db_table
+        )
+        shopping_cart = connection.ops.quote_name(
+            ShoppingCart._meta.db_table
+        )
+        recipe_ids = [recipe.pk for recipe in recipes]
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        if user is None:
+            select = (
+                f'SELECT sc.user_id, ri.ingredient_id, SUM(ri.amount) * %s '
+                f'FROM {shopping_cart} sc JOIN {recipe_ingredient} ri '
+                f'ON ri.recipe_id = sc.recipe_id '
+                f'WHERE sc.recipe_id IN ({placeholders}) '
+                f'GROUP BY sc.user_id, ri.ingredient_id'
+            )
+            params = [sign, *recipe_ids]
+            users = (
+                f'SELECT user_id FROM {shopping_cart} '
+                f'WHERE recipe_id IN ({placeholders})'
+            )
+            users_params = recipe_ids
+        else:
+            select = (
+                f'SELECT %s, ri.ingredient_id, SUM(ri.amount) * %s '
+                f'FROM {recipe_ingredient} ri '
+                f'WHERE ri.recipe_id IN ({placeholders}) '
+                f'GROUP BY ri.ingredient_id'
+            )
+            params = [user.pk, sign, *recipe_ids]
+            users = '%s'
+            users_params = [user.pk]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, ingredient_id, amount) '
+                f'{select} ON CONFLICT (user_id, ingredient_id) '
+                f'DO UPDATE SET amount = {table}.amount + excluded.amount',
+                params
+            )
+            if sign < 0:
+                cursor.execute(
+                    f'DELETE FROM {table} '
+                    f'WHERE amount <= 0 AND user_id IN ({users})',
+                    users_params
+                )
+
+    # Список покупок пользователя: название, количество и единица измерения
+    def for_export(self, user):
+        return self.filter(user=user).order_by(
+            'ingredient__name',
+            'id'
+        ).values_list(
+            'ingredient__name',
+            'amount',
+            'ingredient__measurement_unit'
+        )
+
+    # Список покупок пользователя (как for_export) частями по size строк.
+    # Каждая часть выбирается отдельным запросом по ключу последней строки
+    # предыдущей части, поэтому между частями курсор БД не держится открытым
+    def export_chunks(self, user, size):
+        queryset = self.filter(user=user).order_by('ingredient__name', 'id')
+        last = None
+        while True:
+            chunk = queryset
+            if last is not None:
+                chunk = chunk.filter(
+                    Q(ingredient__name__gt=last[0])
+                    | Q(ingredient__name=last[0], id__gt=last[1])
+                )
+            rows = list(chunk.values_list(
+                'ingredient__name',
+                'id',
+                'amount',
+                'ingredient__measurement_unit'
+            )[:size])
+            if not rows:
+                return
+            last = rows[-1][:2]
+            yield [
+                (name, amount, measurement_unit)
+                for name, _, amount, measurement_unit in rows
+            ]
+            if len(rows) < size:
+                return
+
+
+class ShoppingListItem(models.Model):
+    """
+    Сумма ингредиента по всем рецептам в списке покупок пользователя.
+    Обновляется в той же транзакции, что и список покупок (ShoppingCart) и
+    ингредиенты рецептов, которые в нем находятся. Пересчитать суммы можно
+    командой rebuild_shopping_lists.
+    """
+    user = models.ForeignKey(
+        CustomUser,
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE,
+        related_name='shopping_list'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ингредиент',
+        on_delete=models.CASCADE,
+        related_name='shopping_list'
+    )
+    amount = models.IntegerField(verbose_name='Количество')
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списке покупок'
+        constraints = (models.UniqueConstraint(
+            fields=('user', 'ingredient'),
+            name='unique_shopping_list_item'
+        ), )
+
+    def __str__(self):
+        return f'{self.ingredient} - {self.amount} у пользователя {self.user}'
+
+
 class Favorite(AbstractModel):
     """Модель, которая связывает пользователя и рецепты (избранные рецепты)."""
 
-    class Meta:
+    class Meta(AbstractModel.Meta):
         ordering = ('-id', )
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
@@ -215,6 +557,8 @@ class Subscription(models.Model):
         related_name='following'
     )
 
+    objects = UserRelationQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
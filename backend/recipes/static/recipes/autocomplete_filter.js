@@ -0,0 +1,15 @@
+'use strict';
+// Фильтр с автодополнением (recipes/admin_utils.py): при выборе значения
+// открывается список объектов с этим фильтром
+{
+    const $ = django.jQuery;
+    $(document).on('change', '.autocomplete-filter select', function() {
+        const container = $(this).closest('.autocomplete-filter');
+        const params = new URLSearchParams(container.data('query-string'));
+        const value = $(this).val();
+        if (value) {
+            params.set(container.data('parameter'), value);
+        }
+        window.location.search = params.toString();
+    });
+}
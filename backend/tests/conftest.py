@@ -0,0 +1,109 @@
+import base64
+
+import pytest
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import CustomUser
+
+PNG = (
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA'
+    '60e6kgAAAABJRU5ErkJggg=='
+)
+IMAGE = f'data:image/png;base64,{PNG}'
+INGREDIENTS_PER_RECIPE = 5
+
+
+# Кэш в памяти процесса, картинки - во временном каталоге, варианты
+# картинок строятся в потоке запроса
+@pytest.fixture(autouse=True)
+def test_settings(settings, tmp_path):
+    settings.CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+    }}
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.IMAGE_VARIANT_WORKERS = 0
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def create_user(number, **kwargs):
+    return CustomUser.objects.create_user(
+        username=f'user_{number}',
+        email=f'user_{number}@example.com',
+        password='password',
+        first_name='Имя',
+        last_name='Фамилия',
+        **kwargs
+    )
+
+
+def get_client(user=None):
+    client = APIClient()
+    if user is not None:
+        token, _ = Token.objects.get_or_create(user=user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    return client
+
+
+@pytest.fixture
+def users(db):
+    return [create_user(number) for number in range(3)]
+
+
+@pytest.fixture
+def tags(db):
+    return [
+        Tag.objects.create(name=f'Тег {number}', color=f'#00000{number}',
+                           slug=f'tag_{number}')
+        for number in range(3)
+    ]
+
+
+@pytest.fixture
+def ingredients(db):
+    return [
+        Ingredient.objects.create(name=f'Ингредиент {number:02d}',
+                                  measurement_unit='г')
+        for number in range(20)
+    ]
+
+
+# Рецепты пользователей users: у каждого рецепта от одного до трех тегов и
+# INGREDIENTS_PER_RECIPE ингредиентов
+@pytest.fixture
+def recipes(users, tags, ingredients):
+    recipes = []
+    for number in range(12):
+        recipe = Recipe.objects.create(
+            name=f'Рецепт {number}',
+            text='Описание рецепта',
+            cooking_time=number + 1,
+            author=users[number % len(users)],
+            image=ContentFile(base64.b64decode(PNG), name='recipe.png')
+        )
+        recipe.tags.set(tags[:number % len(tags) + 1])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient=ingredients[(number + shift) % len(ingredients)],
+                amount=shift + 1
+            )
+            for shift in range(INGREDIENTS_PER_RECIPE)
+        )
+        recipes.append(recipe)
+    return recipes
+
+
+@pytest.fixture
+def anon_client():
+    return APIClient()
+
+
+# Клиент пользователя users[0] с аутентификацией по токену
+@pytest.fixture
+def user_client(users):
+    return get_client(users[0])
@@ -0,0 +1,70 @@
+from datetime import timedelta
+
+import pytest
+from api.cache import RECIPES_VERSION_KEY, get_version
+from django.utils import timezone
+from recipes.models import Recipe
+
+from .conftest import create_user
+
+
+# Изменение автора (имя выводится в рецепте) меняет ETag и Last-Modified
+# рецепта, хотя сам рецепт не изменился
+def test_recipe_validators_change_with_author(
+    recipes, anon_client, django_capture_on_commit_callbacks
+):
+    recipe = recipes[0]
+    Recipe.objects.filter(pk=recipe.pk).update(
+        updated=timezone.now() - timedelta(hours=1)
+    )
+    path = f'/api/recipes/{recipe.pk}/'
+    response = anon_client.get(path)
+    etag, last_modified = response['ETag'], response['Last-Modified']
+    assert anon_client.get(
+        path,
+        HTTP_IF_NONE_MATCH=etag
+    ).status_code == 304
+    assert anon_client.get(
+        path,
+        HTTP_IF_MODIFIED_SINCE=last_modified
+    ).status_code == 304
+    author = recipe.author
+    author.first_name = 'Новое имя'
+    with django_capture_on_commit_callbacks(execute=True):
+        author.save()
+    response = anon_client.get(path, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.json()['author']['first_name'] == 'Новое имя'
+    assert anon_client.get(
+        path,
+        HTTP_IF_MODIFIED_SINCE=last_modified
+    ).status_code == 200
+
+
+# Сохранение полей пользователя, которые не выводятся в рецепте, и новый
+# пользователь не меняют ETag, дату изменения и версию рецептов
+@pytest.mark.parametrize(
+    'update_fields',
+    (('last_login', ), ('password', ), ('recipes_count', ), None)
+)
+def test_recipe_validators_ignore_other_user_fields(
+    recipes, anon_client, django_capture_on_commit_callbacks, update_fields
+):
+    recipe = Recipe.objects.get(pk=recipes[0].pk)
+    path = f'/api/recipes/{recipe.pk}/'
+    etag = anon_client.get(path)['ETag']
+    version = get_version(RECIPES_VERSION_KEY)
+    author = recipe.author
+    with django_capture_on_commit_callbacks(execute=True):
+        if update_fields is None:
+            create_user(len(recipes) + 1)
+        else:
+            author.last_login = timezone.now()
+            author.set_password('new-password')
+            author.save(update_fields=update_fields)
+    assert anon_client.get(
+        path,
+        HTTP_IF_NONE_MATCH=etag
+    ).status_code == 304
+    assert Recipe.objects.get(pk=recipe.pk).updated == recipe.updated
+    assert get_version(RECIPES_VERSION_KEY) == version
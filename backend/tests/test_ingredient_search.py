@@ -0,0 +1,50 @@
+import pytest
+from api.search import IngredientSearchIndex, prefix_distance
+
+NAMES = (
+    'карамель', 'картофель', 'картофель молодой', 'молоко',
+    'молоко сгущенное', 'морковь', 'мука'
+)
+
+
+@pytest.fixture
+def search():
+    rows = [
+        {'id': number, 'name': name, 'measurement_unit': 'г'}
+        for number, name in enumerate(NAMES)
+    ]
+    index = IngredientSearchIndex()
+    return lambda query: [
+        row['name'] for row in index.search(query, source=rows)
+    ]
+
+
+@pytest.mark.parametrize('query, word, distance', (
+    ('молко', 'молоко', 1),
+    ('молоко', 'молоко', 0),
+    ('малоко', 'молоко', 1),
+    ('картфель', 'картофель', 1),
+    ('картфель', 'карамель', 2),
+    ('молко', 'мука', None),
+))
+def test_prefix_distance(query, word, distance):
+    assert prefix_distance(query, word, 2 if len(query) > 6 else 1) == (
+        distance
+    )
+
+
+def test_missing_letter(search):
+    assert 'молоко' in search('молко')
+
+
+def test_similar_ordered_by_distance(search):
+    assert search('картфель') == [
+        'картофель', 'картофель молодой', 'карамель'
+    ]
+
+
+def test_prefix_and_substring_first(search):
+    assert search('молоко') == [
+        'молоко', 'молоко сгущенное', 'картофель молодой'
+    ]
+    assert search('офель') == ['картофель', 'картофель молодой']
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+from api.instrumentation import logger, request_timing_middleware
+from asgiref.sync import async_to_sync, sync_to_async
+from django.http import StreamingHttpResponse
+from django.test import AsyncRequestFactory
+from recipes.models import ShoppingCart, ShoppingListItem, Tag
+
+
+# Заголовок Server-Timing для всех пользователей, в журнал записывается
+# каждый запрос. Записи журнала передаются caplog
+@pytest.fixture(autouse=True)
+def timing_settings(settings, monkeypatch):
+    settings.SERVER_TIMING_FOR_ALL = True
+    settings.SLOW_REQUEST_MS = 0
+    monkeypatch.setattr(logger, 'propagate', True)
+
+
+def get_metrics(response):
+    return dict(
+        metric.split(';', 1)
+        for metric in response['Server-Timing'].split(', ')
+    )
+
+
+def get_records(caplog):
+    return [
+        json.loads(record.getMessage()) for record in caplog.records
+        if record.name == 'api.instrumentation'
+    ]
+
+
+def test_response(caplog, user_client, recipes):
+    response = user_client.get(f'/api/recipes/{recipes[0].pk}/')
+    metrics = get_metrics(response)
+    [record] = get_records(caplog)
+    assert metrics['size'] == f'desc="{len(response.content)}"'
+    assert record['size'] == len(response.content)
+    assert record['streaming'] is False
+
+
+def test_streaming_response(caplog, users, recipes, user_client):
+    ShoppingCart.objects.add(user=users[0], recipe=recipes[0])
+    ShoppingListItem.objects.apply_recipe(recipes[0], 1, users[0])
+    response = user_client.get('/api/recipes/download_shopping_cart/')
+    metrics = get_metrics(response)
+    assert metrics['partial'] == 'desc="streaming"'
+    assert 'size' not in metrics
+    assert get_records(caplog) == []
+    content = b''.join(response.streaming_content)
+    [record] = get_records(caplog)
+    assert record['size'] == len(content)
+    assert record['streaming'] is True
+    # Строки списка покупок выбираются при передаче тела
+    assert record['queries'] > int(metrics['queries'][6:-1])
+
+
+def test_async_streaming_response(caplog, tags):
+    async def content():
+        names = await sync_to_async(list)(
+            Tag.objects.values_list('name', flat=True)
+        )
+        for name in names:
+            yield name.encode()
+
+    async def get_response(request):
+        return StreamingHttpResponse(content())
+
+    async def read():
+        response = await request_timing_middleware(get_response)(
+            AsyncRequestFactory().get('/api/tags/')
+        )
+        metrics = get_metrics(response)
+        assert get_records(caplog) == []
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        return metrics, body
+
+    metrics, body = async_to_sync(read)()
+    [record] = get_records(caplog)
+    assert metrics['queries'] == 'desc="0"'
+    assert record['queries'] == 1
+    assert record['size'] == len(body)
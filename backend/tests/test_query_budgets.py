@@ -0,0 +1,370 @@
+import base64
+import os
+import time
+from io import StringIO
+
+import pytest
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from recipes.fulltext import update_search_index
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Subscription, Tag)
+from rest_framework.test import APIClient
+from users.models import CustomUser
+
+from .conftest import IMAGE, PNG, get_client
+
+USERS = 10
+RECIPES = 60
+INGREDIENTS = 50
+INGREDIENTS_PER_RECIPE = 8
+
+# Новый рецепт и изменения рецепта для проверок создания и изменения
+RECIPE_DATA = {
+    'name': 'Проверка',
+    'text': 'Описание',
+    'cooking_time': 10,
+    'image': IMAGE,
+    'tags': '{tags}',
+    'ingredients': '{ingredients}'
+}
+RECIPE_UPDATE = {
+    'name': 'Проверка изменения',
+    'tags': '{tags}',
+    'ingredients': '{own_ingredients}'
+}
+INGREDIENTS_UPDATE = {
+    'tags': '{tags}',
+    'ingredients': '{ingredients}'
+}
+LOGIN_DATA = {'email': 'user_1@example.com', 'password': 'password'}
+
+# Множитель времени ответа: на медленной машине CI бюджеты времени
+# увеличиваются переменной окружения QUERY_BUDGET_TIME_FACTOR
+TIME_FACTOR = float(os.getenv('QUERY_BUDGET_TIME_FACTOR', 1))
+
+# Бюджеты запросов: название, пользователь (anon - анонимный, user -
+# пользователь с подписками, избранным и списком покупок, admin -
+# администратор), метод, путь, тело запроса, код ответа, наибольшее
+# количество запросов к БД при пустом кэше и наибольшее время ответа в
+# миллисекундах (с запасом, время входа включает хеширование пароля). В
+# путь и тело подставляются id объектов набора данных (dataset).
+# Количество запросов не должно зависеть от объема данных
+BUDGETS = (
+    (
+        'Вход', 'anon', 'post', '/api/auth/token/login/',
+        LOGIN_DATA, 200, 3, 2000
+    ),
+    ('Выход', 'user', 'post', '/api/auth/token/logout/', None, 204, 3, 500),
+    ('Список тегов', 'anon', 'get', '/api/tags/', None, 200, 2, 300),
+    ('Тег', 'anon', 'get', '/api/tags/{tag}/', None, 200, 2, 300),
+    (
+        'Список ингредиентов', 'anon', 'get', '/api/ingredients/',
+        None, 200, 2, 300
+    ),
+    (
+        'Поиск ингредиентов', 'anon', 'get', '/api/ingredients/?name=ингр',
+        None, 200, 2, 300
+    ),
+    (
+        'Ингредиент', 'anon', 'get', '/api/ingredients/{ingredient}/',
+        None, 200, 2, 300
+    ),
+    (
+        'Список рецептов', 'anon', 'get', '/api/recipes/?limit=6',
+        None, 200, 6, 300
+    ),
+    (
+        'Список рецептов', 'user', 'get', '/api/recipes/?limit=6',
+        None, 200, 7, 300
+    ),
+    (
+        'Рецепты: теги', 'user', 'get',
+        '/api/recipes/?limit=6&tags={tag_slug}&tags={other_tag_slug}',
+        None, 200, 7, 300
+    ),
+    (
+        'Рецепты: автор', 'user', 'get',
+        '/api/recipes/?limit=6&author={author}',
+        None, 200, 8, 300
+    ),
+    (
+        'Рецепты: избранное', 'user', 'get',
+        '/api/recipes/?limit=6&is_favorited=1',
+        None, 200, 7, 300
+    ),
+    (
+        'Рецепты: список покупок', 'user', 'get',
+        '/api/recipes/?limit=6&is_in_shopping_cart=1',
+        None, 200, 7, 300
+    ),
+    (
+        'Рецепты: поиск', 'user', 'get', '/api/recipes/?limit=6&search=рецепт',
+        None, 200, 7, 300
+    ),
+    (
+        'Рецепты: курсор', 'user', 'get',
+        '/api/recipes/?limit=6&pagination=cursor',
+        None, 200, 6, 300
+    ),
+    ('Рецепт', 'anon', 'get', '/api/recipes/{recipe}/', None, 200, 6, 300),
+    ('Рецепт', 'user', 'get', '/api/recipes/{recipe}/', None, 200, 7, 300),
+    ('Лента подписок', 'user', 'get', '/api/recipes/feed/', None, 200, 6, 300),
+    ('Лента подписок', 'anon', 'get', '/api/recipes/feed/', None, 401, 0, 300),
+    (
+        'Список покупок (txt)', 'user', 'get',
+        '/api/recipes/download_shopping_cart/',
+        None, 200, 2, 300
+    ),
+    (
+        'Список покупок (csv)', 'user', 'get',
+        '/api/recipes/download_shopping_cart/?format=csv',
+        None, 200, 2, 300
+    ),
+    (
+        'Список покупок (pdf)', 'user', 'get',
+        '/api/recipes/download_shopping_cart/?format=pdf',
+        None, 200, 2, 1000
+    ),
+    ('Пользователи', 'admin', 'get', '/api/users/?limit=6', None, 200, 3, 300),
+    ('Пользователь', 'anon', 'get', '/api/users/{author}/', None, 200, 1, 300),
+    ('Пользователь', 'user', 'get', '/api/users/{author}/', None, 200, 2, 300),
+    (
+        'Текущий пользователь', 'user', 'get', '/api/users/me/',
+        None, 200, 1, 300
+    ),
+    (
+        'Подписки', 'user', 'get',
+        '/api/users/subscriptions/?limit=6&recipes_limit=3',
+        None, 200, 4, 300
+    ),
+    (
+        'Подписки', 'anon', 'get', '/api/users/subscriptions/',
+        None, 401, 0, 300
+    ),
+    (
+        'Подписка', 'user', 'post', '/api/users/{author}/subscribe/',
+        None, 201, 6, 500
+    ),
+    (
+        'Отписка', 'user', 'delete',
+        '/api/users/{subscribed_author}/subscribe/',
+        None, 204, 5, 500
+    ),
+    (
+        'Подписка на авторов', 'user', 'post', '/api/users/subscribe/batch/',
+        {'ids': '{authors}'}, 200, 6, 500
+    ),
+    (
+        'Отписка от авторов', 'user', 'delete', '/api/users/subscribe/batch/',
+        {'ids': '{subscribed_authors}'}, 200, 6, 500
+    ),
+    (
+        'В избранное', 'user', 'post', '/api/recipes/{recipe}/favorite/',
+        None, 201, 6, 500
+    ),
+    (
+        'Из избранного', 'user', 'delete',
+        '/api/recipes/{favorite_recipe}/favorite/',
+        None, 204, 6, 500
+    ),
+    (
+        'В список покупок', 'user', 'post',
+        '/api/recipes/{recipe}/shopping_cart/',
+        None, 201, 7, 500
+    ),
+    (
+        'Из списка покупок', 'user', 'delete',
+        '/api/recipes/{cart_recipe}/shopping_cart/',
+        None, 204, 8, 500
+    ),
+    (
+        'В избранное (несколько)', 'user', 'post',
+        '/api/recipes/favorite/batch/',
+        {'ids': '{recipes}'}, 200, 6, 500
+    ),
+    (
+        'Из избранного (несколько)', 'user', 'delete',
+        '/api/recipes/favorite/batch/',
+        {'ids': '{favorite_recipes}'}, 200, 6, 500
+    ),
+    (
+        'В список покупок (несколько)', 'user', 'post',
+        '/api/recipes/shopping_cart/batch/',
+        {'ids': '{recipes}'}, 200, 7, 500
+    ),
+    (
+        'Из списка покупок (несколько)', 'user', 'delete',
+        '/api/recipes/shopping_cart/batch/',
+        {'ids': '{cart_recipes}'}, 200, 8, 500
+    ),
+    (
+        'Создание рецепта', 'user', 'post', '/api/recipes/',
+        RECIPE_DATA, 201, 16, 500
+    ),
+    (
+        'Изменение рецепта', 'user', 'patch', '/api/recipes/{own_recipe}/',
+        RECIPE_UPDATE, 200, 14, 500
+    ),
+    (
+        'Изменение ингредиентов', 'user', 'patch',
+        '/api/recipes/{own_recipe}/',
+        INGREDIENTS_UPDATE, 200, 17, 500
+    ),
+    (
+        'Удаление многих ингредиентов', 'user', 'patch',
+        '/api/recipes/{big_recipe}/',
+        INGREDIENTS_UPDATE, 200, 18, 500
+    ),
+    (
+        'Удаление рецепта', 'user', 'delete', '/api/recipes/{own_recipe}/',
+        None, 204, 16, 500
+    ),
+)
+
+
+# Набор данных: теги, ингредиенты, пользователи с рецептами, у
+# пользователя user - подписки, избранное и список покупок
+@pytest.fixture
+def dataset(db):
+    tags = Tag.objects.bulk_create(
+        Tag(name=f'Тег {number}', color=f'#0000{number:02d}',
+            slug=f'tag_{number}')
+        for number in range(3)
+    )
+    ingredients = Ingredient.objects.bulk_create(
+        Ingredient(name=f'Ингредиент {number:04d}', measurement_unit='г')
+        for number in range(INGREDIENTS)
+    )
+    password = make_password('password')
+    users = CustomUser.objects.bulk_create(
+        CustomUser(username=f'user_{number}',
+                   email=f'user_{number}@example.com',
+                   first_name='Имя', last_name='Фамилия',
+                   password=password, is_staff=not number,
+                   is_superuser=not number)
+        for number in range(USERS + 1)
+    )
+    admin, user, authors = users[0], users[1], users[2:]
+    image = Recipe._meta.get_field('image')
+    image_name = image.storage.save(
+        f'{image.upload_to}budget.png',
+        ContentFile(base64.b64decode(PNG))
+    )
+    recipes = Recipe.objects.bulk_create(
+        Recipe(name=f'Рецепт {number}', text='Описание рецепта',
+               cooking_time=number % 60 + 1, image=image_name,
+               author=(users[1:])[number % (len(users) - 1)])
+        for number in range(RECIPES)
+    )
+    Recipe.tags.through.objects.bulk_create(
+        Recipe.tags.through(recipe=recipe, tag=tags[number % len(tags)])
+        for number, recipe in enumerate(recipes)
+    )
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(
+            recipe=recipe,
+            ingredient=ingredients[(number * 7 + shift) % len(ingredients)],
+            amount=shift + 1
+        )
+        for number, recipe in enumerate(recipes)
+        for shift in range(INGREDIENTS_PER_RECIPE)
+    )
+    # Последние шесть авторов - для проверок подписки
+    subscribed = authors[:-6]
+    own = [recipe for recipe in recipes if recipe.author == user]
+    other = [recipe for recipe in recipes if recipe.author != user]
+    # Рецепт со всеми ингредиентами - для проверки удаления многих
+    # ингредиентов
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe=own[1], ingredient=ingredient, amount=1)
+        for ingredient in ingredients
+        if not own[1].recipe_ingredient.filter(ingredient=ingredient).exists()
+    )
+    Subscription.objects.bulk_create(
+        Subscription(user=user, author=author) for author in subscribed
+    )
+    Favorite.objects.bulk_create(
+        Favorite(user=user, recipe=recipe) for recipe in other[:20]
+    )
+    ShoppingCart.objects.bulk_create(
+        ShoppingCart(user=user, recipe=recipe) for recipe in other[:10]
+    )
+    for command in ('reconcile_counters', 'rebuild_shopping_lists'):
+        call_command(command, stdout=StringIO())
+    update_search_index()
+    free = other[20:]
+    return {
+        'clients': {
+            'anon': APIClient(),
+            'user': get_client(user),
+            'admin': get_client(admin)
+        },
+        'ids': {
+            'tag': tags[0].pk,
+            'tag_slug': tags[0].slug,
+            'other_tag_slug': tags[1].slug,
+            'tags': [tag.pk for tag in tags[:2]],
+            'ingredient': ingredients[0].pk,
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 5}
+                for ingredient in ingredients[:INGREDIENTS_PER_RECIPE]
+            ],
+            'author': authors[-1].pk,
+            'authors': [author.pk for author in authors[-6:-1]],
+            'subscribed_author': subscribed[0].pk,
+            'subscribed_authors': [author.pk for author in subscribed],
+            'recipe': free[0].pk,
+            'recipes': [recipe.pk for recipe in free[1:7]],
+            'favorite_recipe': other[0].pk,
+            'favorite_recipes': [recipe.pk for recipe in other[:6]],
+            'cart_recipe': other[0].pk,
+            'cart_recipes': [recipe.pk for recipe in other[:6]],
+            'own_recipe': own[0].pk,
+            'big_recipe': own[1].pk,
+            'own_ingredients': [
+                {'id': ingredient_id, 'amount': amount}
+                for ingredient_id, amount
+                in own[0].recipe_ingredient.values_list(
+                    'ingredient_id',
+                    'amount'
+                )
+            ]
+        }
+    }
+
+
+# Подстановка id в путь и тело запроса
+def fill(value, ids):
+    if isinstance(value, dict):
+        return {key: fill(item, ids) for key, item in value.items()}
+    if not isinstance(value, str):
+        return value
+    if value.startswith('{') and value.endswith('}'):
+        return ids.get(value[1:-1], value)
+    return value.format(**ids)
+
+
+# Потоковый ответ читается внутри проверки: строки списка покупок
+# выбираются при чтении ответа
+@pytest.mark.parametrize(
+    'name, user, method, path, data, status, max_queries, max_ms',
+    BUDGETS,
+    ids=[f'{check[1]}-{check[2]}-{check[3]}' for check in BUDGETS]
+)
+def test_query_budget(django_assert_max_num_queries, dataset, name, user,
+                      method, path, data, status, max_queries, max_ms):
+    client = dataset['clients'][user]
+    path = fill(path, dataset['ids'])
+    data = fill(data, dataset['ids'])
+    with django_assert_max_num_queries(max_queries):
+        start = time.perf_counter()
+        response = getattr(client, method)(path, data, format='json')
+        if response.streaming:
+            b''.join(response.streaming_content)
+        duration = (time.perf_counter() - start) * 1000
+    assert response.status_code == status, response.content
+    assert duration <= max_ms * TIME_FACTOR, (
+        f'{name}: {duration:.0f} мс, бюджет {max_ms * TIME_FACTOR:.0f} мс'
+    )
@@ -0,0 +1,68 @@
+import base64
+from hashlib import sha256
+from io import BytesIO
+
+from PIL import Image
+from recipes.models import Recipe
+
+from .conftest import IMAGE, PNG
+
+
+def get_image(color):
+    buffer = BytesIO()
+    Image.new('RGB', (2, 2), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def get_data(tags, ingredients, image):
+    return {
+        'name': 'Рецепт',
+        'text': 'Описание',
+        'cooking_time': 10,
+        'image': image,
+        'tags': [tags[0].pk],
+        'ingredients': [{'id': ingredients[0].pk, 'amount': 5}]
+    }
+
+
+# Хеш картинки сохраняется вместе с картинкой, до построения вариантов.
+# Повторно переданная картинка не сохраняется
+def test_image_hash(tags, ingredients, user_client):
+    response = user_client.post(
+        '/api/recipes/',
+        get_data(tags, ingredients, IMAGE),
+        format='json'
+    )
+    assert response.status_code == 201, response.data
+    recipe = Recipe.objects.get(pk=response.data['id'])
+    assert recipe.image_hash == sha256(base64.b64decode(PNG)).hexdigest()
+
+    image = get_image('red')
+    response = user_client.patch(
+        f'/api/recipes/{recipe.pk}/',
+        get_data(
+            tags,
+            ingredients,
+            f'data:image/png;base64,{base64.b64encode(image).decode()}'
+        ),
+        format='json'
+    )
+    assert response.status_code == 200, response.data
+    changed = Recipe.objects.get(pk=recipe.pk)
+    assert changed.image.name != recipe.image.name
+    assert changed.image_hash == sha256(image).hexdigest()
+    assert not changed.image_thumbnail
+
+    response = user_client.patch(
+        f'/api/recipes/{recipe.pk}/',
+        get_data(
+            tags,
+            ingredients,
+            f'data:image/png;base64,{base64.b64encode(image).decode()}'
+        ),
+        format='json'
+    )
+    assert response.status_code == 200, response.data
+    same = Recipe.objects.get(pk=recipe.pk)
+    assert same.image.name == changed.image.name
+    assert same.image_hash == changed.image_hash
@@ -0,0 +1,69 @@
+"""
+Количество запросов к БД в списке и карточке рецепта не зависит от
+количества рецептов на странице (with_related, with_user_flags). Запросы
+выполняются с пустым кэшем, поэтому в количество входят чтение
+справочников (2) и, для пользователя, токена (1).
+"""
+import pytest
+from django.core.cache import cache
+from recipes.models import Favorite, ShoppingCart
+
+from .conftest import INGREDIENTS_PER_RECIPE
+
+# Запросы списка рецептов: справочники, количество рецептов, рецепты с
+# автором и флагами, теги, ингредиенты
+LIST_QUERIES = 6
+# Запросы карточки рецепта: справочники, дата изменения (ETag), рецепт с
+# автором и флагами, теги, ингредиенты
+DETAIL_QUERIES = 6
+# Запрос токена пользователя
+AUTH_QUERIES = 1
+
+
+# Клиент и запросы аутентификации. У пользователя первый рецепт - в
+# избранном, второй - в списке покупок
+@pytest.fixture(params=('anon', 'user'))
+def client_and_queries(request, users, recipes, anon_client, user_client):
+    if request.param == 'anon':
+        return anon_client, 0
+    Favorite.objects.create(user=users[0], recipe=recipes[0])
+    ShoppingCart.objects.create(user=users[0], recipe=recipes[1])
+    return user_client, AUTH_QUERIES
+
+
+# Флаги рецептов в ответе: вычисляются только для пользователя, для
+# анонимного пользователя - null
+def check_flags(data, recipes, authenticated):
+    if not authenticated:
+        assert data['is_favorited'] is None
+        assert data['is_in_shopping_cart'] is None
+        return
+    assert data['is_favorited'] == (data['id'] == recipes[0].pk)
+    assert data['is_in_shopping_cart'] == (data['id'] == recipes[1].pk)
+
+
+@pytest.mark.parametrize('limit', (1, 6, 12))
+def test_recipe_list_queries(limit, recipes, client_and_queries,
+                             django_assert_num_queries):
+    client, auth_queries = client_and_queries
+    with django_assert_num_queries(LIST_QUERIES + auth_queries):
+        response = client.get(f'/api/recipes/?limit={limit}')
+    assert response.status_code == 200
+    results = response.json()['results']
+    assert len(results) == limit
+    for data in results:
+        assert len(data['ingredients']) == INGREDIENTS_PER_RECIPE
+        check_flags(data, recipes, bool(auth_queries))
+
+
+def test_recipe_detail_queries(recipes, client_and_queries,
+                               django_assert_num_queries):
+    client, auth_queries = client_and_queries
+    for recipe in recipes[:3]:
+        cache.clear()
+        with django_assert_num_queries(DETAIL_QUERIES + auth_queries):
+            response = client.get(f'/api/recipes/{recipe.pk}/')
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data['tags']) == recipe.tags.count()
+        check_flags(data, recipes, bool(auth_queries))
@@ -0,0 +1,147 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from recipes.fulltext import search_recipes, update_search_index
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Subscription
+
+from .conftest import create_user
+
+
+# Рецепты с разной релевантностью запроса «суп»: в названии, в описании и в
+# ингредиентах, по несколько рецептов с одинаковой релевантностью. Индекс
+# обновляется после фиксации транзакции, поэтому строится явно
+@pytest.fixture
+def soup_recipes(users, recipes, ingredients):
+    found = []
+    for number in range(9):
+        kind = number % 3
+        recipe = Recipe.objects.create(
+            name='Суп' if kind == 0 else f'Блюдо {number}',
+            text='Сварите суп' if kind == 1 else 'Описание',
+            cooking_time=5,
+            author=users[number % len(users)],
+            image=recipes[0].image.name
+        )
+        ingredient = ingredients[number]
+        if kind == 2:
+            ingredient = Ingredient.objects.create(
+                name=f'Суповой набор {number}',
+                measurement_unit='г'
+            )
+        RecipeIngredient.objects.create(
+            recipe=recipe,
+            ingredient=ingredient,
+            amount=1
+        )
+        found.append(recipe)
+    update_search_index()
+    return found
+
+
+# id рецептов списка (все на одной странице)
+def get_ranked(client, **params):
+    return [
+        recipe['id'] for recipe in client.get(
+            '/api/recipes/',
+            {'limit': 50, **params}
+        ).json()['results']
+    ]
+
+
+# id рецептов со всех страниц пагинации по курсору
+def get_cursor_pages(client, path, **params):
+    ids = []
+    data = client.get(path, params).json()
+    while True:
+        ids.extend(recipe['id'] for recipe in data['results'])
+        if not data['next']:
+            return ids
+        data = client.get(data['next']).json()
+
+
+def test_search_ranked(soup_recipes, user_client):
+    ids = get_ranked(user_client, search='суп')
+    assert sorted(ids) == sorted(recipe.pk for recipe in soup_recipes)
+    names = {recipe.pk: recipe.name for recipe in soup_recipes}
+    assert [names[pk] for pk in ids[:3]] == ['Суп'] * 3
+
+
+@pytest.mark.parametrize('limit', (1, 2, 4))
+def test_search_cursor_ranked(limit, soup_recipes, user_client):
+    assert get_cursor_pages(
+        user_client,
+        '/api/recipes/',
+        search='суп',
+        pagination='cursor',
+        limit=limit
+    ) == get_ranked(user_client, search='суп')
+
+
+def test_feed_search_ranked(users, soup_recipes, user_client):
+    for author in users[1:]:
+        Subscription.objects.create(user=users[0], author=author)
+    own = set(
+        Recipe.objects.filter(author=users[0]).values_list('pk', flat=True)
+    )
+    assert get_cursor_pages(
+        user_client,
+        '/api/recipes/feed/',
+        search='суп',
+        limit=2
+    ) == [
+        pk for pk in get_ranked(user_client, search='суп') if pk not in own
+    ]
+
+
+def test_cursor_without_search(recipes, anon_client):
+    assert get_cursor_pages(
+        anon_client,
+        '/api/recipes/',
+        pagination='cursor',
+        limit=5
+    ) == sorted((recipe.pk for recipe in recipes), reverse=True)
+
+
+# Таблица индекса создана миграцией, индекс рецепта обновляется сигналом
+def test_search_index_table(db, django_capture_on_commit_callbacks):
+    author = create_user(10)
+    with django_capture_on_commit_callbacks(execute=True):
+        recipe = Recipe.objects.create(
+            name='Борщ', text='Описание', cooking_time=5, author=author,
+            image='recipes/images/recipe.png'
+        )
+    assert list(search_recipes(Recipe.objects.all(), 'борщ')) == [recipe]
+
+
+# Запросы к таблице поискового индекса
+def capture_search_queries(action):
+    with CaptureQueriesContext(connection) as context:
+        action()
+    return [
+        query['sql'] for query in context.captured_queries
+        if 'recipes_recipe_search' in query['sql']
+    ]
+
+
+# Изменение рецепта и нескольких его ингредиентов в одной транзакции
+# обновляет индекс рецепта один раз
+def test_search_index_updated_once(django_capture_on_commit_callbacks,
+                                   recipes, ingredients, anon_client):
+    recipe = recipes[0]
+
+    def change():
+        with django_capture_on_commit_callbacks(execute=True):
+            recipe.name = 'Суп'
+            recipe.save()
+            for ingredient in ingredients[10:15]:
+                RecipeIngredient.objects.create(
+                    recipe=recipe,
+                    ingredient=ingredient,
+                    amount=1
+                )
+
+    queries = capture_search_queries(change)
+    assert len(queries) == len(capture_search_queries(
+        lambda: update_search_index((recipe.pk, ))
+    ))
+    assert get_ranked(anon_client, search='суп') == [recipe.pk]
@@ -0,0 +1,59 @@
+import pytest
+from api import async_views
+from api.async_views import ShoppingListView
+from api.views import RecipeViewSet
+from asgiref.sync import async_to_sync
+from django.test import AsyncRequestFactory
+from recipes.models import ShoppingCart, ShoppingListItem
+from rest_framework.authtoken.models import Token
+
+URL = '/api/recipes/download_shopping_cart/'
+FORMATS = ('txt', 'csv', 'pdf')
+
+
+@pytest.fixture
+def cart(users, recipes):
+    for recipe in recipes:
+        ShoppingCart.objects.add(user=users[0], recipe=recipe)
+    ShoppingListItem.objects.apply_recipes(recipes, 1, users[0])
+    return ShoppingListItem.objects.for_export(users[0])
+
+
+# Асинхронный обработчик вызывается напрямую: маршруты асинхронных
+# обработчиков подключаются только под ASGI (settings.ASYNC_READ_VIEWS)
+def get_async_content(user, format):
+    view = ShoppingListView.as_view(viewset_view=RecipeViewSet.as_view(
+        {'get': 'download_shopping_cart'},
+        **RecipeViewSet.download_shopping_cart.kwargs
+    ))
+    token, _ = Token.objects.get_or_create(user=user)
+    request = AsyncRequestFactory().get(
+        URL,
+        {'format': format},
+        headers={'Authorization': f'Token {token.key}'}
+    )
+
+    async def read():
+        response = await view(request)
+        assert response.status_code == 200
+        return b''.join([chunk async for chunk in response.streaming_content])
+    return async_to_sync(read)()
+
+
+def test_export_chunks(django_assert_num_queries, users, cart):
+    with django_assert_num_queries(3):
+        chunks = list(ShoppingListItem.objects.export_chunks(users[0], 6))
+    assert [len(chunk) for chunk in chunks] == [6, 6, 4]
+    assert [row for chunk in chunks for row in chunk] == list(cart)
+
+
+@pytest.mark.parametrize('format', FORMATS)
+def test_async_shopping_list(monkeypatch, users, cart, user_client, format):
+    monkeypatch.setattr(async_views, 'SHOPPING_LIST_CHUNK_SIZE', 3)
+    response = user_client.get(URL, {'format': format})
+    assert response.status_code == 200
+    content = b''.join(response.streaming_content)
+    if format != 'pdf':
+        assert content == get_async_content(users[0], format)
+    else:
+        assert get_async_content(users[0], format).startswith(b'%PDF')
@@ -0,0 +1,98 @@
+import threading
+
+import pytest
+from django.db import connection, connections
+from recipes.models import (Favorite, ShoppingCart, ShoppingListItem,
+                            Subscription)
+
+from .conftest import get_client
+
+# Запросов на добавление или удаление связи (AbstractCreateDeleteMixin.
+# perform_action): не больше пяти, запрос аутентификации по токену, BEGIN и
+# COMMIT транзакции
+TOGGLE_QUERIES = 8
+# Количество одновременных запросов в тесте конкурентного добавления
+THREADS = 8
+
+
+def get_paths(users, recipes):
+    return {
+        'favorite': f'/api/recipes/{recipes[1].pk}/favorite/',
+        'shopping_cart': f'/api/recipes/{recipes[1].pk}/shopping_cart/',
+        'subscribe': f'/api/users/{users[1].pk}/subscribe/'
+    }
+
+
+# Тест выполняется вне транзакции теста, как и запросы к сервису: иначе
+# transaction.atomic представления добавляет запросы точек сохранения
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('name', ('favorite', 'shopping_cart', 'subscribe'))
+def test_toggle_queries(django_assert_max_num_queries, users, recipes,
+                        user_client, name):
+    path = get_paths(users, recipes)[name]
+    for method, code in (
+        ('post', 201), ('post', 400), ('delete', 204), ('delete', 400)
+    ):
+        with django_assert_max_num_queries(TOGGLE_QUERIES):
+            response = getattr(user_client, method)(path)
+        assert response.status_code == code, response.data
+
+
+def test_subscribe_response(users, recipes, user_client):
+    response = user_client.post(get_paths(users, recipes)['subscribe'])
+    assert response.data['is_subscribed'] is True
+    assert len(response.data['recipes']) == 4
+
+
+# Одновременные запросы на добавление одной и той же связи: связь
+# добавляется один раз, остальные запросы получают 400. Под SQLite запись
+# блокирует всю базу, поэтому тест выполняется только под PostgreSQL
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('name', ('favorite', 'shopping_cart', 'subscribe'))
+def test_concurrent_add(users, recipes, name):
+    if connection.vendor != 'postgresql':
+        pytest.skip('Нужна PostgreSQL')
+    user, recipe = users[0], recipes[1]
+    path = get_paths(users, recipes)[name]
+    clients = [get_client(user) for _ in range(THREADS)]
+    barrier = threading.Barrier(THREADS)
+    codes = []
+
+    def post(client):
+        barrier.wait()
+        try:
+            codes.append(client.post(path).status_code)
+        finally:
+            connections.close_all()
+
+    threads = [
+        threading.Thread(target=post, args=(client, )) for client in clients
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(codes) == [201] + [400] * (THREADS - 1), codes
+    recipe.refresh_from_db()
+    if name == 'favorite':
+        assert Favorite.objects.filter(user=user, recipe=recipe).count() == 1
+        assert recipe.favorites_count == 1
+    elif name == 'shopping_cart':
+        assert ShoppingCart.objects.filter(
+            user=user,
+            recipe=recipe
+        ).count() == 1
+        assert recipe.shopping_cart_count == 1
+        assert dict(ShoppingListItem.objects.filter(user=user).values_list(
+            'ingredient_id',
+            'amount'
+        )) == dict(recipe.recipe_ingredient.values_list(
+            'ingredient_id',
+            'amount'
+        ))
+    else:
+        assert Subscription.objects.filter(
+            user=user,
+            author=users[1]
+        ).count() == 1
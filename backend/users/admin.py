@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.models import Group
+from recipes.admin_utils import LargeTableAdmin
 from rest_framework.authtoken.models import TokenProxy
 
 from .models import CustomUser
@@ -9,6 +10,7 @@ admin.site.unregister(Group)
 
 
 @admin.register(CustomUser)
-class CustomUserAdmin(admin.ModelAdmin):
+class CustomUserAdmin(LargeTableAdmin):
     list_display = ('username', 'first_name', 'last_name', 'is_staff')
-    list_filter = ('username', )
+    list_filter = ('is_staff', )
+    search_fields = ('username', 'email', 'first_name', 'last_name')
@@ -0,0 +1,138 @@
+import asyncio
+from collections import defaultdict
+from statistics import quantiles
+from time import perf_counter
+from urllib.parse import quote, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+PATHS = (
+    '/api/recipes/?limit=6',
+    '/api/recipes/?limit=6&page=2',
+    '/api/tags/',
+    '/api/ingredients/?name=мол'
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест частых запросов на чтение: заданное количество '
+        'одновременных клиентов в течение заданного времени. Используется '
+        'для сравнения запуска под WSGI (gunicorn) и ASGI (gunicorn с '
+        'воркерами uvicorn), см. README.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            default='http://127.0.0.1:8000',
+            help='Адрес сервера.'
+        )
+        parser.add_argument(
+            '--path',
+            action='append',
+            dest='paths',
+            help='Путь запроса (можно указать несколько раз).'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=64,
+            help='Количество одновременных клиентов.'
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=10,
+            help='Длительность теста в секундах.'
+        )
+        parser.add_argument(
+            '--token',
+            help='Токен пользователя (без него запросы анонимные).'
+        )
+
+    # Один запрос в отдельном соединении (синхронные воркеры gunicorn не
+    # поддерживают keep-alive, поэтому соединение закрывается в обоих
+    # режимах). Возвращает код ответа
+    async def request(self, host, port, path, token):
+        reader, writer = await asyncio.open_connection(host, port)
+        headers = [
+            f'GET {quote(path, safe="/?=&")} HTTP/1.1',
+            f'Host: {host}:{port}',
+            'Accept: application/json',
+            'Connection: close'
+        ]
+        if token:
+            headers.append(f'Authorization: Token {token}')
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode())
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        await writer.wait_closed()
+        return int(response.split(b' ', 2)[1])
+
+    async def client(self, number, options, deadline, results):
+        url = urlsplit(options['url'])
+        paths = options['paths'] or PATHS
+        while perf_counter() < deadline:
+            path = paths[number % len(paths)]
+            number += 1
+            start = perf_counter()
+            try:
+                status = await self.request(
+                    url.hostname,
+                    url.port or 80,
+                    path,
+                    options['token']
+                )
+            except (OSError, IndexError, ValueError):
+                status = None
+            results[path].append((status, perf_counter() - start))
+
+    async def run(self, options):
+        results = defaultdict(list)
+        start = perf_counter()
+        deadline = start + options['duration']
+        await asyncio.gather(*(
+            self.client(number, options, deadline, results)
+            for number in range(options['concurrency'])
+        ))
+        return results, perf_counter() - start
+
+    def write_row(self, name, rows, elapsed):
+        times = sorted(time * 1000 for _, time in rows)
+        errors = sum(
+            1 for status, _ in rows
+            if status is None or status >= 400
+        )
+        if len(times) > 1:
+            percentiles = quantiles(times, n=100)
+        else:
+            percentiles = times * 99
+        self.stdout.write(
+            f'{name:<32}{len(rows):>8}{errors:>8}'
+            f'{len(rows) / elapsed:>10.1f}{percentiles[49]:>10.1f}'
+            f'{percentiles[94]:>10.1f}{percentiles[98]:>10.1f}'
+        )
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['duration'] <= 0:
+            raise CommandError(
+                'Количество клиентов и длительность должны быть больше нуля.'
+            )
+        results, elapsed = asyncio.run(self.run(options))
+        self.stdout.write(
+            f'{options["url"]}, клиентов: {options["concurrency"]}, '
+            f'время: {elapsed:.1f} с'
+        )
+        self.stdout.write(
+            f'{"путь":<32}{"запросов":>8}{"ошибок":>8}{"запр/с":>10}'
+            f'{"p50, мс":>10}{"p95, мс":>10}{"p99, мс":>10}'
+        )
+        for path, rows in results.items():
+            self.write_row(path[:31], rows, elapsed)
+        self.write_row(
+            '<все>',
+            [row for rows in results.values() for row in rows],
+            elapsed
+        )
@@ -0,0 +1,70 @@
+from timeit import repeat
+
+from api.search import ingredient_index
+from api.serializers import IngredientSerializer
+from django.core.management.base import BaseCommand
+from recipes.models import Ingredient
+from rest_framework.renderers import JSONRenderer
+
+QUERIES = ('а', 'мол', 'молоко', 'Сыр', 'картофель', 'мoлокo', 'сахр')
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнение поиска ингредиентов через ORM (name__startswith) и через '
+        'индекс в памяти процесса.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--number',
+            type=int,
+            default=100,
+            help='Количество повторов каждого запроса.'
+        )
+
+    # Среднее время одного вызова в миллисекундах (лучший из трех замеров)
+    def measure(self, func, number):
+        return min(repeat(func, number=number, repeat=3)) / number * 1000
+
+    def handle(self, *args, **options):
+        number = options['number']
+        renderer = JSONRenderer()
+        ingredient_index.rendered()
+        self.stdout.write(
+            f'Ингредиентов в БД: {Ingredient.objects.count()}, '
+            f'повторов: {number}'
+        )
+        self.stdout.write(f'{"запрос":<14}{"ORM, мс":>10}{"индекс, мс":>12}'
+                          f'{"ORM":>6}{"индекс":>8}')
+        for query in QUERIES:
+            orm_count = Ingredient.objects.filter(
+                name__startswith=query
+            ).count()
+            index_count = len(ingredient_index.search(query))
+            orm_time = self.measure(
+                lambda: renderer.render(IngredientSerializer(
+                    Ingredient.objects.filter(name__startswith=query),
+                    many=True
+                ).data),
+                number
+            )
+            index_time = self.measure(
+                lambda: renderer.render(ingredient_index.search(query)),
+                number
+            )
+            self.stdout.write(
+                f'{query:<14}{orm_time:>10.3f}{index_time:>12.3f}'
+                f'{orm_count:>6}{index_count:>8}'
+            )
+        orm_time = self.measure(
+            lambda: renderer.render(IngredientSerializer(
+                Ingredient.objects.all(),
+                many=True
+            ).data),
+            number
+        )
+        index_time = self.measure(ingredient_index.rendered, number)
+        self.stdout.write(
+            f'{"<все>":<14}{orm_time:>10.3f}{index_time:>12.3f}'
+        )
@@ -0,0 +1,37 @@
+from api.images import build_variants, variants_ready
+from django.core.management.base import BaseCommand
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Построение вариантов картинок рецептов (миниатюра и картинка для '
+        'страницы рецепта в формате WebP), которые еще не построены.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Перестроить варианты всех картинок.'
+        )
+
+    def handle(self, *args, **options):
+        built = failed = 0
+        recipes = Recipe.objects.exclude(image='').only(
+            'image',
+            'image_thumbnail',
+            'image_detail'
+        )
+        for recipe in recipes.iterator():
+            if not options['force'] and variants_ready(recipe):
+                continue
+            try:
+                build_variants(recipe)
+                built += 1
+            except Exception as error:
+                failed += 1
+                self.stderr.write(f'Рецепт {recipe.pk}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Построено вариантов: {built}, ошибок: {failed}.'
+        ))
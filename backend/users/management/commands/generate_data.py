@@ -0,0 +1,463 @@
+import random
+from collections import Counter
+from colorsys import hsv_to_rgb
+from io import BytesIO
+from itertools import accumulate, islice
+from time import perf_counter
+
+from api.cache import RECIPES_VERSION_KEY, bump_version
+from api.images import build_variants, get_image_hash
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from PIL import Image
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Subscription, Tag)
+from users.models import CustomUser
+
+from .import_data import CopyStream
+
+# Количество объектов, которые добавляются в БД за один запрос (кроме
+# PostgreSQL, где связи загружаются через COPY)
+BATCH_SIZE = 5000
+# Картинки-заглушки рецептов: количество и размер. Файлы создаются один раз
+# и используются всеми рецептами
+PLACEHOLDERS = 8
+PLACEHOLDER_SIZE = (1200, 800)
+# Количество попыток выбрать различные объекты по степенному распределению,
+# после которых недостающие объекты выбираются равномерно
+DRAW_ROUNDS = 5
+
+FIRST_NAMES = (
+    'Анна', 'Иван', 'Мария', 'Петр', 'Елена', 'Сергей', 'Ольга', 'Дмитрий',
+    'Наталья', 'Алексей'
+)
+LAST_NAMES = (
+    'Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Соколов',
+    'Михайлов', 'Новиков', 'Федоров', 'Морозов'
+)
+DISHES = (
+    'Суп', 'Салат', 'Рагу', 'Запеканка', 'Пирог', 'Омлет', 'Каша', 'Паста',
+    'Плов', 'Котлеты', 'Блины', 'Соус'
+)
+STEPS = (
+    'Подготовьте продукты: {}.',
+    'Смешайте {} и хорошо перемешайте.',
+    'Добавьте {} и готовьте на среднем огне.',
+    'Подавайте горячим, посыпав {}.'
+)
+AMOUNTS = (1, 2, 3, 5, 10, 20, 50, 100, 150, 200, 250, 300, 500)
+
+
+# Накопленные веса степенного распределения (закон Ципфа) для count рангов:
+# объект ранга r выбирается с вероятностью, пропорциональной 1 / r ** skew
+def power_law(count, skew):
+    return list(accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+# Случайный порядок индексов: объект order[r] получает ранг r
+def ranking(rng, count):
+    order = list(range(count))
+    rng.shuffle(order)
+    return order
+
+
+# count различных индексов (без exclude) по рангам order с весами
+# cum_weights, по возрастанию
+def distinct_choices(rng, order, cum_weights, count, exclude=None):
+    chosen = set()
+    for _ in range(DRAW_ROUNDS):
+        if len(chosen) >= count:
+            break
+        chosen.update(
+            order[rank] for rank in rng.choices(
+                range(len(order)),
+                cum_weights=cum_weights,
+                k=count - len(chosen)
+            )
+        )
+        chosen.discard(exclude)
+    while len(chosen) < count:
+        chosen.add(rng.randrange(len(order)))
+        chosen.discard(exclude)
+    return sorted(chosen)
+
+
+# Распределение total между индексами по рангам order с весами cum_weights,
+# не больше limit на индекс. Выборки сверх limit повторяются, а остаток
+# распределяется равномерно
+def distribute(rng, order, cum_weights, total, limit):
+    counts = Counter()
+    total = min(total, len(order) * limit)
+    for _ in range(DRAW_ROUNDS):
+        missing = total - sum(counts.values())
+        if not missing:
+            break
+        for index in rng.choices(order, cum_weights=cum_weights, k=missing):
+            if counts[index] < limit:
+                counts[index] += 1
+    missing = total - sum(counts.values())
+    while missing:
+        index = rng.randrange(len(order))
+        if counts[index] < limit:
+            counts[index] += 1
+            missing -= 1
+    return counts
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерация набора данных для нагрузочного тестирования: '
+        'пользователи, рецепты с ингредиентами и тегами, избранное, списки '
+        'покупок и подписки. Авторы рецептов, подписчики, популярные рецепты '
+        'и ингредиенты выбираются по степенному распределению (немногие '
+        'популярные авторы и рецепты, активные подписчики). Данные '
+        'добавляются пачками (в PostgreSQL - через COPY) и одинаковы при '
+        'одинаковом --seed. Ингредиенты и теги нужно загрузить заранее '
+        'командой import_data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=1000,
+            help='Количество пользователей.'
+        )
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=5000,
+            help='Количество рецептов.'
+        )
+        parser.add_argument(
+            '--favorites',
+            type=int,
+            default=50000,
+            help='Количество добавлений в избранное.'
+        )
+        parser.add_argument(
+            '--carts',
+            type=int,
+            default=5000,
+            help='Количество рецептов в списках покупок.'
+        )
+        parser.add_argument(
+            '--subscriptions',
+            type=int,
+            default=10000,
+            help='Количество подписок.'
+        )
+        parser.add_argument(
+            '--skew',
+            type=float,
+            default=1.1,
+            help='Показатель степенного распределения популярности.'
+        )
+        parser.add_argument(
+            '--seed',
+            default='foodgram',
+            help='Начальное значение генератора случайных чисел.'
+        )
+        parser.add_argument(
+            '--prefix',
+            default='generated',
+            help='Префикс имен и e-mail пользователей.'
+        )
+        parser.add_argument(
+            '--password',
+            help='Пароль пользователей (без него вход по паролю невозможен).'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Количество объектов в одной пачке.'
+        )
+
+    # Генератор случайных чисел этапа генерации: у каждого этапа свой,
+    # поэтому, например, изменение --favorites не меняет рецепты
+    def get_random(self, stage):
+        return random.Random(f'{self.seed}-{stage}')
+
+    def report(self, title, count, start):
+        self.stdout.write(
+            f'{title}: {count} за {perf_counter() - start:.2f} с.'
+        )
+
+    # Добавление объектов пачками. Вернет id добавленных объектов
+    def create_objects(self, model, objs):
+        pks = []
+        while batch := list(islice(objs, self.batch_size)):
+            pks.extend(obj.pk for obj in model.objects.bulk_create(batch))
+        return pks
+
+    # Добавление строк rows (значения полей fields) без создания объектов
+    # моделей: в PostgreSQL - через COPY, в остальных БД - пачками. Вернет
+    # количество строк
+    def insert_rows(self, model, fields, rows):
+        total = 0
+        if connection.vendor == 'postgresql':
+            def counted():
+                nonlocal total
+                for row in rows:
+                    total += 1
+                    yield row
+            quote = connection.ops.quote_name
+            columns = ', '.join(
+                quote(model._meta.get_field(field).column) for field in fields
+            )
+            with connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f'COPY {quote(model._meta.db_table)} ({columns}) '
+                    f'FROM STDIN WITH (FORMAT csv)',
+                    CopyStream(counted())
+                )
+            return total
+        while batch := list(islice(rows, self.batch_size)):
+            model.objects.bulk_create(
+                model(**dict(zip(fields, row))) for row in batch
+            )
+            total += len(batch)
+        return total
+
+    # Картинки-заглушки: однотонные JPEG разных цветов. Уже созданные файлы
+    # используются повторно
+    def create_placeholders(self):
+        storage = Recipe._meta.get_field('image').storage
+        names = []
+        for number in range(PLACEHOLDERS):
+            name = f'recipes/placeholder_{number}.jpg'
+            if not storage.exists(name):
+                color = tuple(
+                    int(value * 255)
+                    for value in hsv_to_rgb(number / PLACEHOLDERS, 0.5, 0.9)
+                )
+                buffer = BytesIO()
+                Image.new('RGB', PLACEHOLDER_SIZE, color).save(buffer, 'JPEG')
+                name = storage.save(name, ContentFile(buffer.getvalue()))
+            names.append(name)
+        return names
+
+    def create_users(self, count):
+        rng = self.get_random('users')
+        password = make_password(self.password)
+        return self.create_objects(CustomUser, (
+            CustomUser(
+                username=f'{self.prefix}_{number}',
+                email=f'{self.prefix}_{number}@example.com',
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                password=password
+            ) for number in range(count)
+        ))
+
+    # Рецепты: авторы (по рангам authors), теги и ингредиенты выбираются по
+    # степенному распределению. Вернет id рецептов
+    def create_recipes(self, count, user_ids, authors, images, skew):
+        rng = self.get_random('recipes')
+        tags = list(Tag.objects.order_by('pk').values_list('pk', flat=True))
+        ingredients = list(
+            Ingredient.objects.order_by('pk').values_list('pk', 'name')
+        )
+        authors_weights = power_law(len(user_ids), skew)
+        tags_order = ranking(rng, len(tags))
+        tags_weights = power_law(len(tags), skew)
+        ingredients_order = ranking(rng, len(ingredients))
+        ingredients_weights = power_law(len(ingredients), skew)
+        recipe_tags = []
+        recipe_ingredients = []
+
+        def recipes():
+            for number in range(count):
+                chosen = distinct_choices(
+                    rng,
+                    ingredients_order,
+                    ingredients_weights,
+                    min(round(rng.triangular(3, 15, 7)), len(ingredients))
+                )
+                rng.shuffle(chosen)
+                names = [ingredients[index][1].lower() for index in chosen]
+                recipe_ingredients.append([
+                    (ingredients[index][0], rng.choice(AMOUNTS))
+                    for index in chosen
+                ])
+                recipe_tags.append([
+                    tags[index] for index in distinct_choices(
+                        rng,
+                        tags_order,
+                        tags_weights,
+                        min(rng.choices((1, 2, 3), (5, 3, 1))[0], len(tags))
+                    )
+                ])
+                yield Recipe(
+                    name=f'{rng.choice(DISHES)}: {names[0]}'[:200],
+                    text=' '.join(
+                        step.format(', '.join(names[index::len(STEPS)]))
+                        for index, step in enumerate(STEPS)
+                        if names[index::len(STEPS)]
+                    ),
+                    cooking_time=min(
+                        max(round(rng.lognormvariate(3.4, 0.6)), 1),
+                        600
+                    ),
+                    author_id=user_ids[rng.choices(
+                        authors,
+                        cum_weights=authors_weights
+                    )[0]],
+                    image=images[number % len(images)]
+                )
+
+        recipe_ids = self.create_objects(Recipe, recipes())
+        self.insert_rows(
+            Recipe.tags.through,
+            ('recipe_id', 'tag_id'),
+            (
+                (recipe_id, tag_id)
+                for recipe_id, tag_ids in zip(recipe_ids, recipe_tags)
+                for tag_id in tag_ids
+            )
+        )
+        self.insert_rows(
+            RecipeIngredient,
+            ('recipe_id', 'ingredient_id', 'amount'),
+            (
+                (recipe_id, ingredient_id, amount)
+                for recipe_id, rows in zip(recipe_ids, recipe_ingredients)
+                for ingredient_id, amount in rows
+            )
+        )
+        return recipe_ids
+
+    # Связи пользователей с объектами (избранное, список покупок, подписки):
+    # общее количество total распределяется между пользователями по
+    # степенному распределению (немногие активные пользователи), объекты
+    # выбираются по популярности. Для подписок объекты - те же пользователи
+    # с рангами авторов authors, и на себя пользователь не подписывается
+    def create_relations(self, stage, model, field, total, user_ids,
+                         target_ids, skew, authors=None):
+        rng = self.get_random(stage)
+        self_related = authors is not None
+        users = ranking(rng, len(user_ids))
+        targets = authors or ranking(rng, len(target_ids))
+        targets_weights = power_law(len(target_ids), skew)
+        limit = max((len(target_ids) - self_related) // 2, 1)
+        counts = distribute(
+            rng,
+            users,
+            power_law(len(user_ids), skew),
+            total,
+            limit
+        )
+        rows = (
+            (user_ids[user], target_ids[target])
+            for user in sorted(counts)
+            for target in distinct_choices(
+                rng,
+                targets,
+                targets_weights,
+                counts[user],
+                exclude=user if self_related else None
+            )
+        )
+        return self.insert_rows(model, ('user_id', f'{field}_id'), rows)
+
+    # Варианты картинок строятся один раз для каждой заглушки и
+    # сохраняются во всех рецептах с этой заглушкой вместе с хешем заглушки
+    def build_placeholder_variants(self, images):
+        for name in images:
+            recipe = Recipe.objects.filter(image=name).first()
+            if recipe is None:
+                continue
+            build_variants(recipe)
+            recipe.refresh_from_db()
+            with recipe.image.open('rb') as file:
+                image_hash = get_image_hash(file.read())
+            Recipe.objects.filter(image=name).update(
+                image_thumbnail=recipe.image_thumbnail.name,
+                image_detail=recipe.image_detail.name,
+                image_hash=image_hash
+            )
+
+    def handle(self, *args, **options):
+        counts = ('users', 'recipes', 'favorites', 'carts', 'subscriptions')
+        if any(options[name] < 0 for name in counts):
+            raise CommandError('Количество не может быть отрицательным.')
+        if options['skew'] <= 0 or options['batch_size'] < 1:
+            raise CommandError(
+                'Показатель распределения и размер пачки должны быть больше '
+                'нуля.'
+            )
+        if options['recipes'] and not options['users']:
+            raise CommandError('Для рецептов нужны пользователи.')
+        if not Ingredient.objects.exists() or not Tag.objects.exists():
+            raise CommandError(
+                'Сначала загрузите ингредиенты и теги командой import_data.'
+            )
+        if CustomUser.objects.filter(
+            username__startswith=f'{options["prefix"]}_'
+        ).exists():
+            raise CommandError(
+                f'Пользователи с префиксом {options["prefix"]} уже есть, '
+                f'укажите другой префикс (--prefix).'
+            )
+        self.seed = options['seed']
+        self.prefix = options['prefix']
+        self.password = options['password']
+        self.batch_size = options['batch_size']
+        skew = options['skew']
+        images = self.create_placeholders()
+        with transaction.atomic():
+            start = perf_counter()
+            user_ids = self.create_users(options['users'])
+            self.report('Пользователи', len(user_ids), start)
+            # Популярные авторы: у них больше всего рецептов и подписчиков
+            authors = ranking(self.get_random('authors'), len(user_ids))
+            start = perf_counter()
+            recipe_ids = self.create_recipes(
+                options['recipes'],
+                user_ids,
+                authors,
+                images,
+                skew
+            )
+            self.report('Рецепты', len(recipe_ids), start)
+            relations = (
+                ('Избранное', 'favorites', Favorite, 'recipe', recipe_ids,
+                 None),
+                ('Списки покупок', 'carts', ShoppingCart, 'recipe',
+                 recipe_ids, None),
+                ('Подписки', 'subscriptions', Subscription, 'author',
+                 user_ids, authors)
+            )
+            for title, name, model, field, target_ids, ranks in relations:
+                start = perf_counter()
+                count = 0
+                if len(target_ids) > (ranks is not None):
+                    count = self.create_relations(
+                        name,
+                        model,
+                        field,
+                        options[name],
+                        user_ids,
+                        target_ids,
+                        skew,
+                        ranks
+                    )
+                self.report(title, count, start)
+        # Массовая загрузка не вызывает сигналы моделей, поэтому счетчики,
+        # суммы списков покупок, индекс поиска и варианты картинок
+        # обновляются после загрузки
+        start = perf_counter()
+        self.build_placeholder_variants(images)
+        for command in (
+            'reconcile_counters',
+            'rebuild_shopping_lists',
+            'rebuild_search_index'
+        ):
+            call_command(command, stdout=self.stdout)
+        bump_version(RECIPES_VERSION_KEY)
+        self.report('Пересчет', len(recipe_ids), start)
+        self.stdout.write(self.style.SUCCESS('Данные успешно созданы.'))
@@ -1,31 +1,192 @@
-from csv import reader
+from csv import reader, writer
+from itertools import islice
+from time import perf_counter
 
-from django.core.management.base import BaseCommand
+from api.cache import reference_data
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 from recipes.models import Ingredient, Tag
 
+# Количество строк CSV-файла, которые загружаются в БД за один запрос
+BATCH_SIZE = 1000
+
+
+class CopyStream:
+    """
+    Файловый объект для COPY FROM STDIN: отдает строки CSV из итератора по
+    мере чтения, не загружая файл в память целиком.
+    """
+
+    def __init__(self, rows):
+        self.lines = self.encode(rows)
+        self.buffer = b''
+
+    def encode(self, rows):
+        csv_writer = writer(self)
+        for row in rows:
+            yield csv_writer.writerow(row).encode()
+
+    # Для csv.writer: возвращает записанную строку
+    def write(self, value):
+        return value
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            self.buffer += line
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    readline = read
+
 
 class Command(BaseCommand):
-    help = 'Импорт данных из CSV-файлов в БД.'
+    help = (
+        'Импорт ингредиентов и тегов из CSV-файлов в БД. Файлы читаются '
+        'построчно и загружаются пачками (в PostgreSQL - через COPY). '
+        'Повторный импорт добавляет только новые записи.'
+    )
 
-    def handle(self, *args, **options):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ingredients',
+            default='data/ingredients.csv',
+            help='Путь к CSV-файлу ингредиентов (название, единица измерения).'
+        )
+        parser.add_argument(
+            '--tags',
+            default='data/tags.csv',
+            help='Путь к CSV-файлу тегов (название, цвет, slug).'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Количество строк в одной пачке.'
+        )
+
+    # Чтение строк CSV-файла. Строки с неверным количеством полей, пустыми
+    # или слишком длинными значениями пропускаются и считаются ошибками
+    def read_rows(self, path, model, fields, stats):
+        max_lengths = [
+            model._meta.get_field(field).max_length for field in fields
+        ]
         try:
-            with open('data/ingredients.csv', 'r', encoding='utf8') as file:
-                file_reader = reader(file)
-                for row in file_reader:
-                    Ingredient.objects.get_or_create(
-                        name=row[0],
-                        measurement_unit=row[1]
-                    )
-            with open('data/tags.csv', 'r', encoding='utf8') as file:
-                file_reader = reader(file)
-                for row in file_reader:
-                    Tag.objects.get_or_create(
-                        name=row[0],
-                        color=row[1],
-                        slug=row[2]
-                    )
-            self.stdout.write(self.style.SUCCESS(
-                'Данные успешно загружены в БД.')
+            with open(path, 'r', encoding='utf8', newline='') as file:
+                for row in reader(file):
+                    row = [value.strip() for value in row]
+                    if len(row) != len(fields) or not all(row) or any(
+                        len(value) > max_length
+                        for value, max_length in zip(row, max_lengths)
+                    ):
+                        stats['invalid'] += 1
+                        continue
+                    stats['read'] += 1
+                    yield row
+        except OSError as error:
+            raise CommandError(f'Не удалось прочитать файл {path}: {error}')
+
+    # Загрузка ингредиентов в PostgreSQL: COPY во временную таблицу и вставка
+    # новых записей одним запросом
+    def copy_ingredients(self, rows):
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE import_ingredient '
+                '(name varchar(200), measurement_unit varchar(200)) '
+                'ON COMMIT DROP'
+            )
+            cursor.copy_expert(
+                'COPY import_ingredient (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                CopyStream(rows)
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                f'SELECT DISTINCT name, measurement_unit '
+                f'FROM import_ingredient '
+                f'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+            return cursor.rowcount
+
+    # Загрузка ингредиентов пачками. Уже существующие ингредиенты
+    # пропускаются за счет ограничения уникальности (название, единица
+    # измерения)
+    def insert_ingredients(self, rows, batch_size):
+        before = Ingredient.objects.count()
+        while batch := list(islice(rows, batch_size)):
+            Ingredient.objects.bulk_create(
+                (
+                    Ingredient(name=name, measurement_unit=measurement_unit)
+                    for name, measurement_unit in batch
+                ),
+                ignore_conflicts=True
             )
-        except Exception as error:
-            raise Exception('Ошибка при импорте данных:', error)
+        return Ingredient.objects.count() - before
+
+    def import_ingredients(self, path, batch_size):
+        stats = {'read': 0, 'invalid': 0, 'updated': 0}
+        rows = self.read_rows(
+            path,
+            Ingredient,
+            ('name', 'measurement_unit'),
+            stats
+        )
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                stats['inserted'] = self.copy_ingredients(rows)
+            else:
+                stats['inserted'] = self.insert_ingredients(rows, batch_size)
+        return stats
+
+    # Загрузка тегов. Тег определяется по slug: новые теги добавляются,
+    # у существующих обновляются название и цвет
+    def import_tags(self, path, batch_size):
+        stats = {'read': 0, 'invalid': 0, 'inserted': 0, 'updated': 0}
+        rows = self.read_rows(path, Tag, ('name', 'color', 'slug'), stats)
+        with transaction.atomic():
+            while batch := list(islice(rows, batch_size)):
+                batch = {slug: (name, color) for name, color, slug in batch}
+                existing = Tag.objects.in_bulk(batch, field_name='slug')
+                changed = []
+                for slug, (name, color) in batch.items():
+                    tag = existing.get(slug)
+                    if tag and (tag.name, tag.color) != (name, color):
+                        tag.name, tag.color = name, color
+                        changed.append(tag)
+                Tag.objects.bulk_update(changed, ('name', 'color'))
+                Tag.objects.bulk_create(
+                    Tag(name=name, color=color, slug=slug)
+                    for slug, (name, color) in batch.items()
+                    if slug not in existing
+                )
+                stats['updated'] += len(changed)
+                stats['inserted'] += len(batch) - len(existing)
+        return stats
+
+    def report(self, title, stats, seconds):
+        skipped = stats['read'] - stats['inserted'] - stats['updated']
+        self.stdout.write(
+            f'{title}: прочитано {stats["read"]}, добавлено '
+            f'{stats["inserted"]}, обновлено {stats["updated"]}, пропущено '
+            f'{skipped}, с ошибками {stats["invalid"]} за {seconds:.2f} с.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        start = perf_counter()
+        stats = self.import_ingredients(options['ingredients'], batch_size)
+        self.report('Ингредиенты', stats, perf_counter() - start)
+        start = perf_counter()
+        stats = self.import_tags(options['tags'], batch_size)
+        self.report('Теги', stats, perf_counter() - start)
+        # Массовая загрузка не вызывает сигналы моделей, поэтому версия кэша
+        # справочников меняется один раз после загрузки
+        reference_data.bump_version()
+        self.stdout.write(self.style.SUCCESS(
+            'Данные успешно загружены в БД.')
+        )
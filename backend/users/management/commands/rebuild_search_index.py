@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.fulltext import update_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        'Перестроение индекса полнотекстового поиска рецептов (название, '
+        'описание и ингредиенты).'
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            update_search_index()
+        self.stdout.write(self.style.SUCCESS(
+            'Индекс поиска рецептов перестроен.'
+        ))
@@ -0,0 +1,104 @@
+from itertools import islice
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+from recipes.models import RecipeIngredient, ShoppingListItem
+
+# Размер пачки строк при выборке и вставке сумм
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчет сумм ингредиентов в списках покупок (ShoppingListItem) по '
+        'рецептам в корзинах пользователей. С параметром --verify суммы '
+        'только проверяются. Пересчет лучше выполнять без нагрузки: изменения '
+        'корзин во время пересчета могут быть потеряны.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только проверить суммы, не изменяя их.'
+        )
+
+    # Ожидаемые суммы: (пользователь, ингредиент, количество), по порядку
+    def expected(self):
+        return RecipeIngredient.objects.filter(
+            recipe__shoppingcart__isnull=False
+        ).values(
+            'recipe__shoppingcart__user_id',
+            'ingredient_id'
+        ).annotate(
+            amount_sum=Sum('amount')
+        ).order_by(
+            'recipe__shoppingcart__user_id',
+            'ingredient_id'
+        ).values_list(
+            'recipe__shoppingcart__user_id',
+            'ingredient_id',
+            'amount_sum'
+        ).iterator(chunk_size=BATCH_SIZE)
+
+    # Сохраненные суммы в том же порядке
+    def actual(self):
+        return ShoppingListItem.objects.order_by(
+            'user_id',
+            'ingredient_id'
+        ).values_list(
+            'user_id',
+            'ingredient_id',
+            'amount'
+        ).iterator(chunk_size=BATCH_SIZE)
+
+    # Сравнение сумм слиянием двух упорядоченных выборок. Возвращает
+    # количество отсутствующих, лишних и неверных сумм
+    def verify(self):
+        missing = extra = wrong = 0
+        expected, actual = self.expected(), self.actual()
+        left, right = next(expected, None), next(actual, None)
+        while left is not None or right is not None:
+            if right is None or (left is not None and left[:2] < right[:2]):
+                missing += 1
+                left = next(expected, None)
+            elif left is None or right[:2] < left[:2]:
+                extra += 1
+                right = next(actual, None)
+            else:
+                wrong += left[2] != right[2]
+                left, right = next(expected, None), next(actual, None)
+        return missing, extra, wrong
+
+    # Полный пересчет сумм в одной транзакции
+    def rebuild(self):
+        with transaction.atomic():
+            ShoppingListItem.objects.all().delete()
+            rows = self.expected()
+            while batch := list(islice(rows, BATCH_SIZE)):
+                ShoppingListItem.objects.bulk_create(
+                    ShoppingListItem(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        amount=amount
+                    ) for user_id, ingredient_id, amount in batch
+                )
+
+    def handle(self, *args, **options):
+        if not options['verify']:
+            start = perf_counter()
+            self.rebuild()
+            self.stdout.write(
+                f'Суммы пересчитаны за {perf_counter() - start:.2f} с.'
+            )
+        missing, extra, wrong = self.verify()
+        if missing or extra or wrong:
+            raise CommandError(
+                f'Суммы не совпадают: отсутствует {missing}, лишних {extra}, '
+                f'неверных {wrong}.'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Суммы совпадают, записей: {ShoppingListItem.objects.count()}.'
+        ))
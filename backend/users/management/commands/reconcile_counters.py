@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import CustomUser
+
+# Счетчики: модель и поле счетчика, модель и поле связи с объектом счетчика
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'shopping_cart_count', ShoppingCart, 'recipe'),
+    (CustomUser, 'recipes_count', Recipe, 'author')
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверка счетчиков (число добавлений рецепта в избранное и в список '
+        'покупок, количество рецептов автора) с данными и исправление '
+        'расхождений.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать расхождения, не исправляя их.'
+        )
+
+    # Фактическое значение счетчика: количество связанных записей
+    def actual(self, related_model, related_field):
+        return Coalesce(Subquery(
+            related_model.objects.filter(
+                **{related_field: OuterRef('pk')}
+            ).order_by().values(
+                related_field
+            ).annotate(
+                count=Count('pk')
+            ).values('count')
+        ), 0)
+
+    def handle(self, *args, **options):
+        for model, field, related_model, related_field in COUNTERS:
+            with transaction.atomic():
+                actual = self.actual(related_model, related_field)
+                pks = list(model.objects.annotate(
+                    actual=actual
+                ).exclude(
+                    **{field: F('actual')}
+                ).values_list('pk', flat=True))
+                if pks and not options['dry_run']:
+                    model.objects.filter(pk__in=pks).update(**{field: actual})
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}, {field}: '
+                f'расхождений {len(pks)}'
+            )
+        self.stdout.write(self.style.SUCCESS('Сверка счетчиков завершена.'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from recipes.models import Favorite, ShoppingCart
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаление повторяющихся записей избранного и списка покупок (один '
+        'пользователь и один рецепт). Выполняется перед миграцией, которая '
+        'добавляет ограничения уникальности.'
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic(), connection.cursor() as cursor:
+            for model in (Favorite, ShoppingCart):
+                table = connection.ops.quote_name(model._meta.db_table)
+                cursor.execute(
+                    f'DELETE FROM {table} WHERE id NOT IN ('
+                    f'SELECT MIN(id) FROM {table} GROUP BY user_id, recipe_id)'
+                )
+                self.stdout.write(
+                    f'{model._meta.verbose_name_plural}: удалено '
+                    f'{cursor.rowcount}'
+                )
+        self.stdout.write(self.style.SUCCESS(
+            'Повторяющиеся записи удалены. После миграции выполните команды '
+            'reconcile_counters и rebuild_shopping_lists.'
+        ))
@@ -13,6 +13,11 @@ class CustomUser(AbstractUser):
         unique=True,
         blank=False
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Количество рецептов',
+        default=0,
+        editable=False
+    )
 
     # Поле, которое будет использоваться как уникальный идентификатор при
     # авторизации пользователя